@@ -0,0 +1,294 @@
+"""
+    benchmarks of the graph algorithms on synthetic graphs, from about 10^2 to 10^6 edges
+
+three families of graphs are generated, all with coordinates around the campus and weights in seconds like
+graph_output.json:
+    - grid: a square lattice of streets
+    - geometric: random points joined to every other point closer than a fixed radius
+    - campus: random points joined to their nearest neighbours, like generate_graph_json.py does for buildings
+
+every operation is timed (the best of a few runs) and run once more under tracemalloc for its memory peak, and the
+results are written as json, for example:
+    python benchmark.py --max-edges 100000 --output benchmark_results.json
+"""
+from __future__ import annotations
+from typing import Any, Callable, Optional
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from pj2_graph import EARTH_RADIUS, Graph
+from json_to_class import load_graph_from_json, stream_graph_from_json
+
+# the graph families, and the edge counts benchmarked by default
+FAMILIES = ('grid', 'geometric', 'campus')
+EDGE_COUNTS = (10 ** 2, 10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6)
+
+# centre of the generated graphs (the campus), typical distance in metres between neighbouring buildings, and the
+# walking and driving speeds in metres per second
+CENTRE = (43.6629, -79.3957)
+SPACING = 80.0
+WALKING_SPEED = 1.4
+DRIVING_SPEED = 8.0
+
+# number of destinations of every greedy_dijkstra and generate_complete_graph run
+TARGET_COUNT = 10
+
+# a synthetic graph: (latitude, longitude) of every vertex, and (index1, index2, weight, mode) of every edge
+SyntheticGraph = tuple[list[tuple[float, float]], list[tuple[int, int, int, str]]]
+
+
+def grid_graph(edges: int, seed: int = 0) -> SyntheticGraph:
+    """
+    return a square lattice with about the given number of edges, weights vary by up to 20% per street
+    >>> coordinates, edge_list = grid_graph(100)
+    >>> len(coordinates), len(edge_list)
+    (49, 84)
+    """
+    rng = random.Random(seed)
+    side = max(2, round(math.sqrt(edges / 2)))
+    coordinates = [_position(SPACING * (k % side), SPACING * (k // side)) for k in range(side * side)]
+    edge_list = []
+    for k in range(side * side):
+        if k % side < side - 1:
+            edge_list.append((k, k + 1, _walk(SPACING * rng.uniform(0.9, 1.1)), 'walking'))
+        if k // side < side - 1:
+            edge_list.append((k, k + side, _walk(SPACING * rng.uniform(0.9, 1.1)), 'walking'))
+    return coordinates, edge_list
+
+
+def geometric_graph(edges: int, seed: int = 0) -> SyntheticGraph:
+    """
+    return a random geometric graph with about the given number of edges: random points with an average of 8
+    neighbours, each joined to every point closer than a fixed radius
+    >>> coordinates, edge_list = geometric_graph(1000)
+    >>> len(coordinates), 800 < len(edge_list) < 1200
+    (250, True)
+    """
+    rng = random.Random(seed)
+    n = max(2, edges // 4)
+    side = SPACING * math.sqrt(n)
+    radius = side * math.sqrt(8 / (math.pi * n))
+    points = [(rng.uniform(0, side), rng.uniform(0, side)) for _ in range(n)]
+    cells = _cells(points, radius)
+    edge_list = []
+    for i, (x, y) in enumerate(points):
+        for j in _nearby(cells, x, y, radius, 1):
+            if j > i:
+                length = math.dist(points[i], points[j])
+                if length <= radius:
+                    edge_list.append((i, j, _walk(length), 'walking'))
+    return [_position(x, y) for x, y in points], edge_list
+
+
+def campus_graph(edges: int, seed: int = 0) -> SyntheticGraph:
+    """
+    return a graph like graph_output.json with about the given number of edges: random points, each joined to its
+    6 nearest neighbours, with one in 20 points also joined by road to a point a few blocks away
+    >>> coordinates, edge_list = campus_graph(1000)
+    >>> 900 < len(edge_list) < 1100
+    True
+    """
+    rng = random.Random(seed)
+    n = max(8, round(edges / 3.6))
+    side = SPACING * math.sqrt(n)
+    points = [(rng.uniform(0, side), rng.uniform(0, side)) for _ in range(n)]
+    cells = _cells(points, SPACING)
+    pairs = {}
+    for i, (x, y) in enumerate(points):
+        rings = 1
+        while True:
+            candidates = [j for j in _nearby(cells, x, y, SPACING, rings) if j != i]
+            # every point within rings cells is a candidate, so the 6 nearest are final once they are that close
+            candidates.sort(key=lambda j: math.dist(points[i], points[j]))
+            if len(candidates) >= n - 1 or (len(candidates) >= 6
+                                            and math.dist(points[i], points[candidates[5]]) <= rings * SPACING):
+                break
+            rings += 1
+        for j in candidates[:6]:
+            pairs[min(i, j), max(i, j)] = (_walk(math.dist(points[i], points[j])), 'walking')
+        if rng.random() < 0.05:
+            j = rng.randrange(n)
+            if j != i:
+                duration = round(math.dist(points[i], points[j]) / DRIVING_SPEED) + 60
+                pairs[min(i, j), max(i, j)] = (duration, 'driving')
+    edge_list = [(i, j, weight, mode) for (i, j), (weight, mode) in pairs.items()]
+    return [_position(x, y) for x, y in points], edge_list
+
+
+GENERATORS = {'grid': grid_graph, 'geometric': geometric_graph, 'campus': campus_graph}
+
+
+def build_graph(synthetic: SyntheticGraph, tree_cache_bytes: int = 0) -> Graph:
+    """
+    return the Graph of a synthetic graph, whose vertices are named 'v0', 'v1', ...
+    the shortest path tree cache is disabled by default, so repeated runs measure the searches themselves
+    """
+    coordinates, edge_list = synthetic
+    graph = Graph(tree_cache_bytes)
+    for k, position in enumerate(coordinates):
+        graph.add_vertex(f'v{k}', position)
+    for i, j, weight, mode in edge_list:
+        graph.add_edge(f'v{i}', f'v{j}', weight, mode=mode)
+    return graph
+
+
+def write_json(synthetic: SyntheticGraph, json_path: str) -> None:
+    """Write a synthetic graph to json_path in the format of graph_output.json, every edge under both ends."""
+    coordinates, edge_list = synthetic
+    edges_of = [[] for _ in coordinates]
+    for i, j, weight, mode in edge_list:
+        edges_of[i].append({"neighbor": f'v{j}', "duration": weight, "mode": mode})
+        edges_of[j].append({"neighbor": f'v{i}', "duration": weight, "mode": mode})
+    nodes = [{"name": f'v{k}', "lat": lat, "lng": lng, "edges": edges_of[k]}
+             for k, (lat, lng) in enumerate(coordinates)]
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump({"nodes": nodes}, f, indent=4)
+
+
+def measure(prepare: Callable[[], Callable[[], Any]], repeat: int) -> dict[str, float]:
+    """
+    return the best time in seconds of repeat runs, and the peak of memory allocated by one more run in bytes
+    prepare is called (untimed) before every run and returns the run itself, so a run never reuses the caches
+    filled by the one before
+    """
+    times = []
+    for _ in range(repeat):
+        run = prepare()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    run = prepare()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': min(times), 'peak_bytes': peak}
+
+
+def benchmark_graph(family: str, edges: int, repeat: int = 3, seed: int = 0) -> list[dict]:
+    """
+    return the results of every operation on the graph of family with about the given number of edges
+    >>> results = benchmark_graph('grid', 100, repeat=1)
+    >>> [result['operation'] for result in results]  # doctest: +NORMALIZE_WHITESPACE
+    ['load_graph_from_json', 'stream_graph_from_json', 'freeze', 'dijkstra', 'compact_dijkstra',
+     'greedy_dijkstra', 'generate_complete_graph', 'in_cycle']
+    >>> all(result['seconds'] >= 0 and result['peak_bytes'] > 0 for result in results)
+    True
+    """
+    synthetic = GENERATORS[family](edges, seed)
+    graph = build_graph(synthetic)
+    rng = random.Random(seed)
+    start = 'v0'
+    component = sorted(graph.get_connected_component(start), key=lambda item: int(item[1:]))
+    targets = [start] + rng.sample(component, min(TARGET_COUNT, len(component)))
+
+    def fresh(query: Callable[[Graph], Any]) -> Callable[[], Callable[[], Any]]:
+        """Return a prepare function that runs query on a newly built graph, for queries that cache results."""
+        def prepare() -> Callable[[], Any]:
+            """Build the graph and return the run of query on it."""
+            new_graph = build_graph(synthetic)
+            return lambda: query(new_graph)
+        return prepare
+
+    compact = graph.freeze()
+    operations = {
+        'freeze': fresh(lambda g: g.freeze()),
+        'dijkstra': lambda: lambda: graph.dijkstra(start),
+        'compact_dijkstra': lambda: lambda: compact.dijkstra(start),
+        'greedy_dijkstra': lambda: lambda: graph.greedy_dijkstra(start, targets),
+        'generate_complete_graph': lambda: lambda: graph.generate_complete_graph(targets),
+        'in_cycle': fresh(lambda g: g.in_cycle(start)),
+    }
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, 'graph.json')
+        write_json(synthetic, json_path)
+        for name, load in (('load_graph_from_json', load_graph_from_json),
+                           ('stream_graph_from_json', stream_graph_from_json)):
+            results.append(_result(family, synthetic, name, measure(lambda: lambda: load(json_path), repeat)))
+    for name, prepare in operations.items():
+        results.append(_result(family, synthetic, name, measure(prepare, repeat)))
+    return results
+
+
+def run_benchmarks(families: tuple[str, ...] = FAMILIES, edge_counts: tuple[int, ...] = EDGE_COUNTS,
+                   repeat: int = 3, seed: int = 0,
+                   progress: Optional[Callable[[dict], None]] = None) -> dict[str, Any]:
+    """Return the results of every operation on every family at every edge count, with the environment."""
+    results = []
+    for edges in edge_counts:
+        for family in families:
+            for result in benchmark_graph(family, edges, repeat, seed):
+                results.append(result)
+                if progress is not None:
+                    progress(result)
+    return {'environment': {'python': sys.version.split()[0], 'implementation': platform.python_implementation(),
+                            'platform': platform.platform(), 'time': datetime.datetime.now().isoformat(),
+                            'repeat': repeat, 'seed': seed},
+            'results': results}
+
+
+def _result(family: str, synthetic: SyntheticGraph, operation: str, measured: dict[str, float]) -> dict:
+    """Return one row of results."""
+    return {'family': family, 'vertices': len(synthetic[0]), 'edges': len(synthetic[1]), 'operation': operation,
+            **measured}
+
+
+def _position(x: float, y: float) -> tuple[float, float]:
+    """Return the (latitude, longitude) of the point x metres east and y metres north of the south-west corner."""
+    lat = CENTRE[0] + math.degrees(y / EARTH_RADIUS)
+    lng = CENTRE[1] + math.degrees(x / (EARTH_RADIUS * math.cos(math.radians(CENTRE[0]))))
+    return lat, lng
+
+
+def _walk(metres: float) -> int:
+    """Return the walking time in whole seconds of metres, at least 1."""
+    return max(1, round(metres / WALKING_SPEED))
+
+
+def _cells(points: list[tuple[float, float]], size: float) -> dict[tuple[int, int], list[int]]:
+    """Return the indices of points bucketed by the square cell of the given size they fall in."""
+    cells = {}
+    for i, (x, y) in enumerate(points):
+        cells.setdefault((int(x // size), int(y // size)), []).append(i)
+    return cells
+
+
+def _nearby(cells: dict[tuple[int, int], list[int]], x: float, y: float, size: float, rings: int) -> list[int]:
+    """Return the indices in the cells at most rings cells away from the cell of (x, y)."""
+    cx, cy = int(x // size), int(y // size)
+    found = []
+    for gx in range(cx - rings, cx + rings + 1):
+        for gy in range(cy - rings, cy + rings + 1):
+            found.extend(cells.get((gx, gy), ()))
+    return found
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the graph algorithms on synthetic graphs.")
+    parser.add_argument('--families', nargs='+', choices=FAMILIES, default=list(FAMILIES))
+    parser.add_argument('--max-edges', type=int, default=10 ** 5,
+                        help="largest edge count to benchmark, up to 1000000 (default 100000)")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs of every operation (default 3)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    arguments = parser.parse_args()
+
+    report = run_benchmarks(tuple(arguments.families), tuple(m for m in EDGE_COUNTS if m <= arguments.max_edges),
+                            arguments.repeat, arguments.seed,
+                            lambda row: print(f"{row['family']:>9} {row['edges']:>8} edges  {row['operation']:<24}"
+                                              f"{row['seconds'] * 1000:>10.2f} ms {row['peak_bytes'] / 1024:>10.0f} KiB"))
+    with open(arguments.output, 'w', encoding='utf-8') as output:
+        json.dump(report, output, indent=4)
+    print(f"wrote {len(report['results'])} results to {arguments.output}")
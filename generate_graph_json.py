@@ -1,20 +1,63 @@
+import argparse
 import csv
 import json
 import time
 import os
 import math
-import googlemaps
+import hashlib
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from pj2_files import atomic_write
+from pj2_graph_snapshot import compile_snapshot
+from pj2_spatial_index import SpatialIndex
 
 
 API_KEY = "YOUR KEY"
-gmaps = googlemaps.Client(key=API_KEY)
 
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# every Distance Matrix response is kept here, so an interrupted run resumes without asking Google again
+RESPONSE_CACHE_DIR = os.path.join(CURRENT_DIR, ".distance_matrix_cache")
+
+# the coordinates of every address geocoded so far, so a rebuild only geocodes new addresses
+GEOCODE_CACHE_PATH = os.path.join(CURRENT_DIR, "geocode_cache.json")
+
+# Geocoding requests started per second, and new addresses geocoded between two saves of the geocode cache
+GEOCODE_RATE = 10.0
+GEOCODE_SAVE_EVERY = 20
+
+# Distance Matrix requests in flight at a time, requests started per second (at most 100 elements each, well
+# below the 1000 elements per second allowed by Google), and attempts of every request before giving up
+FETCH_WORKERS = 8
+FETCH_RATE = 10.0
+FETCH_ATTEMPTS = 4
+
+# every building is joined to the buildings within NEIGHBOR_RADIUS metres of walking, or to its NEIGHBOR_COUNT
+# nearest ones if there are fewer; only its CANDIDATE_NEIGHBORS nearest buildings in a straight line and those
+# within CANDIDATE_RADIUS metres of it are asked for, instead of the full matrix (on buildings.csv, these margins
+# keep every edge the full matrix gave, with 7 times fewer elements)
+NEIGHBOR_RADIUS = 150
+NEIGHBOR_COUNT = 5
+CANDIDATE_NEIGHBORS = 15
+CANDIDATE_RADIUS = 250
+
+
+def make_client(api_key):
+    """
+    Create a Google Maps client; googlemaps is only needed when the API is actually called.
+    """
+    import googlemaps
+    return googlemaps.Client(key=api_key)
 
-def get_geocode(address):
+
+def get_geocode(address, client):
     """
     Get latitude and longitude for a given address using the Geocoding API.
     """
-    results = gmaps.geocode(address)
+    results = client.geocode(address)
     if results:
         location = results[0]["geometry"]["location"]
         return location["lat"], location["lng"]
@@ -23,52 +66,409 @@ def get_geocode(address):
         return None, None
 
 
-def batch_distance_matrix(origins, destinations, mode="walking", max_elements=100):
+class GeocodeCache:
+    """A persistent store of address to (lat, lng), kept in a json file.
+
+    Addresses are compared with their whitespace collapsed and case ignored. Addresses that Google could not
+    geocode are stored too (as None), so they are not asked for again either.
+
+    >>> import os, tempfile
+    >>> class FakeClient:
+    ...     '''Stands in for googlemaps.Client: every address is found, at (its length, 0).'''
+    ...     def __init__(self):
+    ...         self.calls = 0
+    ...     def geocode(self, address):
+    ...         self.calls += 1
+    ...         return [{"geometry": {"location": {"lat": len(address), "lng": 0}}}]
+    >>> path = os.path.join(tempfile.mkdtemp(), 'geocode_cache.json')
+    >>> client = FakeClient()
+    >>> GeocodeCache(path).lookup(['Robarts Library', 'Hart House'], client, rate=1000)
+    {'Robarts Library': (15, 0), 'Hart House': (10, 0)}
+    >>> GeocodeCache(path).lookup(['robarts  library', 'Bahen Centre'], client, rate=1000)
+    {'robarts  library': (15, 0), 'Bahen Centre': (12, 0)}
+    >>> client.calls
+    3
+    """
+    # Private Instance Attributes:
+    #     - _path: the json file holding the cache
+    #     - _entries: maps normalized address to [lat, lng], or None if the address was not found
+    _path: str
+    _entries: dict[str, Optional[list]]
+
+    def __init__(self, path: str) -> None:
+        """Initialize the cache stored at path, empty if there is no such file yet."""
+        self._path = path
+        try:
+            with open(path, encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            self._entries = {}
+
+    def __contains__(self, address: str) -> bool:
+        """Return whether address has been geocoded before."""
+        return _normalize_address(address) in self._entries
+
+    def get(self, address: str) -> Optional[tuple]:
+        """Return the stored (lat, lng) of address, None if it is not stored or was not found."""
+        entry = self._entries.get(_normalize_address(address))
+        return None if entry is None else (entry[0], entry[1])
+
+    def put(self, address: str, coordinates: Optional[tuple]) -> None:
+        """Store the (lat, lng) of address, or None if it was not found."""
+        self._entries[_normalize_address(address)] = None if coordinates is None else list(coordinates)
+
+    def save(self) -> None:
+        """Write the cache to its file, replacing the old file only once the new one is complete."""
+        with atomic_write(self._path) as f:
+            f.write(json.dumps(self._entries, indent=1, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+
+    def lookup(self, addresses: list, client: Any, rate: float = GEOCODE_RATE) -> dict:
+        """
+        Return a dict mapping every address to its (lat, lng), or None if it cannot be geocoded.
+        Only the addresses that are not stored yet are geocoded with client, at most rate per second, and the
+        cache is saved every GEOCODE_SAVE_EVERY of them, so an interrupted lookup keeps most of its work.
+        """
+        missing = [address for address in dict.fromkeys(addresses) if address not in self]
+        bucket = TokenBucket(rate)
+        for count, address in enumerate(missing, 1):
+            bucket.acquire()
+            lat, lng = get_geocode(address, client)
+            self.put(address, None if lat is None or lng is None else (lat, lng))
+            if count % GEOCODE_SAVE_EVERY == 0:
+                self.save()
+        if missing:
+            self.save()
+        return {address: self.get(address) for address in addresses}
+
+
+def _normalize_address(address: str) -> str:
+    """Return the key of address in a GeocodeCache."""
+    return " ".join(address.split()).casefold()
+
+
+class FetchError(Exception):
+    """Raised when some Distance Matrix requests still fail after every attempt.
+
+    The responses of the requests that succeeded are in the response cache, so running again only repeats the
+    failed ones.
+    """
+
+    def __init__(self, failures: list) -> None:
+        """Initialize an error for the given (request, exception) failures."""
+        super().__init__(failures)
+        self.failures = failures
+
+    def __str__(self) -> str:
+        """Return a string representation of this error."""
+        return f'{len(self.failures)} distance matrix requests failed, the first with: {self.failures[0][1]!r}'
+
+
+class TokenBucket:
+    """A thread-safe rate limiter: tokens are added at rate per second, up to capacity, and every request takes one.
+
+    >>> now = [0.0]
+    >>> def sleep(seconds: float) -> None:
+    ...     now[0] += seconds
+    >>> bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0], sleep=sleep)
+    >>> for _ in range(5):
+    ...     bucket.acquire()
+    >>> now[0]
+    1.5
+    """
+    # Private Instance Attributes:
+    #     - _rate: the number of tokens added per second
+    #     - _capacity: the largest number of tokens kept
+    #     - _tokens: the number of tokens at time _updated, negative if requests are waiting for them
+    #     - _updated: the time _tokens was last brought up to date
+    #     - _clock, _sleep: return the current time and wait for a number of seconds
+    #     - _lock: guards _tokens and _updated
+    _rate: float
+    _capacity: float
+    _tokens: float
+    _updated: float
+    _clock: Callable[[], float]
+    _sleep: Callable[[float], None]
+    _lock: threading.Lock
+
+    def __init__(self, rate: float, capacity: float = 1.0, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep) -> None:
+        """Initialize a full bucket."""
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Take a token, waiting until one is available; waiting requests are served in the order they came."""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            self._sleep(wait)
+
+
+class ResponseCache:
+    """Distance Matrix responses stored on disk, one json file per request, named by the hash of the request.
+
+    A response is written to a temporary file first and renamed into place, so an interrupted run never leaves a
+    partial response behind.
+    """
+    # Private Instance Attributes:
+    #     - _directory: the directory holding the responses, created when the first one is stored
+    _directory: str
+
+    def __init__(self, directory: str) -> None:
+        """Initialize a cache stored in directory."""
+        self._directory = directory
+
+    @staticmethod
+    def key(request: dict) -> str:
+        """Return the content address of a request: the sha256 of its canonical json."""
+        canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        """Return the response stored for key, None if there is none."""
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key: str, response: dict) -> None:
+        """Store the response for key."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(response, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def _path(self, key: str) -> str:
+        """Return the file of key, in a subdirectory named by its first two characters."""
+        return os.path.join(self._directory, key[:2], key + ".json")
+
+
+class DistanceMatrixFetcher:
+    """Sends Distance Matrix requests through a response cache, a rate limiter and retries.
+
+    Instance Attributes:
+        - client: the Google Maps client (or any object with the same distance_matrix method)
+        - cache: the responses received so far, None to always ask the client
+        - workers: the number of requests in flight at a time
+        - attempts: the number of times a request is sent before giving up
+        - backoff: the seconds to wait after the first failure of a request, doubled after every other one
+        - requests: the number of requests sent to the client so far
+    """
+    client: Any
+    cache: Optional[ResponseCache]
+    workers: int
+    attempts: int
+    backoff: float
+    requests: int
+    # Private Instance Attributes:
+    #     - _bucket: limits the rate of requests sent to the client
+    #     - _sleep: waits for a number of seconds
+    #     - _lock: guards requests
+    _bucket: TokenBucket
+    _sleep: Callable[[float], None]
+    _lock: threading.Lock
+
+    def __init__(self, client: Any, cache: Optional[ResponseCache] = None, workers: int = FETCH_WORKERS,
+                 rate: float = FETCH_RATE, attempts: int = FETCH_ATTEMPTS, backoff: float = 1.0,
+                 sleep: Callable[[float], None] = time.sleep) -> None:
+        """Initialize a fetcher sending at most rate requests per second to client."""
+        self.client = client
+        self.cache = cache
+        self.workers = workers
+        self.attempts = attempts
+        self.backoff = backoff
+        self.requests = 0
+        self._bucket = TokenBucket(rate, sleep=sleep)
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+    def fetch(self, origins: list, destinations: list, mode: str) -> dict:
+        """
+        Return the Distance Matrix response for the given origins, destinations and mode, from the cache if it
+        is there; otherwise the request is sent (up to attempts times) and its response is cached.
+        Raise the error of the last attempt if every attempt fails.
+        """
+        request = {"origins": list(origins), "destinations": list(destinations), "mode": mode}
+        key = ResponseCache.key(request)
+        if self.cache is not None:
+            response = self.cache.get(key)
+            if response is not None:
+                return response
+        for attempt in range(self.attempts):
+            self._bucket.acquire()
+            with self._lock:
+                self.requests += 1
+            try:
+                response = self.client.distance_matrix(**request)
+                if response.get("status", "OK") != "OK":
+                    raise RuntimeError(f"distance matrix status {response.get('status')}")
+                if len(response.get("rows", [])) != len(origins):
+                    raise RuntimeError("distance matrix response does not have a row for every origin")
+            except Exception:
+                if attempt == self.attempts - 1:
+                    raise
+                self._sleep(self.backoff * 2 ** attempt)
+            else:
+                if self.cache is not None:
+                    self.cache.put(key, response)
+                return response
+
+
+def batch_distance_matrix(fetcher, origins, destinations, mode="walking", max_elements=100):
     """
     Query the Distance Matrix API in batches so that each request contains at most
     max_elements (i.e. len(batch_origins) * len(batch_destinations) <= max_elements).
 
+    The batches are fetched concurrently by fetcher, which caches every response, so running again after an
+    interruption only sends the batches that were not received. If some batches still fail after every
+    attempt, the others are fetched (and cached) anyway and FetchError is raised at the end.
+
     Returns a dictionary where the keys are the origin strings (e.g. "lat,lng")
-    and the values are lists of tuples (destination, distance, duration).
+    and the values are lists of tuples (destination, distance, duration), in the same order as if the batches
+    were fetched one after another.
+
+    >>> import tempfile
+    >>> class FakeClient:
+    ...     '''Stands in for googlemaps.Client: points are numbers, 100 metres and 70 seconds apart.'''
+    ...     def __init__(self, failures=0):
+    ...         self.failures = failures
+    ...     def distance_matrix(self, origins, destinations, mode):
+    ...         if self.failures > 0:
+    ...             self.failures -= 1
+    ...             raise TimeoutError
+    ...         return {"status": "OK", "rows": [{"elements": [
+    ...             {"status": "OK", "distance": {"value": 100 * abs(int(o) - int(d))},
+    ...              "duration": {"value": 70 * abs(int(o) - int(d))}} for d in destinations]} for o in origins]}
+    >>> points = ['0', '1', '2', '3', '4']
+    >>> cache = ResponseCache(tempfile.mkdtemp())
+    >>> fetcher = DistanceMatrixFetcher(FakeClient(failures=2), cache, rate=1000, backoff=0)
+    >>> edges = batch_distance_matrix(fetcher, points, points, max_elements=4)
+    >>> edges['0']
+    [('1', 100, 70), ('2', 200, 140), ('3', 300, 210), ('4', 400, 280)]
+    >>> fetcher.requests  # 9 batches of at most 2 by 2 points, 2 of them sent twice
+    11
+    >>> resumed = DistanceMatrixFetcher(FakeClient(), cache, rate=1000)
+    >>> batch_distance_matrix(resumed, points, points, max_elements=4) == edges, resumed.requests
+    (True, 0)
     """
-    candidate_edges = {origin: [] for origin in origins}
     batch_size = int(math.floor(math.sqrt(max_elements)))
-    for i in range(0, len(origins), batch_size):
-        origin_batch = origins[i:i + batch_size]
-        for j in range(0, len(destinations), batch_size):
-            destination_batch = destinations[j:j + batch_size]
-            try:
-                matrix_result = gmaps.distance_matrix(
-                    origins=origin_batch,
-                    destinations=destination_batch,
-                    mode=mode
-                )
-            except Exception as e:
-                print(f"Error with batch request: {e}")
-                continue
-
-            for i_idx, origin in enumerate(origin_batch):
-                row = matrix_result.get("rows", [])[i_idx]
-                elements = row.get("elements", [])
-                for j_idx, element in enumerate(elements):
-                    dest = destination_batch[j_idx]
-                    if origin == dest:
-                        continue
-                    if element.get("status") != "OK":
-                        continue
-                    distance = element["distance"]["value"]  # in meters
-                    duration = element["duration"]["value"]  # in seconds
-                    candidate_edges[origin].append((dest, distance, duration))
-            time.sleep(0.1)
+    batches = [(origins[i:i + batch_size], destinations[j:j + batch_size])
+               for i in range(0, len(origins), batch_size)
+               for j in range(0, len(destinations), batch_size)]
+    return _fetch_batches(fetcher, batches, origins, mode)
+
+
+def candidate_destinations(coordinates, k=CANDIDATE_NEIGHBORS, radius=CANDIDATE_RADIUS):
+    """
+    Return a dictionary mapping every key of coordinates (a dictionary of point to (lat, lng)) to the points
+    that may be among its walking neighbours: every point within radius metres in a straight line, and its
+    k nearest points in a straight line. A walk is rarely much shorter than the straight line (Google snaps both
+    ends to the nearest path), so with margins above NEIGHBOR_RADIUS and NEIGHBOR_COUNT these include the
+    neighbours chosen from the full matrix unless walks are unusually roundabout.
+    The destinations of every point are in the order of coordinates.
+
+    >>> points = {'A': (43.6600, -79.3950), 'B': (43.6605, -79.3950), 'C': (43.6620, -79.3950),
+    ...           'D': (43.6700, -79.3950)}
+    >>> candidate_destinations(points, k=1, radius=100)
+    {'A': ['B'], 'B': ['A'], 'C': ['B'], 'D': ['C']}
+    """
+    index = SpatialIndex(coordinates)
+    order = {point: position for position, point in enumerate(coordinates)}
+    candidates = {}
+    for point, (lat, lng) in coordinates.items():
+        found = {other for other, _ in index.near(lat, lng, radius) if other != point}
+        found.update(other for other, _ in index.nearest(lat, lng, k, exclude=[point]))
+        candidates[point] = sorted(found, key=order.get)
+    return candidates
+
+
+def sparse_distance_matrix(fetcher, candidates, mode="walking", max_elements=100, max_destinations=25):
+    """
+    Query the Distance Matrix API for the given pairs only: candidates maps every origin to its destinations.
+    Every request has one origin and at most max_destinations (and max_elements) of its destinations, so the
+    number of elements is the number of pairs instead of the square of the number of origins.
+
+    Returns the same dictionary as batch_distance_matrix, for the origins of candidates.
+
+    >>> class FakeClient:
+    ...     # stands in for googlemaps.Client: points are numbers, 100 metres and 70 seconds apart
+    ...     elements = 0
+    ...     def distance_matrix(self, origins, destinations, mode):
+    ...         self.elements += len(origins) * len(destinations)
+    ...         return {"status": "OK", "rows": [{"elements": [
+    ...             {"status": "OK", "distance": {"value": 100 * abs(int(o) - int(d))},
+    ...              "duration": {"value": 70 * abs(int(o) - int(d))}} for d in destinations]} for o in origins]}
+    >>> client = FakeClient()
+    >>> sparse_distance_matrix(DistanceMatrixFetcher(client, rate=1000), {'1': ['0', '2'], '5': ['4']})
+    {'1': [('0', 100, 70), ('2', 100, 70)], '5': [('4', 100, 70)]}
+    >>> client.elements
+    3
+    """
+    chunk = max(1, min(max_destinations, max_elements))
+    batches = [([origin], destinations[j:j + chunk])
+               for origin, destinations in candidates.items()
+               for j in range(0, len(destinations), chunk)]
+    return _fetch_batches(fetcher, batches, list(candidates), mode)
+
+
+def _fetch_batches(fetcher, batches, origins, mode):
+    """
+    Fetch the (origin_batch, destination_batch) requests concurrently, and return a dictionary mapping every
+    origin to a list of (destination, distance, duration), in the order of the batches; raise FetchError at
+    the end if some of them failed.
+    """
+    with ThreadPoolExecutor(max_workers=fetcher.workers) as executor:
+        futures = [executor.submit(fetcher.fetch, origin_batch, destination_batch, mode)
+                   for origin_batch, destination_batch in batches]
+
+    candidate_edges = {origin: [] for origin in origins}
+    failures = []
+    for (origin_batch, destination_batch), future in zip(batches, futures):
+        error = future.exception()
+        if error is not None:
+            failures.append(((origin_batch, destination_batch), error))
+            continue
+        matrix_result = future.result()
+        for i_idx, origin in enumerate(origin_batch):
+            row = matrix_result.get("rows", [])[i_idx]
+            elements = row.get("elements", [])
+            for j_idx, element in enumerate(elements):
+                dest = destination_batch[j_idx]
+                if origin == dest:
+                    continue
+                if element.get("status") != "OK":
+                    continue
+                distance = element["distance"]["value"]  # in meters
+                duration = element["duration"]["value"]  # in seconds
+                candidate_edges[origin].append((dest, distance, duration))
+    if failures:
+        raise FetchError(failures)
     return candidate_edges
 
 
-buildings = []
-with open("buildings.csv", newline="") as csvfile:
-    reader = csv.reader(csvfile)
-    for row in reader:
-        if row:
-            buildings.append(row[0].strip())
+def read_buildings(csv_path):
+    """
+    Return the building addresses listed in the first column of csv_path.
+    """
+    buildings = []
+    with open(csv_path, newline="") as csvfile:
+        reader = csv.reader(csvfile)
+        for row in reader:
+            if row:
+                buildings.append(row[0].strip())
+    return buildings
 
 
 special_building = "Keep@Downsview, Toronto, ON, Canada"
@@ -81,101 +481,247 @@ special_neighbors = [
 ]
 
 
-nodes = {}
-ordered_buildings = []
-ordered_coords = []
-
-for b in buildings:
-    lat, lng = get_geocode(b)
-    if lat is None or lng is None:
-        continue
-    nodes[b] = {"name": b, "lat": lat, "lng": lng, "edges": []}
-    ordered_buildings.append(b)
-    ordered_coords.append(f"{lat},{lng}")
-
-
-coord_to_building = {coord: b for b, coord in zip(ordered_buildings, ordered_coords)}
-
-
-candidate_edges_by_coord = batch_distance_matrix(
-    origins=ordered_coords,
-    destinations=ordered_coords,
-    mode="walking",
-    max_elements=100
-)
-
-####################################################################################################################
-# Convert the candidate edges so that keys are building names rather than coordinate strings.
-candidate_edges = {b: [] for b in ordered_buildings}
-for origin_coord, edges in candidate_edges_by_coord.items():
-    origin_building = coord_to_building.get(origin_coord)
-    if not origin_building:
-        continue
-    for dest_coord, distance, duration in edges:
-        dest_building = coord_to_building.get(dest_coord)
-        if dest_building:
-            candidate_edges[origin_building].append((dest_building, distance, duration))
-
-for building, candidates in candidate_edges.items():
-    if building == special_building:
-        continue
-    within_150 = [c for c in candidates if c[1] <= 150]
-    if len(within_150) >= 5:
-        selected = within_150
-    else:
-        selected = within_150.copy()
-        candidates_sorted = sorted(candidates, key=lambda x: x[1])
-        for cand in candidates_sorted:
-            if cand not in selected:
-                selected.append(cand)
-            if len(selected) >= 5:
-                break
-    for dest, dist, dur in selected:
-        edge = {"neighbor": dest, "distance": dist, "duration": dur, "mode": "walking"}
-        nodes[building]["edges"].append(edge)
-
-if special_building in nodes:
-    nodes[special_building]["edges"] = []
-    origin_coord = f"{nodes[special_building]['lat']},{nodes[special_building]['lng']}"
+def build_graph(buildings, client, fetcher, geocodes):
+    """
+    Geocode the buildings and join each to its nearest neighbours by walking time (and the special building to
+    its neighbours by driving time), returning the graph in the format of graph_output.json.
+    Only the addresses missing from the geocodes cache are geocoded.
+    """
+    coordinates = geocodes.lookup(buildings + special_neighbors, client)
+    positions = {b: tuple(coordinates[b]) for b in buildings if coordinates[b] is not None}
+    nodes = {b: {"name": b, "lat": lat, "lng": lng, "edges": []} for b, (lat, lng) in positions.items()}
+
+    for building, edges in walking_edges(fetcher, positions, list(positions)).items():
+        nodes[building]["edges"] = edges
+    if special_building in nodes:
+        try:
+            nodes[special_building]["edges"] = driving_edges(fetcher, coordinates)
+        except FetchError as e:
+            print(f"Error with special building request: {e}")
+
+    return {"nodes": list(nodes.values())}
+
+
+def update_graph(graph, buildings, client, fetcher, geocodes):
+    """
+    Patch graph, built by build_graph from an older version of buildings, in place so that it is the graph
+    build_graph would return for buildings, and return the changes: the 'added', 'removed' and 'renamed'
+    (old name to new name) buildings, and the 'refetched' buildings whose edges were asked for again.
+
+    A building missing from buildings whose coordinates are those of a new building was renamed, so only the
+    names are changed; a renamed row that geocodes to other coordinates than before (even slightly) is a removed
+    building and an added one. Only the walking edges of the buildings whose candidate neighbours changed, or that
+    moved, or had an edge to a removed building, are asked for again; the other buildings keep their edges.
+    Raise FetchError if some of these requests fail (graph is then partly patched and should not be written).
+
+    >>> class FakeClient:
+    ...     # stands in for googlemaps.Client: 'Hall i' is 100 * i metres north of (43, -79) (any other address is
+    ...     # 99 km north), and walks are as long as the straight line
+    ...     def geocode(self, address):
+    ...         metres = 100 * int(address[5:]) if address.startswith('Hall ') else 99000
+    ...         return [{"geometry": {"location": {"lat": 43 + metres / 111195, "lng": -79}}}]
+    ...     def distance_matrix(self, origins, destinations, mode):
+    ...         lat = lambda point: float(point.split(',')[0])
+    ...         return {"status": "OK", "rows": [{"elements": [
+    ...             {"status": "OK", "distance": {"value": round(abs(lat(o) - lat(d)) * 111195)},
+    ...              "duration": {"value": 1}} for d in destinations]} for o in origins]}
+    >>> import tempfile
+    >>> def fresh():
+    ...     geocodes = GeocodeCache(os.path.join(tempfile.mkdtemp(), 'geocode_cache.json'))
+    ...     geocodes.lookup([f'Hall {i}' for i in range(62)] + ['Hall 05'] + special_neighbors, FakeClient(), rate=1000)
+    ...     return DistanceMatrixFetcher(FakeClient(), rate=1000), geocodes
+    >>> fetcher, geocodes = fresh()
+    >>> graph = build_graph([f'Hall {i}' for i in range(60)], FakeClient(), fetcher, geocodes)
+    >>> fetcher.requests
+    60
+    >>> buildings = [f'Hall {i}' for i in range(60) if i != 50] + ['Hall 61']
+    >>> buildings[5] = 'Hall 05'
+    >>> changes = update_graph(graph, buildings, FakeClient(), fetcher, geocodes)
+    >>> changes['added'], changes['removed'], changes['renamed']
+    (['Hall 61'], ['Hall 50'], {'Hall 5': 'Hall 05'})
+    >>> changes['refetched'][0], changes['refetched'][-1], len(changes['refetched'])  # the neighbours of 50 and 61
+    ('Hall 43', 'Hall 61', 17)
+    >>> fetcher.requests - 60
+    17
+    >>> graph == build_graph(buildings, FakeClient(), *fresh())
+    True
+    """
+    coordinates = geocodes.lookup(buildings + special_neighbors, client)
+    positions = {b: tuple(coordinates[b]) for b in buildings if coordinates[b] is not None}
+    nodes = {node["name"]: node for node in graph["nodes"]}
+
+    added = [b for b in positions if b not in nodes]
+    vanished = {}
+    for name, node in nodes.items():
+        if name not in positions:
+            vanished.setdefault((node["lat"], node["lng"]), name)
+    renamed = {}
+    for b in added:
+        old_name = vanished.pop(positions[b], None)
+        if old_name is not None:
+            renamed[old_name] = b
+    added = [b for b in added if b not in renamed.values()]
+    removed = [name for name in nodes if name not in positions and name not in renamed]
+
+    for old_name, new_name in renamed.items():
+        nodes[new_name] = nodes.pop(old_name)
+        nodes[new_name]["name"] = new_name
+    if renamed:
+        for node in nodes.values():
+            for edge in node["edges"]:
+                edge["neighbor"] = renamed.get(edge["neighbor"], edge["neighbor"])
+
+    # the candidate neighbours of every building before and after the change, in the order build_graph uses
+    old_positions = {b: (nodes[b]["lat"], nodes[b]["lng"]) for b in list(positions) + removed if b in nodes}
+    moved = {b for b in positions if b in nodes and old_positions[b] != positions[b]}
+    before = candidate_destinations({b: p for b, p in old_positions.items() if b != special_building})
+    after = candidate_destinations({b: p for b, p in positions.items() if b != special_building})
+    removed_set = set(removed)
+    refetched = [b for b in after
+                 if b not in nodes or b in moved or before.get(b) != after[b] or moved.intersection(after[b])
+                 or any(edge["neighbor"] in removed_set for edge in nodes[b]["edges"])]
+
+    for b in removed:
+        del nodes[b]
+    for b, (lat, lng) in positions.items():
+        node = nodes.setdefault(b, {"name": b, "lat": lat, "lng": lng, "edges": []})
+        node["lat"], node["lng"] = lat, lng
+    for building, edges in walking_edges(fetcher, positions, refetched).items():
+        nodes[building]["edges"] = edges
+
+    changed = set(added) | removed_set | moved | set(renamed) | set(renamed.values())
+    if special_building in nodes and (special_building in changed or changed.intersection(special_neighbors)):
+        nodes[special_building]["edges"] = driving_edges(fetcher, coordinates)
+
+    graph["nodes"] = [nodes[b] for b in positions]
+    return {"added": added, "removed": removed, "renamed": renamed, "refetched": refetched}
+
+
+def walking_edges(fetcher, positions, origins):
+    """
+    Return a dictionary mapping every building of origins to its walking edges in the format of
+    graph_output.json, to the buildings of positions (a dictionary of building to (lat, lng)).
+    Only the rows of origins are asked for, and the special building gets no walking edges.
+    """
+    coords = {b: f"{lat},{lng}" for b, (lat, lng) in positions.items()}
+    coord_to_building = {coord: b for b, coord in coords.items()}
+
+    # Only ask for the pairs that may end up as edges
+    walking_coordinates = {coord: positions[b] for b, coord in coords.items() if b != special_building}
+    wanted = {coords[b] for b in origins if b != special_building}
+    candidate_edges_by_coord = sparse_distance_matrix(
+        fetcher,
+        {coord: destinations for coord, destinations in candidate_destinations(walking_coordinates).items()
+         if coord in wanted},
+        mode="walking",
+        max_elements=100
+    )
+
+    edges = {b: [] for b in origins}
+    for origin_coord, found in candidate_edges_by_coord.items():
+        candidates = [(coord_to_building[dest_coord], distance, duration) for dest_coord, distance, duration in found]
+        edges[coord_to_building[origin_coord]] = [
+            {"neighbor": dest, "distance": dist, "duration": dur, "mode": "walking"}
+            for dest, dist, dur in _select_neighbors(candidates)
+        ]
+    return edges
+
+
+def _select_neighbors(candidates):
+    """
+    Return the (building, distance, duration) candidates within NEIGHBOR_RADIUS metres, topped up with the
+    nearest other candidates to NEIGHBOR_COUNT of them if there are fewer.
+    """
+    within_150 = [c for c in candidates if c[1] <= NEIGHBOR_RADIUS]
+    if len(within_150) >= NEIGHBOR_COUNT:
+        return within_150
+    selected = within_150.copy()
+    candidates_sorted = sorted(candidates, key=lambda x: x[1])
+    for cand in candidates_sorted:
+        if cand not in selected:
+            selected.append(cand)
+        if len(selected) >= NEIGHBOR_COUNT:
+            break
+    return selected
+
+
+def driving_edges(fetcher, coordinates):
+    """
+    Return the driving edges of the special building to its special_neighbors in the format of
+    graph_output.json, given a dictionary mapping these addresses to their (lat, lng) (or None if not found).
+    Raise FetchError if the request fails, so the caller can keep the edges it already has.
+
+    >>> class FailingFetcher:
+    ...     def fetch(self, origins, destinations, mode):
+    ...         raise TimeoutError
+    >>> coordinates = {address: (43.66, -79.39) for address in [special_building] + special_neighbors}
+    >>> driving_edges(FailingFetcher(), coordinates)
+    Traceback (most recent call last):
+    ...
+    generate_graph_json.FetchError: 1 distance matrix requests failed, the first with: TimeoutError()
+    """
+    origin_coord = f"{coordinates[special_building][0]},{coordinates[special_building][1]}"
     special_destinations = []
     special_dest_buildings = []
     for nb in special_neighbors:
-        if nb in nodes:
-            coord = f"{nodes[nb]['lat']},{nodes[nb]['lng']}"
-        else:
-            lat, lng = get_geocode(nb)
-            time.sleep(0.1)
-            if lat is None or lng is None:
-                continue
-            coord = f"{lat},{lng}"
-        special_destinations.append(coord)
+        if coordinates[nb] is None:
+            continue
+        special_destinations.append(f"{coordinates[nb][0]},{coordinates[nb][1]}")
         special_dest_buildings.append(nb)
     try:
-        special_result = gmaps.distance_matrix(
-            origins=[origin_coord],
-            destinations=special_destinations,
-            mode="driving"
-        )
+        special_result = fetcher.fetch([origin_coord], special_destinations, "driving")
     except Exception as e:
-        print(f"Error with special building request: {e}")
-        special_result = None
-    if special_result:
-        elements = special_result["rows"][0]["elements"]
-        for idx, element in enumerate(elements):
-            nb = special_dest_buildings[idx]
-            if element.get("status") != "OK":
-                continue
-            distance = element["distance"]["value"]
-            duration = element["duration"]["value"]
-            edge = {"neighbor": nb, "distance": distance, "duration": duration, "mode": "driving"}
-            nodes[special_building]["edges"].append(edge)
-
-
-#OUTPUT JSON File
-graph = {"nodes": list(nodes.values())}
-file_name = "graph_output.json"
-current_dir = os.path.dirname(os.path.abspath(__file__))
-file_path = os.path.join(current_dir, file_name)
-
-with open(file_path, "w", encoding="utf-8") as json_file:
-    json.dump(graph, json_file, indent=4, ensure_ascii=False)
+        raise FetchError([(([origin_coord], special_destinations), e)]) from e
+    edges = []
+    elements = special_result["rows"][0]["elements"]
+    for idx, element in enumerate(elements):
+        if element.get("status") != "OK":
+            continue
+        distance = element["distance"]["value"]
+        duration = element["duration"]["value"]
+        edges.append({"neighbor": special_dest_buildings[idx], "distance": distance, "duration": duration,
+                      "mode": "driving"})
+    return edges
+
+
+def write_graph(graph, file_path):
+    """
+    Write graph to file_path as json, replacing the old file only once the new one is complete.
+    """
+    with atomic_write(file_path) as json_file:
+        json_file.write(json.dumps(graph, indent=4, ensure_ascii=False).encode("utf-8"))
+
+
+def main():
+    """
+    Build graph_output.json from buildings.csv with the Google Maps APIs.
+    If graph_output.json already exists, only the changes to buildings.csv are applied to it (unless --full is
+    given), and graph_snapshot.bin is compiled again from it.
+    """
+    parser = argparse.ArgumentParser(description="Build graph_output.json from buildings.csv.")
+    parser.add_argument("--full", action="store_true", help="rebuild the whole graph instead of updating it")
+    args = parser.parse_args()
+
+    client = make_client(API_KEY)
+    fetcher = DistanceMatrixFetcher(client, ResponseCache(RESPONSE_CACHE_DIR))
+    geocodes = GeocodeCache(GEOCODE_CACHE_PATH)
+    buildings = read_buildings(os.path.join(CURRENT_DIR, "buildings.csv"))
+
+    #OUTPUT JSON File
+    file_path = os.path.join(CURRENT_DIR, "graph_output.json")
+
+    if not args.full and os.path.exists(file_path):
+        with open(file_path, encoding="utf-8") as json_file:
+            graph = json.load(json_file)
+        changes = update_graph(graph, buildings, client, fetcher, geocodes)
+        print(f"{len(changes['added'])} added, {len(changes['removed'])} removed, {len(changes['renamed'])} "
+              f"renamed, edges of {len(changes['refetched'])} buildings asked for again")
+    else:
+        graph = build_graph(buildings, client, fetcher, geocodes)
+    write_graph(graph, file_path)
+    compile_snapshot(file_path, os.path.join(CURRENT_DIR, "graph_snapshot.bin"))
+    print(f"sent {fetcher.requests} distance matrix requests")
+
+
+if __name__ == "__main__":
+    main()
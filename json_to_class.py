@@ -1,6 +1,15 @@
 import json
+import time
+from typing import Any, Callable, Optional, TextIO
 from pj2_graph import Graph, _Vertex
 
+# number of characters read from the file at a time by the streaming loader
+STREAM_CHUNK_SIZE = 1 << 16
+
+# number of nodes between two calls of the progress callback of the streaming loader
+PROGRESS_EVERY = 1000
+
+
 def load_graph_from_json(json_path: str):
     with open(json_path, 'r', encoding='utf-8') as f:
         data = json.load(f)
@@ -10,12 +19,191 @@ def load_graph_from_json(json_path: str):
 
     for node in data['nodes']:
         name = node['name']
-        graph.add_vertex(name)
+        graph.add_vertex(name, (node['lat'], node['lng']))
         markers[name] = [node['lat'], node['lng']]
 
     for node in data['nodes']:
         current = node['name']
         for edge in node['edges']:
-            graph.add_edge(current, edge['neighbor'], edge['duration'])
+            graph.add_edge(current, edge['neighbor'], edge['duration'], mode=edge.get('mode'))
+
+    return graph, markers
+
+
+def stream_graph_from_json(json_path: str, progress: Optional[Callable[[dict], None]] = None,
+                           chunk_size: int = STREAM_CHUNK_SIZE) -> tuple[Graph, dict]:
+    """
+    build the same (graph, markers) as load_graph_from_json, decoding one node of the file at a time
+    so the whole document is never held in memory next to the graph
+
+    an edge to a node that has not been read yet is kept until that node arrives, and added just before the edges
+    of that node, so every edge still ends up with the weight of its last occurrence in the file
+    progress, if given, is called every PROGRESS_EVERY nodes and once at the end with a dict of the number of
+    nodes, edges and characters read so far, the seconds elapsed and the rates per second
+    raise ValueError if the file is not a graph or an edge leads to a node that is not in it
+
+    >>> import os, tempfile
+    >>> json_path = os.path.join(tempfile.mkdtemp(), 'graph.json')
+    >>> with open(json_path, 'w', encoding='utf-8') as f:
+    ...     _ = f.write('{"nodes": [{"name": "A", "lat": 1, "lng": 2, "edges": ['
+    ...                 '{"neighbor": "B", "duration": 5}]}, {"name": "B", "lat": 3, "lng": 4, "edges": ['
+    ...                 '{"neighbor": "A", "duration": 4, "mode": "walking"}]}], "version": 1}')
+    >>> reports = []
+    >>> graph, markers = stream_graph_from_json(json_path, reports.append, chunk_size=8)
+    >>> graph.shortest_path('A', 'B'), graph.comp_path(['A', 'B'])
+    (['A', 'B'], 4)
+    >>> markers
+    {'A': [1, 2], 'B': [3, 4]}
+    >>> reports[-1]['nodes'], reports[-1]['edges']
+    (2, 2)
+    """
+    graph = Graph()
+    markers = {}
+    # maps name of a node not read yet to the (name, duration, mode) of the edges to it read so far
+    waiting = {}
+    counts = {'nodes': 0, 'edges': 0}
+    started = time.perf_counter()
+
+    def report() -> None:
+        """Call progress with the counters and rates so far."""
+        seconds = time.perf_counter() - started
+        stats = {'nodes': counts['nodes'], 'edges': counts['edges'], 'characters': stream.consumed,
+                 'seconds': seconds}
+        for key in ('nodes', 'edges', 'characters'):
+            stats[key + '_per_second'] = stats[key] / seconds if seconds > 0 else 0.0
+        progress(stats)
+
+    with open(json_path, 'r', encoding='utf-8') as f:
+        stream = _JsonStream(f, chunk_size)
+        for node in stream.array_items('nodes'):
+            name = node['name']
+            if name not in markers:
+                graph.add_vertex(name, (node['lat'], node['lng']))
+            markers[name] = [node['lat'], node['lng']]
+            for neighbour, duration, mode in waiting.pop(name, []):
+                graph.add_edge(neighbour, name, duration, mode=mode)
+            for edge in node['edges']:
+                if edge['neighbor'] in markers:
+                    graph.add_edge(name, edge['neighbor'], edge['duration'], mode=edge.get('mode'))
+                else:
+                    waiting.setdefault(edge['neighbor'], []).append((name, edge['duration'], edge.get('mode')))
+                counts['edges'] += 1
+            counts['nodes'] += 1
+            if progress is not None and counts['nodes'] % PROGRESS_EVERY == 0:
+                report()
+
+    if waiting:
+        raise ValueError(f"edges lead to nodes that are not in {json_path}: {', '.join(map(str, waiting))}")
+    if progress is not None:
+        report()
+    return graph, markers
+
+
+class _JsonStream:
+    """Reads the values of a JSON document incrementally, keeping only a bounded window of the file in memory.
+
+    Instance Attributes:
+        - consumed: the number of characters of the file decoded so far
+    """
+    # Private Instance Attributes:
+    #     - _file: the file being read
+    #     - _chunk_size: the number of characters read at a time
+    #     - _buffer: the characters read but not decoded yet start at _position
+    #     - _position: the position of the next character to decode in _buffer
+    #     - _eof: whether the whole file has been read into _buffer
+    #     - _decoder: decodes one value at a time
+    consumed: int
+    _file: TextIO
+    _chunk_size: int
+    _buffer: str
+    _position: int
+    _eof: bool
+    _decoder: json.JSONDecoder
+
+    def __init__(self, file: TextIO, chunk_size: int) -> None:
+        """Initialize a stream reading file from its current position."""
+        self.consumed = 0
+        self._file = file
+        self._chunk_size = chunk_size
+        self._buffer = ''
+        self._position = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def array_items(self, key: str) -> Any:
+        """
+        yield the items of the array stored under key in the top-level object one at a time, decoding every other
+        top-level value in passing; raise ValueError if the document is not such an object
+        """
+        self._expect('{')
+        if self._peek() == '}':
+            raise ValueError(f"the document has no {key!r} array")
+        while True:
+            name = self._value()
+            self._expect(':')
+            if name == key:
+                yield from self._items()
+                return
+            self._value()
+            if self._peek() == '}':
+                raise ValueError(f"the document has no {key!r} array")
+            self._expect(',')
+
+    def _items(self) -> Any:
+        """Yield the values of the array starting at the next character."""
+        self._expect('[')
+        if self._peek() == ']':
+            self._advance(1)
+            return
+        while True:
+            yield self._value()
+            if self._peek() == ']':
+                self._advance(1)
+                return
+            self._expect(',')
+
+    def _value(self) -> Any:
+        """Decode the value starting at the next non-whitespace character."""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+                self._fill()
+                continue
+            # a number at the end of the buffer may continue in the next chunk
+            if end < len(self._buffer) or self._eof:
+                self._advance(end - self._position)
+                return value
+            self._fill()
+
+    def _expect(self, character: str) -> None:
+        """Consume the next non-whitespace character, raise ValueError if it is not character."""
+        found = self._peek()
+        if found != character:
+            raise ValueError(f"expected {character!r} at character {self.consumed}, found {found!r}")
+        self._advance(1)
+
+    def _peek(self) -> str:
+        """Skip whitespace and return the next character, '' at the end of the file."""
+        while True:
+            while self._position < len(self._buffer) and self._buffer[self._position] in ' \t\r\n':
+                self._advance(1)
+            if self._position < len(self._buffer) or self._eof:
+                return self._buffer[self._position:self._position + 1]
+            self._fill()
+
+    def _advance(self, count: int) -> None:
+        """Consume the next count characters."""
+        self._position += count
+        self.consumed += count
 
-    return graph, markers
\ No newline at end of file
+    def _fill(self) -> None:
+        """Drop the decoded characters from the buffer and read the next chunk of the file."""
+        # read at least as much as is buffered, so a value spanning many chunks is decoded in linear time
+        chunk = self._file.read(max(self._chunk_size, len(self._buffer) - self._position))
+        self._buffer = self._buffer[self._position:] + chunk
+        self._position = 0
+        self._eof = not chunk
@@ -9,87 +9,207 @@ Preconditions:
     - The 'markers' dictionary must contain valid coordinate pairs.
 
 Invariants:
-    - Global variables 'last_path' and 'last_result' store the most recent computed path and result,
-      and are updated only within the defined endpoints.
-    - The map is re-rendered with each request to reflect the latest global state.
+    - No endpoint changes global state: the last itinerary of each user is kept in their session cookie,
+      so the application can run with many threads and processes behind a WSGI server.
+    - The map page is rendered once at startup; routes are sent as JSON and drawn by the page itself.
 """
 
-from flask import Flask, render_template, request, jsonify
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from flask import Flask, Response, g, make_response, request, jsonify, stream_with_context
 import folium
-from json_to_class import load_graph_from_json
-from pj2_graph_alg import greedy_dijkstra_method1
-import os
+import hashlib
+import json
+import math
+import threading
+import time
+from pj2_graph_snapshot import load_or_compile
+from pj2_distance_matrix import load_or_build
+from pj2_graph_alg import batch_executor, greedy_dijkstra_method1, held_karp_method, local_search_method, solve_batch
+from metrics import Metrics
+from pj2_spatial_index import SpatialIndex
+from route_cache import RouteCache
+from route_jobs import JobQueueFull, RouteJobQueue
+from route_state import SESSION_COOKIE, RoutePlanner, decode_itinerary, encode_itinerary
 
 app = Flask(__name__)
 
+# ===== Metrics =====
+# Counters and latency histograms of this process, served in the Prometheus text format at '/metrics'.
+metrics = Metrics()
+metrics.describe("http_requests_total", "counter", "Requests served, by endpoint, method and status code.")
+metrics.describe("http_request_duration_seconds", "histogram",
+                 "Time from receiving a request to returning its response, by endpoint.")
+metrics.describe("startup_stage_seconds", "histogram", "Time spent in every stage of starting the server.")
+metrics.describe("route_stage_seconds", "histogram",
+                 "Time spent in every stage of answering an itinerary, other than the solver.")
+metrics.describe("route_solver_seconds", "histogram", "Time spent computing a route, by solver.")
+
 # ===== Load Graph and Coordinates =====
 # Preconditions: "graph_output.json" should exist and contain valid graph and marker data.
-graph, markers = load_graph_from_json("graph_output.json")
-
-# ===== Global State =====
-# Invariants: last_path and last_result always reflect the last computed route and result.
-last_path = []
-last_result = {}
-
-
-@app.route('/')
-def index():
+# The graph is compiled into a binary snapshot by pj2_graph_snapshot.py (or here, if it is missing or outdated),
+# which loads already frozen without parsing the JSON file.
+with metrics.timer("startup_stage_seconds", stage="load_graph"):
+    graph, markers = load_or_compile("graph_output.json", "graph_snapshot.bin")
+    # The page asks for the markers of its viewport only, and map clicks are snapped to the nearest node
+    spatial_index = SpatialIndex(markers)
+
+# ===== Load All-Pairs Distances =====
+# The matrix is built offline by pj2_distance_matrix.py (or here, if it is missing or outdated) and memory-mapped,
+# so every worker process shares the same pages and no request runs a search of its own.
+DISTANCE_MATRIX_PATH = "distance_matrix.bin"
+with metrics.timer("startup_stage_seconds", stage="load_distance_matrix"):
+    distance_matrix = load_or_build("graph_output.json", DISTANCE_MATRIX_PATH)
+
+# ===== Solvers and Route Cache =====
+# Clients may choose a solver by name; every solver returns the full path through the selected nodes.
+SOLVERS = {
+    "greedy": greedy_dijkstra_method1,
+    "held_karp": held_karp_method,
+    "local_search": local_search_method,
+}
+# Routes are cached by (start, set of selected nodes, solver, graph version), for at most 10 minutes each.
+route_cache = RouteCache(max_entries=4096, ttl=600.0)
+for counter in ("hits", "misses", "evictions", "expirations"):
+    metrics.collect(f"route_cache_{counter}_total", "counter", f"Route cache {counter} since the server started.",
+                    lambda counter=counter: route_cache.stats()[counter])
+metrics.collect("route_cache_entries", "gauge", "Routes currently in the route cache.",
+                lambda: route_cache.stats()["entries"])
+
+# ===== Shared Read-Only State =====
+# Invariants: requests only read the frozen graph snapshot and the distance matrix; the state of each
+# user is the itinerary in their session cookie, so any thread of any process can serve any request.
+planner = RoutePlanner(graph, distance_matrix, SOLVERS, route_cache, metrics)
+
+# ===== Background Route Jobs and Batch Worker Processes =====
+# Slow itineraries can be computed by a small pool of worker threads instead of the request thread; at most
+# 32 jobs wait at a time, and each must finish within 30 seconds of being submitted. Itineraries are checked
+# before they are submitted, so the jobs only solve them.
+# Large '/calculate_batch' requests are solved by one pool of processes kept for the life of the server, spawned
+# rather than forked from the request threads, and at most 2 batches are solved at a time.
+# Invariants: the threads and processes are only started by the first request that needs them, never at import:
+# a spawned worker imports the script that started the server again (as '__mp_main__' when it is this file),
+# and must not start threads or processes of its own.
+batch_slots = threading.BoundedSemaphore(2)
+_workers_lock = threading.Lock()
+_route_jobs: Optional[RouteJobQueue] = None
+_batch_pool: Optional[ProcessPoolExecutor] = None
+
+
+def route_jobs() -> RouteJobQueue:
+    """Return the queue of background route jobs, starting its worker threads on the first call."""
+    global _route_jobs
+    with _workers_lock:
+        if _route_jobs is None:
+            _route_jobs = RouteJobQueue(planner.solve, workers=2, max_pending=32, default_timeout=30.0)
+        return _route_jobs
+
+
+def batch_pool() -> ProcessPoolExecutor:
+    """Return the pool of batch worker processes, created on the first call (its workers start on first use)."""
+    global _batch_pool
+    with _workers_lock:
+        if _batch_pool is None:
+            _batch_pool = batch_executor(planner.snapshot, DISTANCE_MATRIX_PATH)
+        return _batch_pool
+
+
+def render_base_map() -> str:
     """
-    Render the interactive map page.
+    Render the static interactive map page once.
 
-    This function creates a Folium map centered at a default location and adds markers with clickable
-    buttons that allow users to select nodes. It also draws the last computed route if available.
-
-    Preconditions:
-        - 'markers' is a dict with marker labels as keys and coordinate pairs (list or tuple) as values.
-        - Global variables 'last_path' and 'last_result' are properly maintained.
+    This function creates a Folium map centered at a default location. Neither markers nor routes are part
+    of the page: the page script fetches the markers in view from '/markers' whenever the map moves, with
+    clickable buttons that allow users to select nodes, snaps clicks on the map to the nearest node with
+    '/nearest', and fetches routes from '/route' and '/calculate' as JSON, drawing all of them itself.
 
     Invariants:
-        - The rendered map always includes all markers from 'markers'.
-        - If a valid route exists in 'last_path', it is drawn on the map.
+        - The page is the same however many markers there are.
 
     Returns:
-        Rendered HTML page from the 'map.html' template.
+        The full HTML of the map page.
     """
     # Create a map centered at a default location
     m = folium.Map(location=[43.6631778, -79.3946746], zoom_start=17)
 
-    # Add markers to the map with popups including a "Select" button
-    for label, coords in markers.items():
-        popup_html = f"""
-        <b>{label}</b><br>
-        <button onclick="clickedMarkers.push('{label}'); document.getElementById('selection').innerHTML += '{label} → '; console.log(clickedMarkers);">Select</button>
-        """
-        popup = folium.Popup(popup_html, max_width=300)
-        folium.Marker(location=coords, popup=popup, tooltip=label).add_to(m)
-
-    # If a route has been computed, draw the polyline on the map
-    if last_path:
-        # Preconditions: all nodes in 'last_path' must exist in markers
-        route_coords = [markers[n] for n in last_path if n in markers]
-        if len(route_coords) >= 2:
-            folium.PolyLine(route_coords, color="blue", weight=5, tooltip="Route").add_to(m)
-
-    # Prepare the HTML for displaying the result on the map
-    result_html = ""
-    if last_result:
-        result_html = (
-            f"<b>Path:</b> {' → '.join(last_result['path'])}<br>"
-            f"<b>Duration:</b> {last_result['distance']} min<br>"
-            f"{last_result['message']}"
-        )
-
-    # JavaScript and HTML code for the selection panel
+    # JavaScript and HTML code for the selection panel; the route is drawn from the JSON route API
     js_code = f"""
     <div style="position:absolute; top:10px; left:10px; z-index:9999; background:white; padding:10px; border:1px solid #ccc; border-radius:5px;">
         <div id="selection"><b>Selected:</b> </div>
-        <div id="result" style="margin-top:5px;">{result_html}</div>
+        <div id="result" style="margin-top:5px;"></div>
         <button onclick="sendClickedNodes()">Calculate</button>
         <button onclick="clearSelection()">Clear</button>
     </div>
 
     <script>
         var clickedMarkers = [];
+        var routeLayer = null;
+        var shownMarkers = {{}};
+
+        function selectNode(label) {{
+            clickedMarkers.push(label);
+            document.getElementById("selection").appendChild(document.createTextNode(label + " → "));
+        }}
+
+        function selectPopup(label) {{
+            var content = document.createElement("div");
+            var name = document.createElement("b");
+            name.textContent = label;
+            var button = document.createElement("button");
+            button.textContent = "Select";
+            button.onclick = function () {{ selectNode(label); }};
+            content.append(name, document.createElement("br"), button);
+            return content;
+        }}
+
+        function loadMarkers() {{
+            var bounds = {m.get_name()}.getBounds();
+            var bbox = [bounds.getSouth(), bounds.getWest(), bounds.getNorth(), bounds.getEast()].join(",");
+            fetch('/markers?bbox=' + bbox)
+            .then(response => response.json())
+            .then(function (data) {{
+                for (var label in shownMarkers) {{
+                    if (!(label in data.markers)) {{
+                        shownMarkers[label].remove();
+                        delete shownMarkers[label];
+                    }}
+                }}
+                for (var label in data.markers) {{
+                    if (!(label in shownMarkers)) {{
+                        shownMarkers[label] = L.marker(data.markers[label])
+                            .bindPopup(selectPopup(label), {{maxWidth: 300}}).bindTooltip(label).addTo({m.get_name()});
+                    }}
+                }}
+            }});
+        }}
+
+        function snapToNode(event) {{
+            fetch('/nearest?lat=' + event.latlng.lat + '&lng=' + event.latlng.lng)
+            .then(response => response.json())
+            .then(function (data) {{
+                if (data.nearest && data.nearest.length > 0) {{
+                    var node = data.nearest[0];
+                    L.popup().setLatLng(node.coords).setContent(selectPopup(node.name)).openOn({m.get_name()});
+                }}
+            }});
+        }}
+
+        function showRoute(data) {{
+            if (routeLayer) {{
+                routeLayer.remove();
+                routeLayer = null;
+            }}
+            if (!data.path || data.path.length === 0) {{
+                document.getElementById("result").innerHTML = "";
+                return;
+            }}
+            if (data.coords && data.coords.length >= 2) {{
+                routeLayer = L.polyline(data.coords, {{color: "blue", weight: 5}}).bindTooltip("Route").addTo({m.get_name()});
+            }}
+            document.getElementById("result").innerHTML =
+                "<b>Path:</b> " + data.path.join(" → ") + "<br>" +
+                "<b>Duration:</b> " + data.distance + " min<br>" + data.message;
+        }}
 
         function sendClickedNodes() {{
             fetch('/calculate', {{
@@ -98,24 +218,188 @@ def index():
                 body: JSON.stringify({{ nodes: clickedMarkers }})
             }})
             .then(response => response.json())
-            .then(data => {{
-                window.location.reload();
-            }});
+            .then(showRoute);
         }}
 
         function clearSelection() {{
             clickedMarkers = [];
             document.getElementById("selection").innerHTML = "<b>Selected:</b> ";
-            document.getElementById("result").innerHTML = "";
+            showRoute({{path: []}});
         }}
+
+        window.addEventListener("load", function () {{
+            {m.get_name()}.on("moveend", loadMarkers);
+            {m.get_name()}.on("click", snapToNode);
+            loadMarkers();
+            fetch('/route').then(response => response.json()).then(showRoute);
+        }});
     </script>
     """
 
-    # Inject the JavaScript and HTML into the map and save it to the template
+    # Inject the JavaScript and HTML into the map
     m.get_root().html.add_child(folium.Element(js_code))
-    m.save("templates/map.html")
+    return m.get_root().render()
+
+
+# ===== Base Map =====
+# Invariants: the page is rendered once at startup and never changes while the server runs,
+# so it is served from memory and browsers may revalidate it with its ETag.
+with metrics.timer("startup_stage_seconds", stage="render_map"):
+    base_map_html = render_base_map()
+    base_map_etag = hashlib.sha256(base_map_html.encode("utf-8")).hexdigest()
+
+
+@app.before_request
+def start_timer():
+    """Record the time the current request started."""
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    """
+    Count the current request and record its latency, by endpoint (the name of the view function).
+
+    The latency of a streamed response ('/calculate_batch') covers the time to start the stream only.
+    """
+    endpoint = request.endpoint or "none"
+    metrics.observe("http_request_duration_seconds", time.perf_counter() - g.request_started, endpoint=endpoint)
+    metrics.inc("http_requests_total", endpoint=endpoint, method=request.method, status=response.status_code)
+    return response
 
-    return render_template("map.html")
+
+def route_payload(result: dict) -> dict:
+    """
+    Return result with the coordinates of every node of its path added under the key 'coords'.
+
+    Preconditions:
+        - result is empty, or has the keys 'path', 'distance' and 'message'.
+    """
+    if not result:
+        return {"path": [], "coords": [], "distance": 0, "message": ""}
+    # Preconditions: all nodes in the path must exist in markers
+    coords = [markers[n] for n in result["path"] if n in markers]
+    return dict(result, coords=coords)
+
+
+@app.route('/')
+def index():
+    """
+    Serve the interactive map page rendered at startup.
+
+    The response carries an ETag and a Cache-Control header, and a request whose If-None-Match matches
+    the ETag is answered with 304 Not Modified and no body.
+
+    Returns:
+        The map page, or an empty 304 response.
+    """
+    response = make_response(base_map_html)
+    response.set_etag(base_map_etag)
+    response.headers["Cache-Control"] = "public, max-age=300"
+    return response.make_conditional(request)
+
+
+# The largest number of markers returned by one '/markers' request, and of nodes by one '/nearest' request
+MARKER_LIMIT = 2000
+NEAREST_LIMIT = 20
+
+
+@app.route('/markers')
+def markers_in_view():
+    """
+    Return the markers inside a bounding box as JSON, for the page to draw only what is in view.
+
+    The box is given by the query parameter 'bbox' as "south,west,north,east" in degrees. Only the cells of
+    the spatial index that overlap the box are searched, so the cost depends on the markers in view only.
+
+    Returns:
+        JSON response with the coordinates of at most MARKER_LIMIT markers by label under the key 'markers',
+        and whether more markers are in the box under the key 'truncated'; 400 if the box is malformed.
+    """
+    try:
+        south, west, north, east = (float(value) for value in request.args.get("bbox", "").split(","))
+        if not all(math.isfinite(value) for value in (south, west, north, east)):
+            raise ValueError
+    except ValueError:
+        response = jsonify({"message": "❗ Give the box as bbox=south,west,north,east."})
+        response.status_code = 400
+        return response
+    labels = spatial_index.within(south, west, north, east, limit=MARKER_LIMIT + 1)
+    return jsonify({"markers": {label: markers[label] for label in labels[:MARKER_LIMIT]},
+                    "truncated": len(labels) > MARKER_LIMIT})
+
+
+@app.route('/nearest')
+def nearest():
+    """
+    Return the nodes nearest to a coordinate as JSON, to snap a click on the map to a node.
+
+    The coordinate is given by the query parameters 'lat' and 'lng' in degrees, and the number of nodes by 'k'
+    (1 by default, at most NEAREST_LIMIT).
+
+    Returns:
+        JSON response with the label, coordinates and great-circle distance (in metres) of each node, nearest
+        first, under the key 'nearest'; 400 if the coordinate is malformed.
+    """
+    try:
+        lat, lng = float(request.args["lat"]), float(request.args["lng"])
+        k = min(max(int(request.args.get("k", 1)), 1), NEAREST_LIMIT)
+        if not (math.isfinite(lat) and math.isfinite(lng)):
+            raise ValueError
+    except (KeyError, ValueError):
+        response = jsonify({"message": "❗ Give the coordinate as lat=...&lng=..."})
+        response.status_code = 400
+        return response
+    return jsonify({"nearest": [{"name": label, "coords": markers[label], "distance": round(distance, 1)}
+                                for label, distance in spatial_index.nearest(lat, lng, k)]})
+
+
+@app.route('/route')
+def route():
+    """
+    Return the last route computed for this session as JSON, with the coordinates of its nodes, for the
+    page to draw. The route of the itinerary in the session cookie is read from the route cache only.
+
+    Invariants:
+        - No solver is run: the cookie is sent by the client, so it may name any itinerary.
+
+    Returns:
+        JSON response with the route, or with an empty route if the itinerary is not in the route cache.
+
+    Two sessions calculating routes at the same time each get back their own route only:
+
+    >>> from concurrent.futures import ThreadPoolExecutor
+    >>> names = sorted(markers)
+    >>> first, second = names[:2], names[2:4]
+    >>> def session(nodes: list) -> bool:
+    ...     client = app.test_client()
+    ...     own = True
+    ...     for _ in range(20):
+    ...         calculated = client.post('/calculate', json={"nodes": nodes}).get_json()["path"]
+    ...         own = own and calculated[0] == nodes[0] and client.get('/route').get_json()["path"] == calculated
+    ...     return own
+    >>> with ThreadPoolExecutor(4) as pool:
+    ...     list(pool.map(session, [first, second, first[::-1], second[::-1]]))
+    [True, True, True, True]
+
+    Another worker process has its own route cache, so it answers a session with its route or an empty one,
+    never with the route of another session:
+
+    >>> import subprocess, sys
+    >>> client = app.test_client()
+    >>> first_path = client.post('/calculate', json={"nodes": first}).get_json()["path"]
+    >>> cookie = client.get_cookie(SESSION_COOKIE).value
+    >>> _ = app.test_client().post('/calculate', json={"nodes": second})
+    >>> worker = subprocess.run([sys.executable, "-c", "import sys, main; client = main.app.test_client(); "
+    ...                          "client.set_cookie(main.SESSION_COOKIE, sys.argv[1]); "
+    ...                          "print(client.get('/route').get_data(as_text=True))", cookie],
+    ...                         capture_output=True, text=True, check=True)
+    >>> json.loads(worker.stdout)["path"] in ([], first_path)
+    True
+    """
+    itinerary = decode_itinerary(request.cookies.get(SESSION_COOKIE))
+    cached = None if itinerary is None else planner.cached(*itinerary)
+    return jsonify(route_payload(cached or {}))
 
 
 @app.route('/calculate', methods=['POST'])
@@ -123,67 +407,173 @@ def calculate():
     """
     Calculate the optimal path based on user-selected nodes using a greedy Dijkstra algorithm.
 
-    The function expects a JSON POST request containing a list of node labels under the key 'nodes'.
-    It computes the route starting from the first node using 'greedy_dijkstra_method1' and calculates
-    the total distance (converted to minutes) using a simplified complete graph method.
+    The function expects a JSON POST request containing a list of node labels under the key 'nodes',
+    and optionally the name of one of SOLVERS under the key 'solver' ("greedy" by default).
+    It computes the route starting from the first node and its total duration (converted to minutes).
+    A route already computed for the same start, set of nodes and solver is returned from the route cache.
+
+    If the request JSON has "async": true, the route is computed by the background job queue instead:
+    the response is 202 with the id of the job to poll at '/result/<id>' (optionally within "timeout"
+    seconds), or 503 if too many jobs are already waiting. The session cookie is then set by '/result/<id>'
+    once the job is done.
 
     Preconditions:
-        - The POST request JSON must contain a key "nodes" with a list of node labels.
+        - The POST request JSON must be an object with a key "nodes" with a list of node labels;
+          otherwise, a warning message is returned.
+        - The solver, if given, must be one of SOLVERS; otherwise, a warning message is returned.
         - There must be at least 2 nodes selected; otherwise, a warning message is returned.
-        - The global 'graph' object must support 'generate_complete_graph' and the resulting simplified
-          graph must support 'comp_path' method.
+        - Every node must be connected to the first one; otherwise, a warning message is returned.
+        - The global 'distance_matrix' must contain every node of the global 'graph'.
 
     Invariants:
-        - The global variables 'last_path' and 'last_result' are updated only in this function.
+        - No global state is changed; the itinerary is stored in the session cookie of the caller only,
+          and only once its route is computed.
 
     Returns:
-        JSON response with the computed path, distance (in minutes), and a status message.
+        JSON response with the computed path, its coordinates, distance (in minutes), and a status message,
+        or with the id and status of the submitted job.
     """
-    global last_path, last_result
-    data = request.get_json()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
     nodes = data.get("nodes", [])
+    solver = data.get("solver", "greedy")
+
+    warning = planner.check(nodes, solver)
+    if warning is not None:
+        return jsonify(route_payload(warning))
+
+    if data.get("async"):
+        # Jobs may ask for a shorter or longer deadline, up to 5 minutes
+        timeout = data.get("timeout")
+        if not isinstance(timeout, (int, float)) or not 0 < timeout <= 300:
+            timeout = None
+        try:
+            job_id = route_jobs().submit(nodes, solver, timeout)
+        except JobQueueFull as error:
+            response = jsonify({"status": "rejected", "message": f"❗ {error}."})
+            response.status_code = 503
+            response.headers["Retry-After"] = "5"
+            return response
+        response = jsonify(route_jobs().status(job_id))
+        response.status_code = 202
+        return response
+
+    result = planner.solve(nodes, solver)
+    with metrics.timer("route_stage_seconds", stage="serialize"):
+        response = jsonify(route_payload(result))
+    response.set_cookie(SESSION_COOKIE, encode_itinerary(nodes, solver), samesite="Lax")
+    return response
+
+
+# The largest number of itineraries accepted by one '/calculate_batch' request
+BATCH_LIMIT = 5000
+
+
+@app.route('/calculate_batch', methods=['POST'])
+def calculate_batch():
+    """
+    Calculate the routes of many itineraries at once, across a pool of processes.
 
-    if len(nodes) < 2:
-        last_result = {
-            "path": nodes,
-            "distance": 0,
-            "message": "❗ Select at least 2 nodes."
-        }
-        return jsonify(last_result)
-
-    # Compute path starting from the first node using the greedy Dijkstra method
-    start = nodes[0]
-    path = greedy_dijkstra_method1(graph, start, nodes)
-
-    # Generate a simplified complete graph for the selected nodes
-    simp_graph = graph.generate_complete_graph(nodes)
-    # Calculate total distance; assume the distance is given in seconds and convert to minutes
-    distance = simp_graph.comp_path(nodes) / 60
-
-    # Update global state with the new path and result
-    last_path = path
-    last_result = {
-        "path": path,
-        "distance": round(distance, 2),
-        "message": "✅ Path calculated successfully."
-    }
-    return jsonify(last_result)
+    The function expects a JSON POST request containing a list of itineraries (each a list of node labels,
+    starting with its start node) under the key 'itineraries', and optionally the name of one of SOLVERS
+    under the key 'solver' ("greedy" by default). Large batches are solved by the worker processes of the global
+    'batch_pool()', which share the frozen graph snapshot and memory-map the same distance matrix file; small ones
+    are solved by this thread with the global 'distance_matrix'.
 
+    Preconditions:
+        - The POST request JSON must be an object with a list of at most BATCH_LIMIT itineraries;
+          otherwise, 400 is returned.
+        - Fewer batches than the slots of the global 'batch_slots' are being solved; otherwise, 503 is returned.
 
-if __name__ == '__main__':
+    Returns:
+        A stream of newline-delimited JSON objects, one per itinerary and in the same order, each with the
+        computed path, its coordinates, distance (in minutes), and a status message.
     """
-    Entry point for the Flask application.
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    itineraries = data.get("itineraries", [])
+    solver = data.get("solver", "greedy")
+    if not isinstance(itineraries, list) or len(itineraries) > BATCH_LIMIT:
+        response = jsonify({"message": f"❗ Send a list of at most {BATCH_LIMIT} itineraries."})
+        response.status_code = 400
+        return response
+    if not batch_slots.acquire(blocking=False):
+        response = jsonify({"message": "❗ Too many batches are being calculated, try again later."})
+        response.status_code = 503
+        response.headers["Retry-After"] = "5"
+        return response
+
+    def generate():
+        """Yield one JSON line per itinerary, as soon as it and every earlier one are computed."""
+        warnings = [planner.check(nodes, solver) for nodes in itineraries]
+        valid = [nodes for nodes, warning in zip(itineraries, warnings) if warning is None]
+        # Every itinerary is rejected if the solver is not one of SOLVERS, so a valid one means a known solver
+        paths = solve_batch(planner.snapshot, valid, SOLVERS[solver] if valid else greedy_dijkstra_method1,
+                            oracle=distance_matrix, executor=batch_pool())
+        for warning in warnings:
+            result = warning if warning is not None else planner.result(next(paths))
+            yield json.dumps(route_payload(result), ensure_ascii=False) + "\n"
+
+    # The slot is released once the stream is closed, whether it was sent in full or the client went away
+    response = Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+    response.call_on_close(batch_slots.release)
+    return response
+
+
+@app.route('/result/<job_id>', methods=['GET', 'DELETE'])
+def result(job_id: str):
+    """
+    Poll (GET) or cancel (DELETE) a route job submitted to '/calculate' with "async": true.
 
-    This block ensures that the 'templates' directory exists before starting the Flask development server.
+    Returns:
+        JSON response with the id and status of the job ("queued", "running", "done", "failed",
+        "cancelled" or "expired"), and the route with its coordinates once it is done; 404 if the job is unknown.
+        Once the job is done, its itinerary is stored in the session cookie of the caller.
+    """
+    if request.method == 'DELETE':
+        route_jobs().cancel(job_id)
+    state = route_jobs().status(job_id)
+    if state is None:
+        response = jsonify({"job": job_id, "status": "unknown"})
+        response.status_code = 404
+        return response
+    if "result" not in state:
+        return jsonify(state)
+    state["result"] = route_payload(state["result"])
+    response = jsonify(state)
+    itinerary = route_jobs().itinerary(job_id)
+    if itinerary is not None:
+        response.set_cookie(SESSION_COOKIE, encode_itinerary(*itinerary), samesite="Lax")
+    return response
+
+
+@app.route('/cache_stats')
+def cache_stats():
+    """
+    Return the hit, miss, eviction and expiration counters and the hit rate of the route cache as JSON.
+    """
+    return jsonify(route_cache.stats())
 
-    Preconditions:
-        - The operating system must permit creating directories if they do not exist.
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """
+    Return the counters and latency histograms of this server process in the Prometheus text format,
+    including the time spent in every stage of '/calculate' (validation, route cache, solver, path length
+    and JSON serialization) and of starting the server (loading the graph and rendering the map).
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+if __name__ == '__main__':
+    """
+    Entry point for the Flask application.
 
     Invariants:
         - The application runs in debug mode.
     """
-    if not os.path.exists("templates"):
-        os.mkdir("templates")
     app.run(debug=True)
     # import python_ta
     #
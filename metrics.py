@@ -0,0 +1,186 @@
+"""
+    counters and latency histograms of the web application, exposed in the Prometheus text format
+
+every server process keeps its own metrics, a Prometheus server scraping several processes sums them itself
+"""
+from __future__ import annotations
+from typing import Any, Callable, Optional
+import bisect
+import math
+import threading
+import time
+
+# upper bounds in seconds of the latency histogram buckets, fine enough below 10 ms for a p99 of cached routes
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Metrics:
+    """A thread-safe registry of counters and histograms, each identified by a name and a set of labels.
+
+    Instance Attributes:
+        - buckets: the upper bounds of the buckets of every histogram, in increasing order
+
+    >>> now = [0.0]
+    >>> metrics = Metrics(buckets=(0.1, 1.0), clock=lambda: now[0])
+    >>> metrics.describe('requests_total', 'counter', 'Requests served.')
+    >>> metrics.inc('requests_total', endpoint='index')
+    >>> with metrics.timer('stage_seconds', stage='solve'):
+    ...     now[0] += 0.5
+    >>> print(metrics.render())
+    # HELP requests_total Requests served.
+    # TYPE requests_total counter
+    requests_total{endpoint="index"} 1.0
+    # TYPE stage_seconds histogram
+    stage_seconds_bucket{stage="solve",le="0.1"} 0
+    stage_seconds_bucket{stage="solve",le="1.0"} 1
+    stage_seconds_bucket{stage="solve",le="+Inf"} 1
+    stage_seconds_sum{stage="solve"} 0.5
+    stage_seconds_count{stage="solve"} 1
+    <BLANKLINE>
+    """
+    buckets: tuple[float, ...]
+    # Private Instance Attributes:
+    #     - _clock: returns the current time in seconds, used by timers
+    #     - _kinds: maps the name of every metric to its kind ('counter', 'gauge' or 'histogram')
+    #     - _help: maps the name of every described metric to its description
+    #     - _counters: maps (name, labels) to the value of a counter
+    #     - _histograms: maps (name, labels) to [count of every bucket, count above the last bucket, sum]
+    #     - _callbacks: (name, labels, read) of the metrics whose value is read when rendered
+    #     - _lock: guards every other attribute
+    _clock: Callable[[], float]
+    _kinds: dict[str, str]
+    _help: dict[str, str]
+    _counters: dict[tuple, float]
+    _histograms: dict[tuple, list]
+    _callbacks: list[tuple[str, tuple, Callable[[], float]]]
+    _lock: threading.Lock
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+                 clock: Callable[[], float] = time.perf_counter) -> None:
+        """Initialize a registry without metrics."""
+        self.buckets = buckets
+        self._clock = clock
+        self._kinds = {}
+        self._help = {}
+        self._counters = {}
+        self._histograms = {}
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, kind: str, help_text: str) -> None:
+        """Declare the kind ('counter', 'gauge' or 'histogram') and description of the metric called name."""
+        with self._lock:
+            self._kinds[name] = kind
+            self._help[name] = help_text
+
+    def inc(self, name: str, amount: float = 1.0, **labels: Any) -> None:
+        """Add amount to the counter called name with the given labels."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._kinds.setdefault(name, 'counter')
+            self._counters[key] = self._counters.get(key, 0.0) + amount
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        """Record value in the histogram called name with the given labels."""
+        key = (name, _label_key(labels))
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._kinds.setdefault(name, 'histogram')
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0, 0.0]
+            if position < len(self.buckets):
+                histogram[0][position] += 1
+            else:
+                histogram[1] += 1
+            histogram[2] += value
+
+    def timer(self, name: str, **labels: Any) -> _Timer:
+        """Return a context manager recording the seconds spent in it in the histogram called name."""
+        return _Timer(self, name, labels)
+
+    def collect(self, name: str, kind: str, help_text: str, read: Callable[[], float], **labels: Any) -> None:
+        """Declare a counter or gauge called name whose value is read, on every render, by calling read."""
+        with self._lock:
+            self._kinds[name] = kind
+            self._help[name] = help_text
+            self._callbacks.append((name, _label_key(labels), read))
+
+    def render(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        with self._lock:
+            samples = {}
+            for (name, labels), value in self._counters.items():
+                samples.setdefault(name, []).append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+            for (name, labels), (counts, overflow, total) in self._histograms.items():
+                lines = samples.setdefault(name, [])
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", repr(float(bound))),))} {cumulative}')
+                cumulative += overflow
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+                lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+            callbacks = list(self._callbacks)
+            kinds = dict(self._kinds)
+            descriptions = dict(self._help)
+        for name, labels, read in callbacks:
+            samples.setdefault(name, []).append(f'{name}{_format_labels(labels)} {_format_value(read())}')
+
+        text = []
+        for name, lines in samples.items():
+            if name in descriptions:
+                text.append(f'# HELP {name} {descriptions[name]}')
+            text.append(f'# TYPE {name} {kinds[name]}')
+            text.extend(lines)
+        return '\n'.join(text) + '\n'
+
+
+class _Timer:
+    """Records the seconds spent in a with block in a histogram of a Metrics registry."""
+    # Private Instance Attributes:
+    #     - _metrics: the registry of the histogram
+    #     - _name, _labels: the histogram
+    #     - _start: the time the block was entered
+    _metrics: Metrics
+    _name: str
+    _labels: dict[str, Any]
+    _start: Optional[float]
+
+    def __init__(self, metrics: Metrics, name: str, labels: dict[str, Any]) -> None:
+        """Initialize a timer of the histogram called name with the given labels."""
+        self._metrics = metrics
+        self._name = name
+        self._labels = labels
+        self._start = None
+
+    def __enter__(self) -> _Timer:
+        """Start timing."""
+        self._start = self._metrics._clock()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """Record the time spent since the block was entered, even if it raised."""
+        self._metrics.observe(self._name, self._metrics._clock() - self._start, **self._labels)
+
+
+def _label_key(labels: dict[str, Any]) -> tuple:
+    """Return the labels as a sorted tuple of (name, value as a string) pairs."""
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: tuple) -> str:
+    """Return the labels in the exposition format, an empty string if there are none."""
+    if not labels:
+        return ''
+    escaped = (name + '="' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+               for name, value in labels)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value: float) -> str:
+    """Return value in the exposition format."""
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
@@ -0,0 +1,400 @@
+"""
+    a contraction hierarchy of a graph, built offline, answering shortest distance and path queries by two small
+    upward searches instead of a dijkstra over the whole graph
+
+vertices are contracted one at a time, least important first; contracting a vertex adds a shortcut between two of
+its remaining neighbours whenever the path through it may be their only shortest path, and every shortcut records
+the vertex it skips, so paths are unpacked back to the vertices of the original graph
+
+file layout (little endian):
+    - 8 bytes magic, 4 bytes number of vertices n, 4 bytes number of upward edges m, 4 bytes length of the name table
+    - the name table, a utf-8 json list of the n items, padded with spaces to a multiple of 8 bytes
+    - m float64 upward edge weights
+    - n + 1 int32 offsets, m int32 upward edge targets and m int32 skipped vertices (-1 for edges of the graph)
+"""
+from __future__ import annotations
+from array import array
+from collections import OrderedDict
+from typing import Any, Optional
+import heapq
+import json
+import struct
+import sys
+import threading
+
+import pj2_graph
+from json_to_class import load_graph_from_json
+from pj2_files import atomic_write, build_if_outdated, little_endian, padded, read_array
+
+MAGIC = b'PJ2CH\x00\x00\x01'
+_HEADER = struct.Struct('<8sIII')
+
+# vertices settled by a witness search before it gives up (and a possibly needless shortcut is added)
+WITNESS_SETTLE_LIMIT = 500
+
+# upward search spaces kept for reuse, so the many queries from one source of a greedy tour search it once
+DEFAULT_SEARCH_CACHE_SIZE = 256
+
+
+class ContractionHierarchy:
+    """The upward graph of a contraction hierarchy, usable as the distance oracle of greedy_dijkstra and
+    generate_complete_graph (see pj2_graph.Graph.greedy_dijkstra).
+
+    An edge of the upward graph leads from a vertex to a vertex contracted after it, so every shortest path is an
+    upward path from its start followed by a downward path to its end, and meets the upward search from its end.
+    Upward search spaces are cached, so a hierarchy can be shared by several threads but not modified.
+
+    Representation Invariants:
+        - len(self._offsets) == len(self._names) + 1
+        - len(self._targets) == len(self._weights) == len(self._middles) == self._offsets[-1]
+
+    >>> g = pj2_graph.Graph()
+    >>> for item in ['A', 'B', 'C', 'D', 'E', 'F', 'G']:
+    ...     g.add_vertex(item)
+    >>> for item1, item2, weight in [('A', 'B', 2), ('A', 'C', 5), ('B', 'D', 1), ('B', 'E', 3), ('C', 'E', 2),
+    ...                              ('C', 'F', 6), ('D', 'G', 4), ('E', 'G', 1), ('F', 'G', 3)]:
+    ...     g.add_edge(item1, item2, weight)
+    >>> hierarchy = ContractionHierarchy.build(g)
+    >>> hierarchy.distance('A', 'F')
+    9.0
+    >>> hierarchy.path('A', 'F')
+    ['A', 'B', 'E', 'G', 'F']
+    >>> all(hierarchy.distance(a, b) == distance
+    ...     for a in 'ABCDEFG' for b, distance in g.shortest_path_tree(a)[0].items())
+    True
+    >>> g.greedy_dijkstra('A', ['A', 'F', 'D'], hierarchy)
+    ['A', 'B', 'D', 'G', 'F']
+    >>> sorted(g.generate_complete_graph(['A', 'C', 'G'], hierarchy).get_neighbours('A'))
+    ['C', 'G']
+    """
+    # Private Instance Attributes:
+    #     - _names: item of every index
+    #     - _index: maps item to its index
+    #     - _offsets, _targets, _weights: the upward graph in CSR form
+    #     - _middles: the index of the vertex skipped by every upward edge, -1 if it is an edge of the graph
+    #     - _searches: maps source index to its upward search space (distances, previous indices), least
+    #       recently used first
+    #     - _search_cache_size: the number of search spaces kept in _searches
+    #     - _lock: guards _searches
+    _names: list
+    _index: dict[Any, int]
+    _offsets: array
+    _targets: array
+    _weights: array
+    _middles: array
+    _searches: OrderedDict
+    _search_cache_size: int
+    _lock: threading.Lock
+
+    def __init__(self, names: list, offsets: array, targets: array, weights: array, middles: array,
+                 search_cache_size: int = DEFAULT_SEARCH_CACHE_SIZE) -> None:
+        """Initialize a hierarchy from its item table and upward CSR arrays."""
+        self._names = names
+        self._index = {item: i for i, item in enumerate(names)}
+        self._offsets = offsets
+        self._targets = targets
+        self._weights = weights
+        self._middles = middles
+        self._searches = OrderedDict()
+        self._search_cache_size = search_cache_size
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, graph: pj2_graph.Graph | pj2_graph.CompactGraph) -> ContractionHierarchy:
+        """
+        contract every vertex of graph, return the resulting hierarchy
+        the next vertex contracted is the one with the lowest edge difference (shortcuts added minus edges
+        removed) plus number of contracted neighbours plus depth in the hierarchy, which keeps both the shortcuts
+        and the upward searches few
+        """
+        compact = graph.freeze()
+        offsets, targets, weights = compact.to_arrays()
+        n = len(compact)
+        # the remaining graph: maps every neighbour of a vertex to (weight, skipped vertex) of the edge between them
+        remaining = [{} for _ in range(n)]
+        for i in range(n):
+            for position in range(offsets[i], offsets[i + 1]):
+                j = targets[position]
+                if j != i and weights[position] < remaining[i].get(j, (float('inf'),))[0]:
+                    remaining[i][j] = remaining[j][i] = (weights[position], -1)
+
+        contracted_neighbours = [0] * n
+        depth = [0] * n
+        upward = [None] * n
+        heap = [(len(_shortcuts(remaining, v)) - len(remaining[v]), v) for v in range(n)]
+        heapq.heapify(heap)
+        while heap:
+            _, v = heapq.heappop(heap)
+            shortcuts = _shortcuts(remaining, v)
+            priority = len(shortcuts) - len(remaining[v]) + contracted_neighbours[v] + depth[v]
+            if heap and priority > heap[0][0]:
+                # the priority of v grew since it was pushed, so another vertex may come first
+                heapq.heappush(heap, (priority, v))
+                continue
+            upward[v] = remaining[v]
+            for u in remaining[v]:
+                del remaining[u][v]
+                contracted_neighbours[u] += 1
+                depth[u] = max(depth[u], depth[v] + 1)
+            for u, w, weight in shortcuts:
+                if weight < remaining[u].get(w, (float('inf'),))[0]:
+                    remaining[u][w] = remaining[w][u] = (weight, v)
+            remaining[v] = {}
+
+        up_offsets = array('i', [0])
+        up_targets = array('i')
+        up_weights = array('d')
+        up_middles = array('i')
+        for v in range(n):
+            for u, (weight, middle) in upward[v].items():
+                up_targets.append(u)
+                up_weights.append(weight)
+                up_middles.append(middle)
+            up_offsets.append(len(up_targets))
+        return cls([compact.item_at(i) for i in range(n)], up_offsets, up_targets, up_weights, up_middles)
+
+    @classmethod
+    def load(cls, file_path: str) -> ContractionHierarchy:
+        """
+        read the hierarchy stored at file_path, raise ValueError if the file is not a contraction hierarchy or is
+        shorter or longer than its header says
+
+        >>> import os, tempfile
+        >>> g = pj2_graph.Graph()
+        >>> for item in ['A', 'B', 'C', 'D']:
+        ...     g.add_vertex(item)
+        >>> g.add_edge('A', 'B', 2)
+        >>> g.add_edge('B', 'C', 1)
+        >>> g.add_edge('A', 'C', 5)
+        >>> hierarchy_path = os.path.join(tempfile.mkdtemp(), 'hierarchy.bin')
+        >>> ContractionHierarchy.build(g).save(hierarchy_path)
+        >>> hierarchy = ContractionHierarchy.load(hierarchy_path)
+        >>> hierarchy.path('C', 'A'), hierarchy.distance('A', 'C')
+        (['C', 'B', 'A'], 3.0)
+        >>> hierarchy.path('A', 'D') is None
+        True
+        >>> hierarchy.distance('A', 'E')
+        Traceback (most recent call last):
+        ...
+        ValueError: End vertex not found in hierarchy.
+        >>> os.truncate(hierarchy_path, os.path.getsize(hierarchy_path) - 4)
+        >>> ContractionHierarchy.load(hierarchy_path)  # doctest: +ELLIPSIS
+        Traceback (most recent call last):
+        ...
+        ValueError: ...hierarchy.bin is not a complete contraction hierarchy file
+        """
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        if len(data) < _HEADER.size or data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{file_path} is not a contraction hierarchy file")
+        _, n, m, table_length = _HEADER.unpack_from(data, 0)
+        # weights are 8 bytes each, offsets, targets and middles 4
+        if len(data) != _HEADER.size + padded(table_length) + 8 * m + 4 * (n + 1 + 2 * m):
+            raise ValueError(f"{file_path} is not a complete contraction hierarchy file")
+        view = memoryview(data)
+        offset = _HEADER.size
+        names = json.loads(bytes(view[offset:offset + table_length]).decode('utf-8'))
+        offset += padded(table_length)
+        weights, offset = read_array(view, offset, 'd', m)
+        offsets, offset = read_array(view, offset, 'i', n + 1)
+        targets, offset = read_array(view, offset, 'i', m)
+        middles, _ = read_array(view, offset, 'i', m)
+        return cls(names, offsets, targets, weights, middles)
+
+    def save(self, file_path: str) -> None:
+        """
+        write this hierarchy to file_path, replacing the old file only once the new one is complete
+        """
+        table = json.dumps(self._names, ensure_ascii=False).encode('utf-8')
+        with atomic_write(file_path) as f:
+            f.write(_HEADER.pack(MAGIC, len(self._names), len(self._targets), len(table)))
+            f.write(table.ljust(padded(len(table)), b' '))
+            for values in (self._weights, self._offsets, self._targets, self._middles):
+                f.write(little_endian(values))
+
+    def __len__(self) -> int:
+        """Return the number of items in this hierarchy."""
+        return len(self._names)
+
+    def __contains__(self, item: Any) -> bool:
+        """Return whether item is in this hierarchy."""
+        return item in self._index
+
+    def shortcut_count(self) -> int:
+        """Return the number of upward edges that are shortcuts rather than edges of the graph."""
+        return sum(1 for middle in self._middles if middle != -1)
+
+    def distance(self, item1: Any, item2: Any) -> float:
+        """
+        return the shortest distance from item1 to item2, inf if item2 cannot be reached
+        raise ValueError if item1 or item2 is not in this hierarchy
+        """
+        return self._meet(item1, item2)[0]
+
+    def path(self, item1: Any, item2: Any) -> Optional[list]:
+        """
+        return the shortest path from item1 to item2 as a list of items, None if item2 cannot be reached
+        raise ValueError if item1 or item2 is not in this hierarchy
+        """
+        distance, meeting = self._meet(item1, item2)
+        if distance == float('inf'):
+            return None
+        source, target = self._index[item1], self._index[item2]
+        up_path = _tree_path(self._upward_search(source)[1], meeting)
+        down_path = _tree_path(self._upward_search(target)[1], meeting)
+        down_path.reverse()
+        upward_path = up_path + down_path[1:]
+        path = [source]
+        for a, b in zip(upward_path, upward_path[1:]):
+            path.extend(self._unpack(a, b))
+        return [self._names[i] for i in path]
+
+    def _meet(self, item1: Any, item2: Any) -> tuple[float, int]:
+        """Return the shortest distance from item1 to item2 and the index where their upward searches meet on
+        a shortest path (-1 if item2 cannot be reached)."""
+        if item1 not in self._index:
+            raise ValueError("Start vertex not found in hierarchy.")
+        if item2 not in self._index:
+            raise ValueError("End vertex not found in hierarchy.")
+        forward = self._upward_search(self._index[item1])[0]
+        backward = self._upward_search(self._index[item2])[0]
+        if len(backward) < len(forward):
+            forward, backward = backward, forward
+        best, meeting = float('inf'), -1
+        for i, distance in forward.items():
+            if i in backward and distance + backward[i] < best:
+                best, meeting = distance + backward[i], i
+        return best, meeting
+
+    def _upward_search(self, source: int) -> tuple[dict[int, float], dict[int, int]]:
+        """Return the (distances, previous indices) of every index reached from source by upward edges."""
+        with self._lock:
+            search = self._searches.get(source)
+            if search is not None:
+                self._searches.move_to_end(source)
+                return search
+
+        offsets, targets, weights = self._offsets, self._targets, self._weights
+        distances = {}
+        tentative = {source: 0.0}
+        previous_indices = {source: -1}
+        heap = [(0.0, source)]
+        while heap:
+            distance, current = heapq.heappop(heap)
+            if current in distances:
+                continue
+            distances[current] = distance
+            for position in range(offsets[current], offsets[current + 1]):
+                neighbour = targets[position]
+                new_distance = distance + weights[position]
+                if new_distance < tentative.get(neighbour, float('inf')):
+                    tentative[neighbour] = new_distance
+                    previous_indices[neighbour] = current
+                    heapq.heappush(heap, (new_distance, neighbour))
+
+        search = (distances, previous_indices)
+        with self._lock:
+            self._searches[source] = search
+            if len(self._searches) > self._search_cache_size:
+                self._searches.popitem(last=False)
+        return search
+
+    def _unpack(self, a: int, b: int) -> list[int]:
+        """Return the indices after a on the path of the upward edge between a and b, down to edges of the graph."""
+        path = []
+        stack = [(a, b)]
+        while stack:
+            a, b = stack.pop()
+            middle = self._middle(a, b)
+            if middle == -1:
+                path.append(b)
+            else:
+                stack.append((middle, b))
+                stack.append((a, middle))
+        return path
+
+    def _middle(self, a: int, b: int) -> int:
+        """Return the index skipped by the upward edge between a and b, -1 if it is an edge of the graph."""
+        for lower, higher in ((a, b), (b, a)):
+            for position in range(self._offsets[lower], self._offsets[lower + 1]):
+                if self._targets[position] == higher:
+                    return self._middles[position]
+        raise ValueError(f"No upward edge between indices {a} and {b} in hierarchy.")
+
+
+def load_or_build(json_path: str, hierarchy_path: str) -> ContractionHierarchy:
+    """
+    read the hierarchy at hierarchy_path, building it from the graph at json_path first if the file is missing or
+    older than json_path (once, however many processes find it so at the same time)
+    """
+    def build() -> None:
+        """Build the hierarchy of the graph at json_path and save it at hierarchy_path."""
+        graph, _ = load_graph_from_json(json_path)
+        ContractionHierarchy.build(graph).save(hierarchy_path)
+
+    build_if_outdated(hierarchy_path, json_path, build)
+    return ContractionHierarchy.load(hierarchy_path)
+
+
+def _shortcuts(remaining: list[dict], v: int) -> list[tuple[int, int, float]]:
+    """
+    return the (u, w, weight) shortcuts needed to contract v from the remaining graph: one for every pair of
+    neighbours u, w of v without a path of at most weight (the length of u, v, w) that avoids v
+    """
+    neighbours = list(remaining[v].items())
+    shortcuts = []
+    for k, (u, (weight_u, _)) in enumerate(neighbours):
+        wanted = {w: weight_u + weight_w for w, (weight_w, _) in neighbours[k + 1:]}
+        if not wanted:
+            continue
+        witnessed = _witness_search(remaining, u, v, wanted)
+        shortcuts.extend((u, w, weight) for w, weight in wanted.items() if w not in witnessed)
+    return shortcuts
+
+
+def _witness_search(remaining: list[dict], source: int, avoid: int, wanted: dict[int, float]) -> set[int]:
+    """
+    return the indices w of wanted reached from source without going through avoid within wanted[w], searching at
+    most WITNESS_SETTLE_LIMIT vertices
+    """
+    limit = max(wanted.values())
+    witnessed = set()
+    settled = 0
+    tentative = {source: 0.0}
+    heap = [(0.0, source)]
+    while heap and settled < WITNESS_SETTLE_LIMIT:
+        distance, current = heapq.heappop(heap)
+        if distance > tentative[current]:
+            continue  # stale heap entry, current was reached through a shorter path
+        settled += 1
+        if current in wanted and distance <= wanted[current]:
+            witnessed.add(current)
+            if len(witnessed) == len(wanted):
+                break
+        for neighbour, (weight, _) in remaining[current].items():
+            new_distance = distance + weight
+            if neighbour != avoid and new_distance <= limit and new_distance < tentative.get(neighbour, limit + 1):
+                tentative[neighbour] = new_distance
+                heapq.heappush(heap, (new_distance, neighbour))
+    return witnessed
+
+
+def _tree_path(previous_indices: dict[int, int], destination: int) -> list[int]:
+    """Return the indices from the source of an upward search to destination, following previous_indices."""
+    path = []
+    current = destination
+    while current != -1:
+        path.append(current)
+        current = previous_indices[current]
+    path.reverse()
+    return path
+
+
+if __name__ == '__main__':
+    # usage: python pj2_contraction_hierarchy.py [graph_output.json] [contraction_hierarchy.bin]
+    source_path = sys.argv[1] if len(sys.argv) > 1 else "graph_output.json"
+    target_path = sys.argv[2] if len(sys.argv) > 2 else "contraction_hierarchy.bin"
+    loaded_graph, _ = load_graph_from_json(source_path)
+    built = ContractionHierarchy.build(loaded_graph)
+    built.save(target_path)
+    print(f"wrote the hierarchy of {len(built)} locations ({built.shortcut_count()} shortcuts) to {target_path}")
@@ -0,0 +1,206 @@
+"""
+    all-pairs shortest distances of a graph, computed offline and stored in a binary file that can be memory-mapped
+
+file layout (little endian):
+    - 8 bytes magic, 4 bytes number of vertices n, 4 bytes length of the name table
+    - the name table, a utf-8 json list of the n items, padded with spaces to a multiple of 8 bytes
+    - n * n float64 distances, row s holds the shortest distances from the s-th item (inf if unreachable)
+    - n * n int32 predecessors, row s holds the index before every item on its shortest path from the s-th item
+      (-1 for the s-th item itself and for unreachable items)
+"""
+from __future__ import annotations
+from array import array
+from typing import Any, Optional
+import json
+import mmap
+import os
+import struct
+import sys
+
+import pj2_graph
+from json_to_class import load_graph_from_json
+from pj2_files import atomic_write, build_if_outdated, little_endian, padded
+
+MAGIC = b'PJ2DM\x00\x00\x01'
+_HEADER = struct.Struct('<8sII')
+
+
+class DistanceMatrix:
+    """The shortest distance and shortest path between every pair of items in a graph.
+
+    Lookups are O(1) reads, and paths are rebuilt from the predecessor rows only when they are asked for.
+    A matrix opened with DistanceMatrix.load reads straight from a read-only memory map, so every process that
+    loads the same file shares its pages.
+
+    Representation Invariants:
+        - len(self._distances) == len(self._predecessors) == len(self._names) ** 2
+    """
+    # Private Instance Attributes:
+    #     - _names: item of every index
+    #     - _index: maps item to its index
+    #     - _distances: flat n * n distances, row major
+    #     - _predecessors: flat n * n predecessor indices, row major
+    #     - _mmap: the memory map backing the two flat sequences, None if they live in memory
+    _names: list
+    _index: dict[Any, int]
+    _distances: Any
+    _predecessors: Any
+    _mmap: Optional[mmap.mmap]
+
+    def __init__(self, names: list, distances: Any, predecessors: Any, mapped: Optional[mmap.mmap] = None) -> None:
+        """Initialize a matrix from its item table and flat row-major distance and predecessor sequences."""
+        self._names = names
+        self._index = {item: i for i, item in enumerate(names)}
+        self._distances = distances
+        self._predecessors = predecessors
+        self._mmap = mapped
+
+    @classmethod
+    def build(cls, graph: pj2_graph.Graph | pj2_graph.CompactGraph) -> DistanceMatrix:
+        """
+        run one dijkstra from every vertex of graph, return the resulting matrix
+        >>> g = pj2_graph.Graph()
+        >>> for item in ['A', 'B', 'C', 'D']:
+        ...     g.add_vertex(item)
+        >>> g.add_edge('A', 'B', 2)
+        >>> g.add_edge('B', 'C', 1)
+        >>> g.add_edge('A', 'C', 5)
+        >>> matrix = DistanceMatrix.build(g)
+        >>> matrix.distance('A', 'C')
+        3.0
+        >>> matrix.path('C', 'A')
+        ['C', 'B', 'A']
+        >>> matrix.path('A', 'D') is None
+        True
+        """
+        compact = graph.freeze() if isinstance(graph, pj2_graph.Graph) else graph
+        n = len(compact)
+        distances = array('d')
+        predecessors = array('i')
+        for source in range(n):
+            row_distances, row_predecessors = compact.search(source)
+            distances.extend(row_distances)
+            predecessors.extend(row_predecessors)
+        return cls([compact.item_at(i) for i in range(n)], distances, predecessors)
+
+    @classmethod
+    def load(cls, file_path: str) -> DistanceMatrix:
+        """
+        memory-map the matrix stored at file_path, raise ValueError if the file is not a distance matrix or is
+        shorter or longer than its header says
+
+        >>> import os, tempfile
+        >>> g = pj2_graph.Graph()
+        >>> for item in ['A', 'B']:
+        ...     g.add_vertex(item)
+        >>> g.add_edge('A', 'B', 2)
+        >>> matrix_path = os.path.join(tempfile.mkdtemp(), 'matrix.bin')
+        >>> DistanceMatrix.build(g).save(matrix_path)
+        >>> DistanceMatrix.load(matrix_path).distance('B', 'A')
+        2.0
+        >>> os.truncate(matrix_path, os.path.getsize(matrix_path) - 4)
+        >>> DistanceMatrix.load(matrix_path)  # doctest: +ELLIPSIS
+        Traceback (most recent call last):
+        ...
+        ValueError: ...matrix.bin is not a complete distance matrix file
+        """
+        with open(file_path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(mapped) < _HEADER.size or mapped[:len(MAGIC)] != MAGIC:
+            mapped.close()
+            raise ValueError(f"{file_path} is not a distance matrix file")
+        _, n, names_length = _HEADER.unpack_from(mapped, 0)
+        offset = _HEADER.size
+        if len(mapped) != offset + padded(names_length) + 12 * n * n:
+            mapped.close()
+            raise ValueError(f"{file_path} is not a complete distance matrix file")
+        names = json.loads(bytes(mapped[offset:offset + names_length]).decode('utf-8'))
+        offset += padded(names_length)
+        view = memoryview(mapped)
+        distances = view[offset:offset + 8 * n * n].cast('d')
+        offset += 8 * n * n
+        predecessors = view[offset:offset + 4 * n * n].cast('i')
+        return cls(names, distances, predecessors, mapped)
+
+    def save(self, file_path: str) -> None:
+        """
+        write this matrix to file_path, replacing the old file only once the new one is complete
+        """
+        names = json.dumps(self._names, ensure_ascii=False).encode('utf-8')
+        n = len(self._names)
+        with atomic_write(file_path) as f:
+            f.write(_HEADER.pack(MAGIC, n, len(names)))
+            f.write(names.ljust(padded(len(names)), b' '))
+            f.write(little_endian(array('d', self._distances)))
+            f.write(little_endian(array('i', self._predecessors)))
+
+    def close(self) -> None:
+        """Release the memory map behind this matrix, if there is one."""
+        if self._mmap is not None:
+            self._distances.release()
+            self._predecessors.release()
+            self._mmap.close()
+            self._mmap = None
+
+    def __len__(self) -> int:
+        """Return the number of items in this matrix."""
+        return len(self._names)
+
+    def __contains__(self, item: Any) -> bool:
+        """Return whether item is in this matrix."""
+        return item in self._index
+
+    def distance(self, item1: Any, item2: Any) -> float:
+        """
+        return the shortest distance from item1 to item2, inf if item2 cannot be reached
+        raise ValueError if item1 or item2 is not in this matrix
+        """
+        return self._distances[self._position(item1, item2)]
+
+    def path(self, item1: Any, item2: Any) -> Optional[list]:
+        """
+        return the shortest path from item1 to item2 as a list of items, None if item2 cannot be reached
+        raise ValueError if item1 or item2 is not in this matrix
+        """
+        position = self._position(item1, item2)
+        if self._distances[position] == float('inf'):
+            return None
+        n = len(self._names)
+        row = position - position % n
+        path = []
+        current = position % n
+        while current != -1:
+            path.append(self._names[current])
+            current = self._predecessors[row + current]
+        path.reverse()
+        return path
+
+    def _position(self, item1: Any, item2: Any) -> int:
+        """Return the position of the (item1, item2) entry in the flat sequences."""
+        if item1 not in self._index or item2 not in self._index:
+            raise ValueError
+        return self._index[item1] * len(self._names) + self._index[item2]
+
+
+def load_or_build(json_path: str, matrix_path: str) -> DistanceMatrix:
+    """
+    memory-map the matrix at matrix_path, building it from the graph at json_path first if the file is missing
+    or older than json_path (once, however many processes find it so at the same time)
+    """
+    def build() -> None:
+        """Build the matrix of the graph at json_path and save it at matrix_path."""
+        graph, _ = load_graph_from_json(json_path)
+        DistanceMatrix.build(graph).save(matrix_path)
+
+    build_if_outdated(matrix_path, json_path, build)
+    return DistanceMatrix.load(matrix_path)
+
+
+if __name__ == '__main__':
+    # usage: python pj2_distance_matrix.py [graph_output.json] [distance_matrix.bin]
+    source = sys.argv[1] if len(sys.argv) > 1 else "graph_output.json"
+    target = sys.argv[2] if len(sys.argv) > 2 else "distance_matrix.bin"
+    loaded_graph, _ = load_graph_from_json(source)
+    built = DistanceMatrix.build(loaded_graph)
+    built.save(target)
+    print(f"wrote the distances between {len(built)} locations to {target}")
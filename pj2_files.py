@@ -0,0 +1,138 @@
+"""
+    writing the files built offline (distance matrix, graph snapshot, contraction hierarchy) when several server
+    processes may start at once and find the same file missing or outdated, and the binary layout they share
+
+every writer gets its own temporary file, which replaces the target only once it is complete, and the builds of
+one target are serialized by an exclusive lock so the file is built once instead of once per process
+
+every file is a header, a json name table padded with spaces to a multiple of 8 bytes, and arrays of numbers in
+little endian order
+"""
+from __future__ import annotations
+from array import array
+from contextlib import contextmanager
+from typing import BinaryIO, Callable, Iterator
+import os
+import sys
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, where concurrent builds only waste time (the writes are still atomic)
+    fcntl = None
+
+
+@contextmanager
+def atomic_write(file_path: str) -> Iterator[BinaryIO]:
+    """
+    open a new temporary file next to file_path for writing, and replace file_path with it once the block
+    completes; the temporary file is removed instead if the block raises
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'data.bin')
+    >>> with atomic_write(path) as f:
+    ...     _ = f.write(b'complete')
+    >>> with atomic_write(path) as f:
+    ...     _ = f.write(b'partial')
+    ...     raise RuntimeError('interrupted')
+    Traceback (most recent call last):
+    ...
+    RuntimeError: interrupted
+    >>> open(path, 'rb').read(), os.listdir(os.path.dirname(path))
+    (b'complete', ['data.bin'])
+    """
+    directory = os.path.dirname(os.path.abspath(file_path))
+    descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(file_path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as f:
+            yield f
+        # mkstemp only lets the owner read the file, other processes of the server may run as other users
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+@contextmanager
+def build_lock(file_path: str) -> Iterator[None]:
+    """
+    hold an exclusive lock on file_path + '.lock' during the block, so only one process builds file_path at a time
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(file_path + '.lock', 'ab') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def is_outdated(file_path: str, source_path: str) -> bool:
+    """Return whether file_path is missing or older than source_path."""
+    return not os.path.exists(file_path) or os.path.getmtime(file_path) < os.path.getmtime(source_path)
+
+
+def build_if_outdated(file_path: str, source_path: str, build: Callable[[], None]) -> None:
+    """
+    call build to write file_path if it is missing or older than source_path; a process that waited for another
+    one building the same file does not build it again
+
+    >>> import os, tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> source, target = os.path.join(directory, 'graph.json'), os.path.join(directory, 'graph.bin')
+    >>> _ = open(source, 'w').write('{}')
+    >>> builds = []
+    >>> def build() -> None:
+    ...     builds.append(target)
+    ...     with atomic_write(target) as f:
+    ...         _ = f.write(b'built')
+    >>> build_if_outdated(target, source, build)
+    >>> build_if_outdated(target, source, build)
+    >>> len(builds)
+    1
+    """
+    if not is_outdated(file_path, source_path):
+        return
+    with build_lock(file_path):
+        if is_outdated(file_path, source_path):
+            build()
+
+
+def padded(length: int) -> int:
+    """Return length rounded up to a multiple of 8."""
+    return (length + 7) // 8 * 8
+
+
+def little_endian(values: array) -> bytes:
+    """Return the bytes of values in little endian order."""
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def read_array(view: memoryview, offset: int, typecode: str, count: int) -> tuple[array, int]:
+    """
+    return the count values of typecode stored at offset in view, and the offset right after them
+    raise ValueError if view ends before them
+
+    >>> view = memoryview(little_endian(array('i', [1, 2, 3])))
+    >>> read_array(view, 4, 'i', 2)
+    (array('i', [2, 3]), 12)
+    >>> read_array(view, 4, 'i', 3)
+    Traceback (most recent call last):
+    ...
+    ValueError: 3 values of typecode 'i' at offset 4 run past the end of the data (12 bytes)
+    """
+    values = array(typecode)
+    end = offset + values.itemsize * count
+    if end > len(view):
+        raise ValueError(f"{count} values of typecode {typecode!r} at offset {offset} run past the end of the data "
+                         f"({len(view)} bytes)")
+    values.frombytes(view[offset:end])
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values, end
@@ -4,6 +4,24 @@ project2: weighted graph
 
 from __future__ import annotations
 from typing import Any, Optional
+from array import array
+from collections import OrderedDict
+import heapq
+import math
+import sys
+import threading
+
+# default memory budget of the shortest path tree cache of every Graph, in bytes
+DEFAULT_TREE_CACHE_BYTES = 8 * 1024 * 1024
+
+# mean radius of the earth, in metres
+EARTH_RADIUS = 6371008.8
+
+# the path of every edge added without one, never modified
+_NO_PATH = ()
+
+# estimated bytes of the number object holding one distance of a cached shortest path tree
+_NUMBER_BYTES = 32
 
 
 class _Vertex:
@@ -118,6 +136,159 @@ class _Vertex:
         return result
 
 
+class _TreeCache:
+    """A bounded least-recently-used cache of shortest path trees, keyed by the source of the search.
+
+    Every entry belongs to one graph version. As soon as the cache is used with a newer version, every older entry
+    is stale and the whole cache is dropped. The cache may be used by several threads at once.
+
+    The size of a tree is estimated as the size of its two dicts plus one number object (its distance) per item;
+    the items themselves belong to the graph.
+
+    Representation Invariants:
+        - self.size_bytes <= self.max_bytes
+        - self.size_bytes == sum(entry[2] for entry in self._entries.values())
+    """
+    # Private Instance Attributes:
+    #     - _entries: maps source to (distances, previous_nodes, estimated size in bytes), least recent first
+    #     - _version: the graph version of every entry in _entries
+    #     - _lock: guards every other attribute
+    max_bytes: int
+    size_bytes: int
+    hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+    _entries: OrderedDict
+    _version: int
+    _lock: threading.Lock
+
+    def __init__(self, max_bytes: int) -> None:
+        """Initialize an empty cache holding at most max_bytes of trees."""
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def get(self, source: Any, version: int) -> Optional[tuple[dict, dict]]:
+        """Return the cached (distances, previous_nodes) tree of source at the given version, or None."""
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(source)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(source)
+            return entry[0], entry[1]
+
+    def put(self, source: Any, version: int, distances: dict, previous_nodes: dict) -> None:
+        """Store the tree of source at the given version, evicting the least recently used trees to make room."""
+        size = sys.getsizeof(distances) + sys.getsizeof(previous_nodes) + len(distances) * _NUMBER_BYTES
+        if size > self.max_bytes:
+            return  # a tree larger than the whole budget would only flush every other tree
+        with self._lock:
+            self._check_version(version)
+            if source in self._entries:
+                self.size_bytes -= self._entries.pop(source)[2]
+            while self.size_bytes + size > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.size_bytes -= evicted_size
+                self.evictions += 1
+            self._entries[source] = (distances, previous_nodes, size)
+            self.size_bytes += size
+
+    def stats(self) -> dict[str, int]:
+        """Return the counters and the current size of this cache."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'invalidations': self.invalidations, 'entries': len(self._entries),
+                    'size_bytes': self.size_bytes, 'max_bytes': self.max_bytes}
+
+    def _check_version(self, version: int) -> None:
+        """Drop every entry if they belong to an older graph version than version.
+
+        Preconditions:
+            - self._lock is held
+        """
+        if version != self._version:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self.size_bytes = 0
+            self._version = version
+
+
+class _ConnectivityIndex:
+    """Incrementally maintained connectivity of a graph.
+
+    Connected components are tracked by a union-find structure that is updated by every new edge. The vertices
+    that lie on a cycle (equivalently, the endpoints of edges that are not bridges) are found by one iterative
+    bridge search, repeated only after the graph has changed.
+
+    Representation Invariants:
+        - all(self._find(item) in self._members for item in self._parent)
+        - sum(len(members) for members in self._members.values()) == len(self._parent)
+    """
+    # Private Instance Attributes:
+    #     - _parent: union-find parent of every item, roots are their own parent
+    #     - _members: maps every root to the set of items in its component
+    #     - _on_cycle: the items that are in a cycle, None if they must be recomputed
+    _parent: dict[Any, Any]
+    _members: dict[Any, set]
+    _on_cycle: Optional[set]
+
+    def __init__(self) -> None:
+        """Initialize an index of a graph without vertices."""
+        self._parent = {}
+        self._members = {}
+        self._on_cycle = None
+
+    def add_item(self, item: Any) -> None:
+        """Record a new vertex that is not adjacent to any other vertex."""
+        self._parent[item] = item
+        self._members[item] = {item}
+        self._on_cycle = None
+
+    def union(self, item1: Any, item2: Any) -> None:
+        """Record a new edge between item1 and item2, merging the smaller component into the larger one."""
+        self._on_cycle = None
+        root1 = self._find(item1)
+        root2 = self._find(item2)
+        if root1 == root2:
+            return
+        if len(self._members[root1]) < len(self._members[root2]):
+            root1, root2 = root2, root1
+        self._parent[root2] = root1
+        self._members[root1].update(self._members.pop(root2))
+
+    def connected(self, item1: Any, item2: Any) -> bool:
+        """Return whether item1 and item2 are in the same component."""
+        return self._find(item1) == self._find(item2)
+
+    def component(self, item: Any) -> set:
+        """Return a new set of the items in the component of item."""
+        return set(self._members[self._find(item)])
+
+    def on_cycle(self, item: Any, vertices: dict[Any, _Vertex]) -> bool:
+        """Return whether item is in a cycle of the graph whose vertices are given."""
+        if self._on_cycle is None:
+            self._on_cycle = _cycle_items(vertices)
+        return item in self._on_cycle
+
+    def _find(self, item: Any) -> Any:
+        """Return the root of the component of item, halving the path to it on the way."""
+        parent = self._parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+
 class Graph:
     """A graph.
 
@@ -128,25 +299,101 @@ class Graph:
     #     - _vertices:
     #         A collection of the vertices contained in this graph.
     #         Maps item to _Vertex object.
+    #     - _version:
+    #         Incremented by every change to the vertices or edges, so results computed earlier can be recognised
+    #         as stale.
+    #     - _tree_cache:
+    #         The most recently used shortest path trees of this graph.
+    #     - _connectivity:
+    #         The connected components and cycle membership of the vertices, None if it must be rebuilt because a
+    #         vertex was replaced.
+    #     - _frozen:
+    #         The version and CompactGraph snapshot returned by the last call to freeze, None if never frozen.
+    #     - _coordinates:
+    #         Maps item to its (latitude, longitude), for the vertices added with coordinates.
+    #     - _speed_bounds:
+    #         Maps every edge mode to the highest great-circle speed (metres per unit of weight) of an edge of that
+    #         mode with a positive weight. Edges are never forgotten here, so the bounds can only be too high.
+    #     - _zero_weight_slack:
+    #         The total great-circle length of the edges with weight 0, which no speed can bound.
+    #     - _uncoordinated_edges:
+    #         The number of edges added between vertices that were not both added with coordinates.
     _vertices: dict[Any, _Vertex]
-
-    def __init__(self) -> None:
-        """Initialize an empty graph (no vertices or edges)."""
+    _version: int
+    _tree_cache: _TreeCache
+    _connectivity: Optional[_ConnectivityIndex]
+    _frozen: Optional[tuple[int, CompactGraph]]
+    _coordinates: dict[Any, tuple[float, float]]
+    _speed_bounds: dict[Optional[str], float]
+    _zero_weight_slack: float
+    _uncoordinated_edges: int
+
+    def __init__(self, tree_cache_bytes: int = DEFAULT_TREE_CACHE_BYTES) -> None:
+        """Initialize an empty graph (no vertices or edges).
+
+        tree_cache_bytes is the memory budget of the shortest path tree cache, 0 disables the cache.
+        """
         self._vertices = {}
+        self._version = 0
+        self._tree_cache = _TreeCache(tree_cache_bytes)
+        self._connectivity = _ConnectivityIndex()
+        self._frozen = None
+        self._coordinates = {}
+        self._speed_bounds = {}
+        self._zero_weight_slack = 0.0
+        self._uncoordinated_edges = 0
+
+    @property
+    def version(self) -> int:
+        """The number of changes made to this graph so far."""
+        return self._version
+
+    def cache_stats(self) -> dict[str, int]:
+        """Return the hit, miss, eviction and invalidation counters and the size of the shortest path tree cache.
+
+        >>> g = Graph()
+        >>> g.add_vertex('A')
+        >>> g.add_vertex('B')
+        >>> g.add_edge('A', 'B', 1)
+        >>> _ = g.dijkstra('A')
+        >>> _ = g.dijkstra('A')
+        >>> stats = g.cache_stats()
+        >>> stats['hits'], stats['misses'], stats['entries']
+        (1, 1, 1)
+        >>> g.add_vertex('C')
+        >>> _ = g.dijkstra('A')
+        >>> stats = g.cache_stats()
+        >>> stats['misses'], stats['invalidations']
+        (2, 1)
+        """
+        return self._tree_cache.stats()
 
-    def add_vertex(self, item: Any) -> None:
+    def add_vertex(self, item: Any, coordinates: Optional[tuple[float, float]] = None) -> None:
         """Add a vertex with the given item to this graph.
 
         The new vertex is not adjacent to any other vertices.
 
         the neighbour is deflaut to be empty
+        coordinates is the optional (latitude, longitude) of the vertex, used by astar
         """
+        if item in self._vertices:
+            # the old vertex and its edges are dropped, which the union-find structure cannot undo
+            self._connectivity = None
+        elif self._connectivity is not None:
+            self._connectivity.add_item(item)
         self._vertices[item] = _Vertex(item, {})
+        if coordinates is not None:
+            self._coordinates[item] = (coordinates[0], coordinates[1])
+        else:
+            self._coordinates.pop(item, None)
+        self._version += 1
 
-    def add_edge(self, item1: Any, item2: Any, weight: int, path: Optional[list] = None) -> None:
+    def add_edge(self, item1: Any, item2: Any, weight: int, path: Optional[list] = None,
+                 mode: Optional[str] = None) -> None:
         """Add an edge between the two vertices with the given items in this graph.
 
         Raise a ValueError if item1 or item2 do not appear as vertices in this graph.
+        mode is the optional way of travelling along the edge ('walking' or 'driving' in graph_output.json)
 
         Preconditions:
             - item1 != item2
@@ -155,10 +402,14 @@ class Graph:
             v1 = self._vertices[item1]
             v2 = self._vertices[item2]
 
-            # Add the new edge
-            path = {} if not path else path
+            # Add the new edge; edges without a path share one empty path instead of allocating their own
+            path = _NO_PATH if not path else path
             v1.neighbours[v2] = (weight, path)
             v2.neighbours[v1] = (weight, path)
+            self._version += 1
+            if self._connectivity is not None:
+                self._connectivity.union(item1, item2)
+            self._record_speed(item1, item2, weight, mode)
         else:
             # We didn't find an existing vertex for both items.
             raise ValueError
@@ -225,8 +476,7 @@ class Graph:
         False
         """
         if item1 in self._vertices and item2 in self._vertices:
-            v1 = self._vertices[item1]
-            return v1.check_connected(item2, set())  # Pass in an empty "visited" set
+            return self._get_connectivity().connected(item1, item2)
         else:
             return False
 
@@ -245,13 +495,12 @@ class Graph:
         >>> g.get_connected_component(0) == {0, 1, 2, 3}
         True
 
-        Note: we've implemented this method for you, and you should not change it.
-        Instead, your task is to implement _Vertex.get_connected_component below.
+        The components are kept up to date by add_edge, so no search is needed here.
         """
         if item not in self._vertices:
             raise ValueError
         else:
-            return self._vertices[item].get_connected_component(set())
+            return self._get_connectivity().component(item)
 
     def in_cycle(self, item: Any) -> bool:
         """Return whether the given item is in a cycle in this graph.
@@ -275,22 +524,26 @@ class Graph:
         False
 
         Implementation notes:
-            1. This method should call _Vertex.check_connected (following the above
-               description).
-            2. Don't try to make this method recursive, or copy and paste the implementation
-               of _Vertex.check_connected! That's not necessary here.
+            Equivalently, v is in a cycle if and only if one of its edges is not a bridge. All bridges are found
+            by one search the first time this is asked after the graph changed, every later query is a lookup.
         """
         if item not in self._vertices:
             return False
         else:
-            # vertex should connect with two vertex, and these two vertex should connect to each other without
-            # visiting vertex
-            vertex = self._vertices[item]
-            for neighbour1 in vertex.neighbours:
-                for neighbour2 in vertex.neighbours:
-                    if neighbour1.item != neighbour2.item and neighbour1.check_connected(neighbour2.item, {vertex}):
-                        return True
-            return False
+            return self._get_connectivity().on_cycle(item, self._vertices)
+
+    def _get_connectivity(self) -> _ConnectivityIndex:
+        """Return the connectivity index of this graph, rebuilding it from the vertices if it was dropped."""
+        if self._connectivity is None:
+            index = _ConnectivityIndex()
+            for item in self._vertices:
+                index.add_item(item)
+            for item, vertex in self._vertices.items():
+                for neighbour in vertex.neighbours:
+                    if neighbour.item in self._vertices:
+                        index.union(item, neighbour.item)
+            self._connectivity = index
+        return self._connectivity
 
     def comp_path(self, path: list) -> int:
         """
@@ -389,36 +642,28 @@ class Graph:
     #         start_point_vertex = simp_comp_graph._vertices[next_point.item]
     #     return path
 
-    def greedy_dijkstra(self, start: Any, targets: list[Any]) -> list:
-        visited = set()
-        current = start
-        path = [current]
-        visited.add(current)
-
-        while not all(t in visited for t in targets):
-            # Run dijkstra on original graph
-            dijkstra_paths = self.dijkstra(current)
-            # Find nearest unvisited target
-            min_target = None
-            min_path = None
-            min_cost = float('inf')
-            for t in targets:
-                if t not in visited and dijkstra_paths[t] is not None:
-                    cost = self.comp_path(dijkstra_paths[t])
-                    if cost < min_cost:
-                        min_cost = cost
-                        min_target = t
-                        min_path = dijkstra_paths[t]
-
-            if min_target is None:
-                break  # no reachable targets
-
-            # Add the new path, excluding current since it's already in path
-            path += min_path[1:]
-            visited.add(min_target)
-            current = min_target
-
-        return path
+    def greedy_dijkstra(self, start: Any, targets: list[Any], oracle: Any = None) -> list:
+        """
+        always move to the nearest unvisited target, return the whole path starting at start
+        every leg is one search that stops at the first unvisited target it settles (see nearest_target)
+        oracle is an optional precomputed distance oracle (such as pj2_distance_matrix.DistanceMatrix) providing
+        distance(item1, item2) and path(item1, item2), used instead of searching this graph
+        >>> g = Graph()
+        >>> for item in ['A', 'B', 'C', 'D', 'E', 'F', 'G']:
+        ...     g.add_vertex(item)
+        >>> g.add_edge('A', 'B', 2)
+        >>> g.add_edge('A', 'C', 5)
+        >>> g.add_edge('B', 'D', 1)
+        >>> g.add_edge('B', 'E', 3)
+        >>> g.add_edge('C', 'E', 2)
+        >>> g.add_edge('C', 'F', 6)
+        >>> g.add_edge('D', 'G', 4)
+        >>> g.add_edge('E', 'G', 1)
+        >>> g.add_edge('F', 'G', 3)
+        >>> g.greedy_dijkstra('A', ['A', 'F', 'D'])
+        ['A', 'B', 'D', 'G', 'F']
+        """
+        return _greedy_tour(self, start, targets, oracle)
 
     def get_Vertex(self, item: Any) -> _Vertex:
         """
@@ -428,9 +673,42 @@ class Graph:
             raise ValueError
         return self._vertices[item]
 
-    def dijkstra(self, start: Any) -> dict:
+    def freeze(self) -> CompactGraph:
+        """
+        return a read-only CompactGraph snapshot of this graph
+        later changes to this graph are not reflected in the snapshot, and the same snapshot is returned again
+        until this graph changes
+        >>> g = Graph()
+        >>> for item in ['A', 'B', 'C']:
+        ...     g.add_vertex(item)
+        >>> g.add_edge('A', 'B', 2)
+        >>> g.add_edge('B', 'C', 1)
+        >>> compact = g.freeze()
+        >>> compact.dijkstra('A') == g.dijkstra('A')
+        True
+        >>> g.freeze() is compact
+        True
+        """
+        if self._frozen is not None and self._frozen[0] == self._version:
+            return self._frozen[1]
+        names = list(self._vertices)
+        index = {item: i for i, item in enumerate(names)}
+        offsets = array('i', [0])
+        targets = array('i')
+        weights = array('d')
+        for item in names:
+            for neighbour, (weight, _) in self._vertices[item].neighbours.items():
+                targets.append(index[neighbour.item])
+                weights.append(weight)
+            offsets.append(len(targets))
+        compact = CompactGraph(names, offsets, targets, weights, self._version)
+        self._frozen = (self._version, compact)
+        return compact
+
+    def dijkstra(self, start: Any, targets: Optional[list[Any]] = None) -> dict:
         """
         to transform a graph into a dictionary about start to all other point's path
+        if targets is given, only the paths to targets are returned, and the search stops once all of them are found
         Precondition:
         - start in graph
         # complex method
@@ -472,49 +750,229 @@ class Graph:
         ['A', 'B', 'E', 'G']
         >>> g.comp_path(shortest_paths['G'])
         6
+        >>> g.dijkstra('A', ['D', 'E'])
+        {'D': ['A', 'B', 'D'], 'E': ['A', 'B', 'E']}
         """
         if start not in self._vertices:
             raise ValueError("Start vertex not found in graph.")
 
-        # Step 1: Initialize distances and previous nodes
-        shortest_distances = {vertex: float('inf') for vertex in self._vertices}
-        previous_nodes = {vertex: None for vertex in self._vertices}
-        shortest_distances[start] = 0
-
-        # Set of unvisited nodes
-        unvisited = set(self._vertices.keys())
+        distances, previous_nodes = self.shortest_path_tree(start, targets)
 
-        while unvisited:
-            # Select the vertex with the smallest known distance
-            current = min(unvisited, key=lambda vertex: shortest_distances[vertex])
-
-            # If the smallest distance is still infinity, break (remaining nodes are unreachable)
-            if shortest_distances[current] == float('inf'):
-                break
-
-            # Process each neighbor of the current vertex
-            for neighbor, (weight, _) in self._vertices[current].neighbours.items():
-                new_distance = shortest_distances[current] + weight
-                if new_distance < shortest_distances[neighbor.item]:
-                    shortest_distances[neighbor.item] = new_distance
-                    previous_nodes[neighbor.item] = current  # Track path
-
-            # Mark the node as visited
-            unvisited.remove(current)
-
-        # Step 2: Build paths dictionary
+        # Build paths dictionary, None for every destination that cannot be reached
+        destinations = self._vertices if targets is None else targets
         paths = {}
-        for destination in self._vertices:
-            path = []
-            current = destination
-            while current is not None:
-                path.append(current)
-                current = previous_nodes[current]
-            path.reverse()
-            paths[destination] = path if path[0] == start else None  # Ensure valid path
-
+        for destination in destinations:
+            if destination in distances:
+                paths[destination] = _build_path(previous_nodes, destination)
+            else:
+                paths[destination] = None
         return paths
 
+    def shortest_path_tree(self, start: Any, targets: Optional[list[Any]] = None) -> tuple[dict, dict]:
+        """
+        run dijkstra from start with a binary heap, return a tuple (distances, previous_nodes)
+        distances maps every settled item to its shortest distance from start
+        previous_nodes maps every settled item to the item before it on its shortest path (None for start)
+        if targets is given, the search stops as soon as every reachable target is settled
+        complete trees (targets is None) are kept in the shortest path tree cache and returned from it, so the
+        returned dicts must not be modified; a search with targets never reads the cache, so its result does not
+        depend on which trees happen to be cached
+        Precondition:
+        - start in graph
+        >>> g = Graph()
+        >>> for item in ['A', 'B', 'C', 'D']:
+        ...     g.add_vertex(item)
+        >>> g.add_edge('A', 'B', 2)
+        >>> g.add_edge('B', 'C', 1)
+        >>> g.add_edge('A', 'C', 5)
+        >>> distances, previous_nodes = g.shortest_path_tree('A')
+        >>> distances == {'A': 0, 'B': 2, 'C': 3}
+        True
+        >>> previous_nodes['C']
+        'B'
+        >>> g.shortest_path_tree('A', ['B'])[0] == {'A': 0, 'B': 2}
+        True
+        """
+        if start not in self._vertices:
+            raise ValueError("Start vertex not found in graph.")
+        if targets is not None:
+            return self._search(start, {t for t in targets if t != start}, False)
+        cached = self._tree_cache.get(start, self._version)
+        if cached is not None:
+            return cached
+        distances, previous_nodes = self._search(start, None, False)
+        self._tree_cache.put(start, self._version, distances, previous_nodes)
+        return distances, previous_nodes
+
+    def nearest_target(self, start: Any, targets: list[Any]) -> Optional[tuple[Any, float, list]]:
+        """
+        return a tuple (target, distance, path) for the target closest to start, None if no target can be reached
+        the search stops at the first target it settles, so only the vertices closer than that target are visited
+        start itself counts as a target at distance 0 if it is in targets
+        the search never uses the tree cache, so of equally close targets the same one is returned whatever was
+        searched before
+        raise ValueError if start is not in graph
+        >>> g = Graph()
+        >>> for item in ['A', 'B', 'C', 'D', 'E']:
+        ...     g.add_vertex(item)
+        >>> g.add_edge('A', 'B', 2)
+        >>> g.add_edge('B', 'C', 1)
+        >>> g.add_edge('A', 'D', 5)
+        >>> g.nearest_target('A', ['C', 'D'])
+        ('C', 3, ['A', 'B', 'C'])
+        >>> g.nearest_target('A', ['E']) is None
+        True
+        >>> g.add_vertex('F')
+        >>> g.add_edge('A', 'F', 3)
+        >>> before = g.nearest_target('A', ['C', 'F'])
+        >>> _ = g.shortest_path_tree('A')
+        >>> g.nearest_target('A', ['C', 'F']) == before
+        True
+        """
+        if start not in self._vertices:
+            raise ValueError("Start vertex not found in graph.")
+        target_set = set(targets)
+        distances, previous_nodes = self._search(start, target_set, True)
+        # the search stops right after settling the first target, which is therefore the last settled item
+        last = next(reversed(distances))
+        if last not in target_set:
+            return None
+        return last, distances[last], _build_path(previous_nodes, last)
+
+    def _search(self, start: Any, targets: Optional[set], first_only: bool) -> tuple[dict, dict]:
+        """Run dijkstra from start, return the (distances, previous_nodes) of every settled item.
+
+        If targets is None the whole component of start is settled. Otherwise the search stops once every item in
+        targets is settled, or once the first one is settled if first_only is True. targets may be modified.
+        """
+        distances = {}
+        previous_nodes = {start: None}
+        tentative = {start: 0}
+        # the counter breaks ties so that items never have to be compared with each other
+        counter = 0
+        heap = [(0, counter, start)]
+
+        while heap:
+            distance, _, current = heapq.heappop(heap)
+            if current in distances:
+                continue  # stale heap entry, current was settled through a shorter path
+            distances[current] = distance
+            if targets is not None:
+                if first_only:
+                    if current in targets:
+                        break
+                else:
+                    targets.discard(current)
+                    if not targets:
+                        break
+
+            for neighbour, (weight, _) in self._vertices[current].neighbours.items():
+                item = neighbour.item
+                new_distance = distance + weight
+                if item not in distances and new_distance < tentative.get(item, float('inf')):
+                    tentative[item] = new_distance
+                    previous_nodes[item] = current
+                    counter += 1
+                    heapq.heappush(heap, (new_distance, counter, item))
+
+        return distances, {item: previous_nodes[item] for item in distances}
+
+    def astar(self, start: Any, end: Any, max_speed: Optional[float] = None) -> Optional[list]:
+        """
+        return the shortest path from start to end as a list of items, None if end cannot be reached
+        the search is guided towards end by a lower bound on the remaining weight: the great-circle distance to end
+        divided by a maximum speed, so only vertices that can still lie on a shorter path are visited
+        by default the maximum speed is the highest great-circle speed of any edge, over every edge mode, which keeps
+        the bound admissible however the edge weights were measured; a max_speed that is too low may give a longer
+        path. Without coordinates for every vertex the search is a plain dijkstra
+        raise ValueError if start or end is not in graph
+        >>> g = Graph()
+        >>> g.add_vertex('A', (43.660, -79.400))
+        >>> g.add_vertex('B', (43.661, -79.400))
+        >>> g.add_vertex('C', (43.662, -79.400))
+        >>> g.add_vertex('D', (43.660, -79.390))
+        >>> g.add_edge('A', 'B', 90, mode='walking')
+        >>> g.add_edge('B', 'C', 90, mode='walking')
+        >>> g.add_edge('A', 'D', 700, mode='walking')
+        >>> g.add_edge('D', 'C', 20, mode='driving')
+        >>> g.astar('A', 'C')
+        ['A', 'B', 'C']
+        >>> g.astar('C', 'D')
+        ['C', 'D']
+        """
+        if start not in self._vertices or end not in self._vertices:
+            raise ValueError("Start or end vertex not found in graph.")
+        speed = max_speed if max_speed is not None else max(self._speed_bounds.values(), default=0.0)
+        guided = speed > 0 and self._uncoordinated_edges == 0 and len(self._coordinates) == len(self._vertices)
+        goal = self._coordinates.get(end)
+        bounds = {}
+
+        def lower_bound(item: Any) -> float:
+            """Return a lower bound on the weight of any path from item to end."""
+            if not guided:
+                return 0
+            if item not in bounds:
+                bounds[item] = max(0.0, haversine(self._coordinates[item], goal) - self._zero_weight_slack) / speed
+            return bounds[item]
+
+        best = {start: 0}
+        previous_nodes = {start: None}
+        # the counter breaks ties so that items never have to be compared with each other
+        counter = 0
+        heap = [(lower_bound(start), 0, counter, start)]
+        while heap:
+            _, distance, _, current = heapq.heappop(heap)
+            if distance > best[current]:
+                continue  # stale heap entry, current was reached through a shorter path since
+            if current == end:
+                return _build_path(previous_nodes, end)
+            for neighbour, (weight, _) in self._vertices[current].neighbours.items():
+                item = neighbour.item
+                new_distance = distance + weight
+                if new_distance < best.get(item, float('inf')):
+                    # a vertex may be reached again through a shorter path, since the bound need not be consistent
+                    best[item] = new_distance
+                    previous_nodes[item] = current
+                    counter += 1
+                    heapq.heappush(heap, (new_distance + lower_bound(item), new_distance, counter, item))
+        return None
+
+    def _record_speed(self, item1: Any, item2: Any, weight: float, mode: Optional[str]) -> None:
+        """Update the speed bounds used by astar with a new edge."""
+        if item1 not in self._coordinates or item2 not in self._coordinates:
+            self._uncoordinated_edges += 1
+            return
+        length = haversine(self._coordinates[item1], self._coordinates[item2])
+        if weight > 0:
+            self._speed_bounds[mode] = max(self._speed_bounds.get(mode, 0.0), length / weight)
+        else:
+            self._zero_weight_slack += length
+
+    def shortest_path(self, start: Any, end: Any) -> Optional[list]:
+        """
+        return the shortest path from start to end as a list of items, None if end cannot be reached
+        the search stops as soon as end is settled, instead of settling the whole graph
+        raise ValueError if start or end is not in graph
+        >>> g = Graph()
+        >>> for item in ['A', 'B', 'C', 'D']:
+        ...     g.add_vertex(item)
+        >>> g.add_edge('A', 'B', 2)
+        >>> g.add_edge('B', 'C', 1)
+        >>> g.add_edge('A', 'C', 5)
+        >>> g.shortest_path('A', 'C')
+        ['A', 'B', 'C']
+        >>> g.shortest_path('A', 'A')
+        ['A']
+        >>> g.shortest_path('A', 'D') is None
+        True
+        """
+        if end not in self._vertices:
+            raise ValueError("End vertex not found in graph.")
+        distances, previous_nodes = self.shortest_path_tree(start, [end])
+        if end not in distances:
+            return None
+        return _build_path(previous_nodes, end)
+
     def simplify_dijkstra(self, targets: list[Any], paths: dict) -> dict:
         """
         to return a dict that only contains the target vertices that are required to be reached
@@ -553,10 +1011,11 @@ class Graph:
                 new_paths[path] = paths[path]
         return new_paths
 
-    def generate_complete_graph(self, targets: list[Any]) -> Graph:
+    def generate_complete_graph(self, targets: list[Any], oracle: Any = None) -> Graph:
         """
         return a new complete graph, according to paths input
         (dict of dijkstra graph {item: its paths to other targets})
+        if a distance oracle (see greedy_dijkstra) is given, the weights and paths are read from it instead
         >>> g = Graph()
         >>> g.add_vertex('A')
         >>> g.add_vertex('B')
@@ -584,6 +1043,16 @@ class Graph:
         >>> g_g.get_neighbours('A')
         {'B', 'G'}
         """
+        if oracle is not None:
+            g = Graph()
+            for item in targets:
+                g.add_vertex(item)
+            for item1 in targets:
+                for item2 in targets:
+                    if item1 != item2 and oracle.path(item1, item2) is not None:
+                        g.add_edge(item1, item2, oracle.distance(item1, item2), oracle.path(item1, item2)[1: -1])
+            return g
+
         paths = {item: self.simplify_dijkstra(targets, self.dijkstra(item)) for item in targets}
         g = Graph()
         # firstly add all vertices
@@ -595,3 +1064,426 @@ class Graph:
                 if target != item:
                     g.add_edge(item, target, self.comp_path(paths[item][target]), paths[item][target][1: -1])
         return g
+
+
+class CompactGraph:
+    """A frozen graph stored in compressed sparse row (CSR) form.
+
+    Every item is interned to an integer index. The neighbours of the vertex with index i are
+    targets[offsets[i]:offsets[i + 1]], and the weights of these edges are stored at the same positions in weights.
+    Queries accept and return items, in the same way as Graph, so a CompactGraph can be used wherever a Graph is
+    only read.
+
+    Instance Attributes:
+        - version: the version of the Graph this snapshot was taken from, 0 if it was loaded from a file
+
+    Representation Invariants:
+        - len(self._offsets) == len(self._names) + 1
+        - len(self._targets) == len(self._weights) == self._offsets[-1]
+        - all(self._index[self._names[i]] == i for i in range(len(self._names)))
+    """
+    # Private Instance Attributes:
+    #     - _names: item of every index
+    #     - _index: maps item to its index
+    #     - _offsets, _targets, _weights: the CSR adjacency arrays
+    #     - _components: connected component label of every index, computed on first use
+    version: int
+    _names: list
+    _index: dict[Any, int]
+    _offsets: array
+    _targets: array
+    _weights: array
+    _components: Optional[array]
+
+    def __init__(self, names: list, offsets: array, targets: array, weights: array, version: int = 0) -> None:
+        """Initialize a compact graph from its item table and CSR arrays."""
+        self.version = version
+        self._names = names
+        self._index = {item: i for i, item in enumerate(names)}
+        self._offsets = offsets
+        self._targets = targets
+        self._weights = weights
+        self._components = None
+
+    def __len__(self) -> int:
+        """Return the number of vertices in this graph."""
+        return len(self._names)
+
+    def __contains__(self, item: Any) -> bool:
+        """Return whether item is a vertex in this graph."""
+        return item in self._index
+
+    def index_of(self, item: Any) -> int:
+        """
+        return the integer index of item, raise ValueError if item not in graph
+        """
+        if item not in self._index:
+            raise ValueError
+        return self._index[item]
+
+    def item_at(self, index: int) -> Any:
+        """
+        return the item stored at index
+        """
+        return self._names[index]
+
+    def to_arrays(self) -> tuple[array, array, array]:
+        """
+        return the (offsets, targets, weights) CSR arrays of this graph, which must not be modified
+        """
+        return self._offsets, self._targets, self._weights
+
+    def freeze(self) -> CompactGraph:
+        """
+        return this graph, which is already read-only
+        """
+        return self
+
+    def adjacent(self, item1: Any, item2: Any) -> bool:
+        """Return whether item1 and item2 are adjacent vertices in this graph.
+
+        Return False if item1 or item2 do not appear as vertices in this graph.
+        """
+        if item1 in self._index and item2 in self._index:
+            return self._edge_weight(self._index[item1], self._index[item2]) is not None
+        else:
+            return False
+
+    def get_neighbours(self, item: Any) -> set:
+        """Return a set of the neighbours of the given item.
+
+        Raise a ValueError if item does not appear as a vertex in this graph.
+        """
+        i = self.index_of(item)
+        return {self._names[j] for j in self._targets[self._offsets[i]:self._offsets[i + 1]]}
+
+    def degree(self, item: Any) -> int:
+        """Return the degree of the vertex corresponding to the given item.
+
+        Raise a ValueError if item does not appear as a vertex in this graph.
+        """
+        i = self.index_of(item)
+        return self._offsets[i + 1] - self._offsets[i]
+
+    def connected(self, item1: Any, item2: Any) -> bool:
+        """Return whether item1 and item2 are connected vertices in this graph.
+
+        Return False if item1 or item2 do not appear as vertices in this graph.
+        The component of every vertex is labelled once, so each query after the first is a constant-time lookup.
+
+        >>> g = Graph()
+        >>> for i in range(4):
+        ...     g.add_vertex(i)
+        >>> g.add_edge(0, 1, 1)
+        >>> g.add_edge(1, 2, 1)
+        >>> compact = g.freeze()
+        >>> compact.connected(0, 2)
+        True
+        >>> compact.connected(0, 3)
+        False
+        """
+        if item1 in self._index and item2 in self._index:
+            components = self._label_components()
+            return components[self._index[item1]] == components[self._index[item2]]
+        else:
+            return False
+
+    def comp_path(self, path: list) -> float:
+        """
+        compute the length of path stored in list, order matter
+        raise ValueError if any of nearby vertices are not adjacent
+        >>> g = Graph()
+        >>> for i in range(0, 4):
+        ...     g.add_vertex(i)
+        >>> g.add_edge(0, 1, 1)
+        >>> g.add_edge(1, 2, 2)
+        >>> g.add_edge(1, 3, 3)
+        >>> g.add_edge(2, 3, 1)
+        >>> g.freeze().comp_path([0, 1, 2, 3, 1])
+        7.0
+        """
+        length_so_far = 0.0
+        for i in range(len(path) - 1):
+            weight = self._edge_weight(self.index_of(path[i]), self.index_of(path[i + 1]))
+            if weight is None:
+                raise ValueError
+            length_so_far += weight
+        return length_so_far
+
+    def search(self, source: int, targets: Optional[set[int]] = None,
+               first_only: bool = False) -> tuple[array, array]:
+        """
+        run dijkstra on indices from source, return a tuple of arrays (distances, previous_indices)
+        unreached indices have distance inf, and the previous index of source and unreached indices is -1
+        if targets is given, the search stops as soon as every reachable index in targets is settled (or the first
+        one, if first_only is True), and every index that was not settled by then is reported as unreached
+        """
+        n = len(self._names)
+        offsets, adjacent_targets, weights = self._offsets, self._targets, self._weights
+        distances = array('d', [float('inf')]) * n
+        previous_indices = array('i', [-1]) * n
+        settled = bytearray(n)
+        if targets is None:
+            remaining = None
+        elif first_only:
+            remaining = set(targets)
+        else:
+            remaining = set(targets) - {source}
+        distances[source] = 0.0
+        heap = [(0.0, source)]
+
+        while heap:
+            distance, current = heapq.heappop(heap)
+            if settled[current]:
+                continue
+            settled[current] = 1
+            if remaining is not None:
+                if first_only:
+                    if current in remaining:
+                        remaining.clear()
+                else:
+                    remaining.discard(current)
+                if not remaining:
+                    # every tentative index that is not settled still has an entry in the heap
+                    for _, frontier in heap:
+                        if not settled[frontier]:
+                            distances[frontier] = float('inf')
+                            previous_indices[frontier] = -1
+                    break
+            for position in range(offsets[current], offsets[current + 1]):
+                neighbour = adjacent_targets[position]
+                new_distance = distance + weights[position]
+                if not settled[neighbour] and new_distance < distances[neighbour]:
+                    distances[neighbour] = new_distance
+                    previous_indices[neighbour] = current
+                    heapq.heappush(heap, (new_distance, neighbour))
+
+        return distances, previous_indices
+
+    def shortest_path_tree(self, start: Any, targets: Optional[list[Any]] = None) -> tuple[dict, dict]:
+        """
+        same as Graph.shortest_path_tree, but searching the CSR arrays
+        """
+        if start not in self._index:
+            raise ValueError("Start vertex not found in graph.")
+        target_indices = None if targets is None else {self._index[t] for t in targets if t in self._index}
+        distances, previous_indices = self.search(self._index[start], target_indices)
+        reached = [i for i in range(len(self._names)) if distances[i] != float('inf')]
+        names = self._names
+        return ({names[i]: distances[i] for i in reached},
+                {names[i]: (names[previous_indices[i]] if previous_indices[i] != -1 else None) for i in reached})
+
+    def dijkstra(self, start: Any, targets: Optional[list[Any]] = None) -> dict:
+        """
+        same as Graph.dijkstra, but searching the CSR arrays
+        >>> g = Graph()
+        >>> for item in ['A', 'B', 'C', 'D']:
+        ...     g.add_vertex(item)
+        >>> g.add_edge('A', 'B', 2)
+        >>> g.add_edge('B', 'C', 1)
+        >>> g.add_edge('A', 'C', 5)
+        >>> g.freeze().dijkstra('A')
+        {'A': ['A'], 'B': ['A', 'B'], 'C': ['A', 'B', 'C'], 'D': None}
+        """
+        if start not in self._index:
+            raise ValueError("Start vertex not found in graph.")
+        target_indices = None if targets is None else {self._index[t] for t in targets if t in self._index}
+        distances, previous_indices = self.search(self._index[start], target_indices)
+        destinations = self._names if targets is None else targets
+        paths = {}
+        for destination in destinations:
+            i = self._index.get(destination)
+            if i is None or distances[i] == float('inf'):
+                paths[destination] = None
+            else:
+                paths[destination] = self.expand(previous_indices, i)
+        return paths
+
+    def shortest_path(self, start: Any, end: Any) -> Optional[list]:
+        """
+        same as Graph.shortest_path, but searching the CSR arrays
+        >>> g = Graph()
+        >>> for item in ['A', 'B', 'C']:
+        ...     g.add_vertex(item)
+        >>> g.add_edge('A', 'B', 2)
+        >>> g.add_edge('B', 'C', 1)
+        >>> g.add_edge('A', 'C', 5)
+        >>> g.freeze().shortest_path('A', 'C')
+        ['A', 'B', 'C']
+        """
+        source = self.index_of(start)
+        destination = self.index_of(end)
+        distances, previous_indices = self.search(source, {destination})
+        if distances[destination] == float('inf'):
+            return None
+        return self.expand(previous_indices, destination)
+
+    def nearest_target(self, start: Any, targets: list[Any]) -> Optional[tuple[Any, float, list]]:
+        """
+        same as Graph.nearest_target, but searching the CSR arrays
+        >>> g = Graph()
+        >>> for item in ['A', 'B', 'C', 'D']:
+        ...     g.add_vertex(item)
+        >>> g.add_edge('A', 'B', 2)
+        >>> g.add_edge('B', 'C', 1)
+        >>> g.add_edge('A', 'D', 5)
+        >>> g.freeze().nearest_target('A', ['C', 'D'])
+        ('C', 3.0, ['A', 'B', 'C'])
+        """
+        source = self.index_of(start)
+        target_indices = {self._index[t] for t in targets if t in self._index}
+        if not target_indices:
+            return None
+        distances, previous_indices = self.search(source, target_indices, True)
+        reached = [i for i in target_indices if distances[i] != float('inf')]
+        if not reached:
+            return None
+        # only one target is settled when the search stops early
+        nearest = reached[0]
+        return self._names[nearest], distances[nearest], self.expand(previous_indices, nearest)
+
+    def greedy_dijkstra(self, start: Any, targets: list[Any], oracle: Any = None) -> list:
+        """
+        same as Graph.greedy_dijkstra, but searching the CSR arrays
+        """
+        return _greedy_tour(self, start, targets, oracle)
+
+    def expand(self, previous_indices: array, destination: int) -> list:
+        """
+        follow previous_indices back from the index destination, return the path of items leading to it
+        """
+        path = []
+        current = destination
+        while current != -1:
+            path.append(self._names[current])
+            current = previous_indices[current]
+        path.reverse()
+        return path
+
+    def _edge_weight(self, i: int, j: int) -> Optional[float]:
+        """Return the weight of the edge between indices i and j, or None if they are not adjacent."""
+        for position in range(self._offsets[i], self._offsets[i + 1]):
+            if self._targets[position] == j:
+                return self._weights[position]
+        return None
+
+    def _label_components(self) -> array:
+        """Return the connected component label of every index, computing them on first use."""
+        if self._components is None:
+            n = len(self._names)
+            components = array('i', [-1]) * n
+            for root in range(n):
+                if components[root] != -1:
+                    continue
+                components[root] = root
+                stack = [root]
+                while stack:
+                    current = stack.pop()
+                    for j in self._targets[self._offsets[current]:self._offsets[current + 1]]:
+                        if components[j] == -1:
+                            components[j] = root
+                            stack.append(j)
+            self._components = components
+        return self._components
+
+
+def haversine(coordinates1: tuple[float, float], coordinates2: tuple[float, float]) -> float:
+    """
+    return the great-circle distance in metres between two (latitude, longitude) pairs in degrees
+    >>> round(haversine((43.6629, -79.3957), (43.6629, -79.3957)))
+    0
+    >>> round(haversine((0.0, 0.0), (1.0, 0.0)))
+    111195
+    """
+    lat1, lng1 = math.radians(coordinates1[0]), math.radians(coordinates1[1])
+    lat2, lng2 = math.radians(coordinates2[0]), math.radians(coordinates2[1])
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(h)))
+
+
+def _greedy_tour(graph: Graph | CompactGraph, start: Any, targets: list[Any], oracle: Any) -> list:
+    """
+    the nearest-neighbour tour behind Graph.greedy_dijkstra and CompactGraph.greedy_dijkstra
+    targets that cannot be reached are skipped
+    """
+    visited = set()
+    current = start
+    path = [current]
+    visited.add(current)
+
+    while not all(t in visited for t in targets):
+        unvisited = [t for t in targets if t not in visited]
+        if oracle is not None:
+            # Look up the nearest unvisited target, only its path is rebuilt
+            min_target = min(unvisited, key=lambda t: oracle.distance(current, t))
+            min_path = oracle.path(current, min_target)
+        else:
+            # Search the graph until the first unvisited target is settled
+            nearest = graph.nearest_target(current, unvisited)
+            min_target, min_path = (None, None) if nearest is None else (nearest[0], nearest[2])
+
+        if min_target is None or min_path is None:
+            break  # no reachable targets
+
+        # Add the new path, excluding current since it's already in path
+        path += min_path[1:]
+        visited.add(min_target)
+        current = min_target
+
+    return path
+
+
+def _cycle_items(vertices: dict[Any, _Vertex]) -> set:
+    """
+    return the set of items that are in a cycle, found with an iterative bridge search:
+    an item is in a cycle exactly when one of its edges is not a bridge
+    """
+    discovery = {}
+    low = {}
+    on_cycle = set()
+    for root in vertices:
+        if root in discovery:
+            continue
+        discovery[root] = low[root] = len(discovery)
+        # every frame is (item, parent item, iterator over the neighbours of item)
+        stack = [(root, None, iter(vertices[root].neighbours))]
+        while stack:
+            item, parent, neighbours = stack[-1]
+            advanced = False
+            for neighbour in neighbours:
+                child = neighbour.item
+                if child == parent:
+                    continue
+                if child in discovery:
+                    # a back edge, which closes a cycle
+                    low[item] = min(low[item], discovery[child])
+                else:
+                    discovery[child] = low[child] = len(discovery)
+                    stack.append((child, item, iter(vertices[child].neighbours)))
+                    advanced = True
+                    break
+            if not advanced:
+                stack.pop()
+                if parent is not None:
+                    low[parent] = min(low[parent], low[item])
+                    if low[item] <= discovery[parent]:
+                        # the edge between parent and item is not a bridge
+                        on_cycle.add(item)
+                        on_cycle.add(parent)
+    # the endpoints of a back edge need no extra step: the tree edges on the cycle it closes are not bridges
+    return on_cycle
+
+
+def _build_path(previous_nodes: dict, destination: Any) -> list:
+    """
+    follow previous_nodes back from destination, return the path from the start of the search to destination
+    Precondition:
+    - destination in previous_nodes
+    """
+    path = []
+    current = destination
+    while current is not None:
+        path.append(current)
+        current = previous_nodes[current]
+    path.reverse()
+    return path
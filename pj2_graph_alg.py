@@ -1,15 +1,39 @@
 """
     this is the file that use to implement the algorithm related to graph
 """
-from typing import Any
+from __future__ import annotations
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Any, Callable, Iterable, Iterator, Optional
+import multiprocessing
+import os
+import time
 import pj2_graph
+from pj2_distance_matrix import DistanceMatrix
 
+# largest number of destinations (besides start) that held_karp_method solves exactly
+HELD_KARP_MAX_TARGETS = 15
+# seconds held_karp_method may spend on its table before falling back to greedy_dijkstra_method1
+HELD_KARP_TIME_BUDGET = 2.0
+# largest number of improving moves local_search_method applies to one tour
+LOCAL_SEARCH_MAX_ITERATIONS = 1000
+# seconds local_search_method may spend improving one tour
+LOCAL_SEARCH_TIME_BUDGET = 0.2
+# build_metric_closure only starts a process pool for at least this many sources on a graph with at least this
+# many vertices, smaller closures are built faster in this process than a pool can start
+PARALLEL_MIN_SOURCES = 8
+PARALLEL_MIN_VERTICES = 20000
+# fewest itineraries for which solve_batch starts a process pool
+BATCH_MIN_ITINERARIES = 16
 
-def greedy_dijkstra_method1(graph: pj2_graph.Graph, start: Any, destination: list[Any]) -> list:
+
+def greedy_dijkstra_method1(graph: pj2_graph.Graph, start: Any, destination: list[Any], oracle: Any = None) -> list:
     """
     method 1 as describe in pj2_graph
+    oracle is an optional precomputed distance oracle, see pj2_graph.Graph.greedy_dijkstra
     """
-    return graph.greedy_dijkstra(start, destination)
+    return graph.greedy_dijkstra(start, destination, oracle)
 
 # method 2
 #
@@ -46,3 +70,408 @@ def greedy_dijkstra_method2(graph: pj2_graph.Graph, start: Any, destination: lis
         path.append(next_point.item)
         start_point_vertex = simp_comp_graph.get_Vertex(next_point.item)
     return path
+
+
+# method 3
+"""
+desecription:
+    try every order of the destinations, but only keep the best way to reach each (visited set, last destination)
+exact steps:
+    1. compute the shortest distance between every two destinations (the metric closure)
+    2. fill a table best[visited][last] with the shortest path that starts at start, visits exactly the
+       destinations in visited and ends at last (Held-Karp dynamic programming over bitmasks)
+    3. follow the table back from the best full set to get the order, and expand every leg to the real path
+"""
+
+
+def held_karp_method(graph: pj2_graph.Graph, start: Any, destination: list[Any], oracle: Any = None,
+                     max_targets: int = HELD_KARP_MAX_TARGETS, time_budget: float = HELD_KARP_TIME_BUDGET) -> list:
+    """
+    return the shortest path that starts at start and visits every reachable destination, as method 1 does
+    if there are more than max_targets destinations (other than start), or the table takes longer than
+    time_budget seconds, the result of greedy_dijkstra_method1 is returned instead
+    >>> g = pj2_graph.Graph()
+    >>> for item in ['S', 'A', 'B', 'C']:
+    ...     g.add_vertex(item)
+    >>> g.add_edge('S', 'A', 2)
+    >>> g.add_edge('S', 'B', 1)
+    >>> g.add_edge('B', 'C', 2)
+    >>> greedy = greedy_dijkstra_method1(g, 'S', ['S', 'A', 'B', 'C'])
+    >>> greedy, g.comp_path(greedy)
+    (['S', 'B', 'C', 'B', 'S', 'A'], 8)
+    >>> exact = held_karp_method(g, 'S', ['S', 'A', 'B', 'C'])
+    >>> exact, g.comp_path(exact)
+    (['S', 'A', 'S', 'B', 'C'], 7)
+    >>> held_karp_method(g, 'S', ['S', 'A', 'B', 'C'], max_targets=2) == greedy
+    True
+    """
+    deadline = time.perf_counter() + time_budget
+    # decide before building the closure, whose k searches an over-limit request would only waste
+    if len(set(destination) - {start}) > max_targets:
+        return greedy_dijkstra_method1(graph, start, destination, oracle)
+    items, matrix, legs = _metric_closure(graph, start, destination, oracle)
+    order = _held_karp_order(matrix, deadline)
+    if order is None:
+        return greedy_dijkstra_method1(graph, start, destination, oracle)
+
+    path = [start]
+    for i in range(len(order) - 1):
+        path += legs(order[i], order[i + 1])[1:]
+    return path
+
+
+# method 4
+"""
+desecription:
+    start from the greedy order of method 1, then keep changing the order while it gets shorter
+exact steps:
+    1. compute the shortest distance between every two destinations (the metric closure)
+    2. build the nearest-neighbour order over it, as method 1 does
+    3. 2-opt: reverse a part of the order; Or-opt: move a run of 1 to 3 destinations somewhere else
+       apply any move that makes the path shorter, the change is computed from the 3 or 4 distances it touches
+    4. stop when no move helps (a local optimum), or after the iteration or time limit, and expand every leg
+"""
+
+
+def local_search_method(graph: pj2_graph.Graph, start: Any, destination: list[Any], oracle: Any = None,
+                        max_iterations: int = LOCAL_SEARCH_MAX_ITERATIONS,
+                        time_budget: float = LOCAL_SEARCH_TIME_BUDGET) -> list:
+    """
+    return a path that starts at start and visits every reachable destination, never longer than the one of the
+    nearest-neighbour order, improved with 2-opt and Or-opt moves
+    >>> g = pj2_graph.Graph()
+    >>> for item in ['S', 'A', 'B', 'C']:
+    ...     g.add_vertex(item)
+    >>> g.add_edge('S', 'A', 2)
+    >>> g.add_edge('S', 'B', 1)
+    >>> g.add_edge('B', 'C', 2)
+    >>> improved = local_search_method(g, 'S', ['S', 'A', 'B', 'C'])
+    >>> improved, g.comp_path(improved)
+    (['S', 'A', 'S', 'B', 'C'], 7)
+    """
+    deadline = time.perf_counter() + time_budget
+    _, matrix, legs = _metric_closure(graph, start, destination, oracle)
+    order = _improve_order(_greedy_order(matrix), matrix, max_iterations, deadline)
+
+    path = [start]
+    for i in range(len(order) - 1):
+        path += legs(order[i], order[i + 1])[1:]
+    return path
+
+
+def _greedy_order(matrix: list) -> list[int]:
+    """
+    return the nearest-neighbour order of the indices of matrix, starting at index 0
+    """
+    order = [0]
+    unvisited = set(range(1, len(matrix)))
+    while unvisited:
+        distances = matrix[order[-1]]
+        nearest = min(unvisited, key=lambda j: (distances[j], j))
+        unvisited.remove(nearest)
+        order.append(nearest)
+    return order
+
+
+def _improve_order(order: list[int], matrix: list, max_iterations: int, deadline: float) -> list[int]:
+    """
+    return order after applying improving 2-opt and Or-opt moves until none is left, max_iterations moves were
+    applied, or the deadline (a time.perf_counter value) has passed; order[0] never moves
+
+    Preconditions:
+        - matrix is symmetric, so reversing a part of the order does not change the length inside it
+    """
+    order = list(order)
+    n = len(order)
+
+    def dist(a: int, b: int) -> float:
+        """Return the distance between positions a and b of order, 0 if b is past the end."""
+        return matrix[order[a]][order[b]] if b < n else 0.0
+
+    iterations = 0
+    improved = True
+    while improved and iterations < max_iterations and time.perf_counter() < deadline:
+        improved = False
+        # 2-opt: reverse order[i:j + 1]
+        for i in range(1, n - 1):
+            for j in range(i + 1, n):
+                delta = (matrix[order[i - 1]][order[j]] + (matrix[order[i]][order[j + 1]] if j + 1 < n else 0.0)
+                         - dist(i - 1, i) - dist(j, j + 1))
+                if delta < -1e-9:
+                    order[i:j + 1] = reversed(order[i:j + 1])
+                    improved = True
+                    iterations += 1
+        # Or-opt: move the run order[i:i + length] between positions p and p + 1
+        for length in (1, 2, 3):
+            for i in range(1, n - length + 1):
+                end = i + length - 1
+                removed = dist(i - 1, end + 1) - dist(i - 1, i) - dist(end, end + 1) if end + 1 < n \
+                    else -dist(i - 1, i)
+                for p in range(n):
+                    if i - 1 <= p <= end:
+                        continue
+                    inserted = matrix[order[p]][order[i]] + dist(end, p + 1) - dist(p, p + 1) \
+                        if p + 1 < n else matrix[order[p]][order[i]]
+                    if removed + inserted < -1e-9:
+                        run = order[i:end + 1]
+                        rest = order[:i] + order[end + 1:]
+                        position = p + 1 if p < i else p + 1 - length
+                        order = rest[:position] + run + rest[position:]
+                        improved = True
+                        iterations += 1
+                        break
+        if iterations >= max_iterations:
+            break
+    return order
+
+
+class MetricClosure:
+    """The shortest distance between every two of k items of a graph, as a dense k x k matrix.
+
+    Only the predecessor arrays of the k searches are kept, a leg is rebuilt from them when it is asked for.
+
+    Instance Attributes:
+        - items: the k items, in the order of the rows and columns of matrix
+        - matrix: matrix[i][j] is the shortest distance from items[i] to items[j] (inf if unreachable)
+
+    Representation Invariants:
+        - len(self.matrix) == len(self.items) == len(self._previous)
+        - all(len(row) == len(self.items) for row in self.matrix)
+    """
+    # Private Instance Attributes:
+    #     - _graph: the snapshot that was searched
+    #     - _previous: _previous[i] is the predecessor array of the search from items[i]
+    items: list
+    matrix: list[array]
+    _graph: pj2_graph.CompactGraph
+    _previous: list[array]
+
+    def __init__(self, graph: pj2_graph.CompactGraph, items: list, matrix: list[array],
+                 previous: list[array]) -> None:
+        """Initialize a closure from the searches of a snapshot."""
+        self.items = items
+        self.matrix = matrix
+        self._graph = graph
+        self._previous = previous
+
+    def distance(self, i: int, j: int) -> float:
+        """Return the shortest distance from items[i] to items[j]."""
+        return self.matrix[i][j]
+
+    def leg(self, i: int, j: int) -> Optional[list]:
+        """Return the shortest path from items[i] to items[j], None if it does not exist."""
+        if self.matrix[i][j] == float('inf'):
+            return None
+        return self._graph.expand(self._previous[i], self._graph.index_of(self.items[j]))
+
+
+def build_metric_closure(graph: pj2_graph.Graph | pj2_graph.CompactGraph, items: list[Any],
+                         processes: Optional[int] = None,
+                         executor: Optional[ProcessPoolExecutor] = None) -> MetricClosure:
+    """
+    run one search from each of items, stopping once all other items are settled, and return their MetricClosure
+    the searches run across a pool of processes once there are at least PARALLEL_MIN_SOURCES items and
+    PARALLEL_MIN_VERTICES vertices: executor if given (see batch_executor), otherwise a pool of processes workers
+    (os.cpu_count() if None) started for this closure only
+    raise ValueError if any of items is not in graph
+
+    Preconditions:
+        - executor, if given, was returned by batch_executor for graph
+
+    >>> g = pj2_graph.Graph()
+    >>> for item in ['A', 'B', 'C', 'D']:
+    ...     g.add_vertex(item)
+    >>> g.add_edge('A', 'B', 2)
+    >>> g.add_edge('B', 'C', 1)
+    >>> g.add_edge('C', 'D', 4)
+    >>> closure = build_metric_closure(g, ['A', 'C', 'D'])
+    >>> [list(row) for row in closure.matrix]
+    [[0.0, 3.0, 7.0], [3.0, 0.0, 4.0], [7.0, 4.0, 0.0]]
+    >>> closure.leg(0, 2)
+    ['A', 'B', 'C', 'D']
+    """
+    compact = graph.freeze() if isinstance(graph, pj2_graph.Graph) else graph
+    indices = [compact.index_of(item) for item in items]
+    processes = (os.cpu_count() or 1) if processes is None else processes
+    if len(indices) < PARALLEL_MIN_SOURCES or len(compact) < PARALLEL_MIN_VERTICES or \
+            (executor is None and processes <= 1):
+        rows = [_closure_row(compact, source, indices) for source in indices]
+    elif executor is not None:
+        rows = list(executor.map(_closure_worker_row, indices, repeat(indices)))
+    else:
+        with batch_executor(compact, processes=min(processes, len(indices))) as executor:
+            rows = list(executor.map(_closure_worker_row, indices, repeat(indices)))
+    return MetricClosure(compact, list(items), [row[0] for row in rows], [row[1] for row in rows])
+
+
+# the snapshot searched by the current worker process of build_metric_closure or solve_batch
+_worker_graph: Optional[pj2_graph.CompactGraph] = None
+# the distance oracle used by the current worker process of solve_batch
+_worker_oracle: Optional[DistanceMatrix] = None
+
+
+def _closure_worker_row(source: int, indices: list[int]) -> tuple[array, array]:
+    """Return the closure row of source, searched on the snapshot of this worker process."""
+    return _closure_row(_worker_graph, source, indices)
+
+
+def _closure_row(compact: pj2_graph.CompactGraph, source: int, indices: list[int]) -> tuple[array, array]:
+    """Return the distances from source to every index of indices, and the predecessor array of the search."""
+    distances, previous_indices = compact.search(source, set(indices))
+    return array('d', [distances[i] for i in indices]), previous_indices
+
+
+def _metric_closure(graph: pj2_graph.Graph, start: Any, destination: list[Any], oracle: Any) -> tuple:
+    """
+    return a tuple (items, matrix, legs) for start and the destinations that can be reached from it
+    items[0] is start, matrix[i][j] is the shortest distance from items[i] to items[j],
+    and legs(i, j) returns the shortest path from items[i] to items[j]
+    """
+    items = [start]
+    for d in destination:
+        if d not in items:
+            items.append(d)
+    if oracle is not None:
+        items = [item for item in items if oracle.distance(start, item) != float('inf')]
+        matrix = [array('d', [oracle.distance(a, b) for b in items]) for a in items]
+        return items, matrix, lambda i, j: oracle.path(items[i], items[j])
+
+    closure = build_metric_closure(graph, items)
+    reachable = [i for i in range(len(items)) if closure.matrix[0][i] != float('inf')]
+    matrix = [array('d', [closure.matrix[i][j] for j in reachable]) for i in reachable]
+    return [items[i] for i in reachable], matrix, lambda i, j: closure.leg(reachable[i], reachable[j])
+
+
+def _held_karp_order(matrix: list, deadline: float) -> Any:
+    """
+    return the order of indices (starting at 0) of the shortest path through every index of matrix,
+    or None if the deadline (a time.perf_counter value) passes first
+    """
+    m = len(matrix) - 1
+    if m <= 1:
+        return list(range(m + 1))
+    full = (1 << m) - 1
+    inf = float('inf')
+    # best[mask * m + j]: shortest path from index 0 through the destinations in mask, ending at destination j
+    # (destination j is index j + 1 of matrix, and bit j of mask)
+    best = array('d', [inf]) * ((full + 1) * m)
+    # a short (not a signed char) holds every destination index, however high max_targets is set
+    parent = array('h', [-1]) * ((full + 1) * m)
+    for j in range(m):
+        best[(1 << j) * m + j] = matrix[0][j + 1]
+
+    for mask in range(1, full + 1):
+        if mask & 255 == 0 and time.perf_counter() > deadline:
+            return None
+        row = mask * m
+        for j in range(m):
+            current = best[row + j]
+            if current == inf:
+                continue
+            distances = matrix[j + 1]
+            for k in range(m):
+                if mask & (1 << k):
+                    continue
+                position = (mask | (1 << k)) * m + k
+                candidate = current + distances[k + 1]
+                if candidate < best[position]:
+                    best[position] = candidate
+                    parent[position] = j
+
+    # follow the parents back from the best last destination
+    last = min(range(m), key=lambda j: best[full * m + j])
+    order = []
+    mask = full
+    while last != -1:
+        order.append(last + 1)
+        previous = parent[mask * m + last]
+        mask ^= 1 << last
+        last = previous
+    order.append(0)
+    order.reverse()
+    return order
+
+
+def solve_batch(graph: pj2_graph.Graph | pj2_graph.CompactGraph, itineraries: Iterable[list[Any]],
+                method: Callable = greedy_dijkstra_method1, processes: Optional[int] = None,
+                matrix_path: Optional[str] = None, chunksize: int = 8, oracle: Any = None,
+                executor: Optional[ProcessPoolExecutor] = None) -> Iterator[list]:
+    """
+    yield the path that method (one of the methods above) finds for every itinerary, in the order of itineraries
+    the first node of every itinerary is its start, as in the web application
+    the itineraries are spread over a pool of processes once there are at least BATCH_MIN_ITINERARIES of them:
+    executor if given (see batch_executor), otherwise a pool of processes workers (os.cpu_count() if None)
+    started for this batch only; every worker memory-maps the distance matrix at matrix_path (if given) as its
+    oracle, so all workers share the same matrix pages
+    fewer itineraries are solved in this process with oracle, or with the distance matrix at matrix_path if oracle
+    is None
+    results are yielded as soon as they are ready and every earlier one has been yielded
+
+    Preconditions:
+        - every itinerary is a non-empty list of items of graph
+        - method is defined at the top level of a module, so worker processes can find it
+        - executor, if given, was returned by batch_executor for graph and matrix_path
+
+    >>> g = pj2_graph.Graph()
+    >>> for item in ['A', 'B', 'C']:
+    ...     g.add_vertex(item)
+    >>> g.add_edge('A', 'B', 2)
+    >>> g.add_edge('B', 'C', 1)
+    >>> list(solve_batch(g, [['A', 'C'], ['C', 'A', 'B']]))
+    [['A', 'B', 'C'], ['C', 'B', 'A']]
+    """
+    compact = graph.freeze() if isinstance(graph, pj2_graph.Graph) else graph
+    itineraries = list(itineraries)
+    processes = (os.cpu_count() or 1) if processes is None else processes
+    if len(itineraries) < BATCH_MIN_ITINERARIES or (executor is None and processes <= 1):
+        loaded = DistanceMatrix.load(matrix_path) if oracle is None and matrix_path is not None else None
+        try:
+            for nodes in itineraries:
+                yield method(compact, nodes[0], nodes, oracle if loaded is None else loaded)
+        finally:
+            if loaded is not None:
+                loaded.close()
+        return
+
+    if executor is not None:
+        yield from executor.map(_batch_worker_solve, repeat(method), itineraries, chunksize=chunksize)
+        return
+    with batch_executor(compact, matrix_path, processes) as executor:
+        yield from executor.map(_batch_worker_solve, repeat(method), itineraries, chunksize=chunksize)
+
+
+def batch_executor(graph: pj2_graph.Graph | pj2_graph.CompactGraph, matrix_path: Optional[str] = None,
+                   processes: Optional[int] = None) -> ProcessPoolExecutor:
+    """
+    return a pool of processes (os.cpu_count() if processes is None) that solve_batch and build_metric_closure
+    can search graph with, to be kept for as long as graph does not change
+    the workers are started on first use and receive the frozen snapshot of graph once; they are spawned instead
+    of forked, since forking a process that runs other threads (such as a web server) may copy a lock that one of
+    them holds
+
+    >>> g = pj2_graph.Graph()
+    >>> for item in ['A', 'B', 'C']:
+    ...     g.add_vertex(item)
+    >>> g.add_edge('A', 'B', 2)
+    >>> g.add_edge('B', 'C', 1)
+    >>> with batch_executor(g, processes=2) as executor:
+    ...     paths = list(solve_batch(g, [['A', 'C']] * BATCH_MIN_ITINERARIES, executor=executor))
+    >>> paths == [['A', 'B', 'C']] * BATCH_MIN_ITINERARIES
+    True
+    """
+    compact = graph.freeze() if isinstance(graph, pj2_graph.Graph) else graph
+    return ProcessPoolExecutor(max_workers=processes or os.cpu_count() or 1,
+                               mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_batch_worker, initargs=(compact, matrix_path))
+
+
+def _init_batch_worker(compact: pj2_graph.CompactGraph, matrix_path: Optional[str]) -> None:
+    """Keep the snapshot and oracle that every itinerary of this worker process is solved with."""
+    global _worker_graph, _worker_oracle
+    _worker_graph = compact
+    _worker_oracle = DistanceMatrix.load(matrix_path) if matrix_path is not None else None
+
+
+def _batch_worker_solve(method: Callable, nodes: list[Any]) -> list:
+    """Return the path of one itinerary found by method, solved in this worker process."""
+    return method(_worker_graph, nodes[0], nodes, _worker_oracle)
@@ -0,0 +1,156 @@
+"""
+    a compact binary snapshot of the graph in graph_output.json, loaded straight into a CompactGraph
+
+parsing graph_output.json and inserting every edge (twice) into a Graph is most of the cold start of the web
+application, the snapshot instead stores the frozen graph as arrays that are read back with one copy each
+
+file layout (little endian):
+    - 8 bytes magic, 4 bytes number of vertices n, 4 bytes number of adjacency entries m (every edge twice),
+      4 bytes length of the name table
+    - the name table, a utf-8 json list of the n items, padded with spaces to a multiple of 8 bytes
+    - 2 * n float64 coordinates, (latitude, longitude) of every item (nan if it has none)
+    - m float64 edge weights
+    - n + 1 int32 offsets and m int32 edge targets, the CSR adjacency arrays of CompactGraph
+"""
+from __future__ import annotations
+from array import array
+from typing import Any, Callable, Optional
+import json
+import math
+import os
+import struct
+import sys
+import time
+
+import pj2_graph
+from json_to_class import load_graph_from_json, stream_graph_from_json
+from pj2_files import atomic_write, build_if_outdated, little_endian, padded, read_array
+
+MAGIC = b'PJ2GS\x00\x00\x01'
+_HEADER = struct.Struct('<8sIII')
+
+
+def save_snapshot(graph: pj2_graph.Graph | pj2_graph.CompactGraph, markers: dict[Any, list[float]],
+                  file_path: str) -> None:
+    """
+    write graph and the coordinates of its items in markers to file_path, replacing the old file only once the
+    new one is complete
+    """
+    compact = graph.freeze()
+    offsets, targets, weights = compact.to_arrays()
+    names = [compact.item_at(i) for i in range(len(compact))]
+    coordinates = array('d')
+    for item in names:
+        coordinates.extend(markers.get(item, (math.nan, math.nan)))
+    table = json.dumps(names, ensure_ascii=False).encode('utf-8')
+    with atomic_write(file_path) as f:
+        f.write(_HEADER.pack(MAGIC, len(names), len(targets), len(table)))
+        f.write(table.ljust(padded(len(table)), b' '))
+        for values in (coordinates, array('d', weights), array('i', offsets), array('i', targets)):
+            f.write(little_endian(values))
+
+
+def load_snapshot(file_path: str) -> tuple[pj2_graph.CompactGraph, dict[Any, list[float]]]:
+    """
+    return the (graph, markers) stored at file_path, in the same form as load_graph_from_json but with the graph
+    already frozen; raise ValueError if the file is not a graph snapshot or is shorter or longer than its header
+    says
+
+    >>> import os, tempfile
+    >>> g = pj2_graph.Graph()
+    >>> g.add_vertex('A', (43.66, -79.40))
+    >>> g.add_vertex('B', (43.67, -79.39))
+    >>> g.add_vertex('C')
+    >>> g.add_edge('A', 'B', 2)
+    >>> g.add_edge('B', 'C', 1.5)
+    >>> snapshot_path = os.path.join(tempfile.mkdtemp(), 'graph.bin')
+    >>> save_snapshot(g, {'A': [43.66, -79.40], 'B': [43.67, -79.39]}, snapshot_path)
+    >>> compact, markers = load_snapshot(snapshot_path)
+    >>> compact.dijkstra('A') == g.dijkstra('A')
+    True
+    >>> markers
+    {'A': [43.66, -79.4], 'B': [43.67, -79.39]}
+    >>> os.truncate(snapshot_path, os.path.getsize(snapshot_path) - 4)
+    >>> load_snapshot(snapshot_path)  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    ValueError: ...graph.bin is not a complete graph snapshot file
+    """
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    if len(data) < _HEADER.size or data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{file_path} is not a graph snapshot file")
+    _, n, m, table_length = _HEADER.unpack_from(data, 0)
+    # coordinates and weights are 8 bytes each, offsets and targets 4
+    if len(data) != _HEADER.size + padded(table_length) + 8 * (2 * n + m) + 4 * (n + 1 + m):
+        raise ValueError(f"{file_path} is not a complete graph snapshot file")
+    view = memoryview(data)
+    offset = _HEADER.size
+    names = json.loads(bytes(view[offset:offset + table_length]).decode('utf-8'))
+    offset += padded(table_length)
+    coordinates, offset = read_array(view, offset, 'd', 2 * n)
+    weights, offset = read_array(view, offset, 'd', m)
+    offsets, offset = read_array(view, offset, 'i', n + 1)
+    targets, _ = read_array(view, offset, 'i', m)
+
+    markers = {}
+    for i, item in enumerate(names):
+        if not math.isnan(coordinates[2 * i]):
+            markers[item] = [coordinates[2 * i], coordinates[2 * i + 1]]
+    return pj2_graph.CompactGraph(names, offsets, targets, weights), markers
+
+
+def compile_snapshot(json_path: str, snapshot_path: str, progress: Optional[Callable[[dict], None]] = None) -> None:
+    """
+    compile the graph stored in json_path into a snapshot at snapshot_path
+    the file is read one node at a time, and progress is passed on to stream_graph_from_json
+    """
+    graph, markers = stream_graph_from_json(json_path, progress)
+    save_snapshot(graph, markers, snapshot_path)
+
+
+def load_or_compile(json_path: str, snapshot_path: str) -> tuple[pj2_graph.CompactGraph, dict[Any, list[float]]]:
+    """
+    load the snapshot at snapshot_path, compiling it from json_path first if the file is missing or older than
+    json_path (once, however many processes find it so at the same time)
+    """
+    build_if_outdated(snapshot_path, json_path, lambda: compile_snapshot(json_path, snapshot_path))
+    return load_snapshot(snapshot_path)
+
+
+def benchmark_cold_start(json_path: str, snapshot_path: str, repeat: int = 5) -> dict[str, float]:
+    """
+    return the best time in seconds, over repeat runs, to get a frozen graph and its markers from json_path and
+    from snapshot_path, and how many times faster the snapshot is
+    """
+    def best_time(load: Any) -> float:
+        """Return the shortest of repeat runs of load."""
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            load()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    def load_json() -> None:
+        """Load the graph the way the web application did before snapshots."""
+        graph, _ = load_graph_from_json(json_path)
+        graph.freeze()
+
+    json_seconds = best_time(load_json)
+    snapshot_seconds = best_time(lambda: load_snapshot(snapshot_path))
+    return {'json_seconds': json_seconds, 'snapshot_seconds': snapshot_seconds,
+            'speedup': json_seconds / snapshot_seconds if snapshot_seconds else math.inf,
+            'json_bytes': os.path.getsize(json_path), 'snapshot_bytes': os.path.getsize(snapshot_path)}
+
+
+if __name__ == '__main__':
+    # usage: python pj2_graph_snapshot.py [graph_output.json] [graph_snapshot.bin]
+    source = sys.argv[1] if len(sys.argv) > 1 else "graph_output.json"
+    target = sys.argv[2] if len(sys.argv) > 2 else "graph_snapshot.bin"
+    compile_snapshot(source, target, lambda stats: print(f"read {stats['nodes']} nodes and {stats['edges']} edges "
+                                                        f"({stats['nodes_per_second']:.0f} nodes per second)"))
+    result = benchmark_cold_start(source, target)
+    print(f"wrote {target}: {result['snapshot_bytes']} bytes ({result['json_bytes']} bytes of json)")
+    print(f"cold start from json: {result['json_seconds'] * 1000:.2f} ms, "
+          f"from the snapshot: {result['snapshot_seconds'] * 1000:.2f} ms ({result['speedup']:.1f}x faster)")
@@ -0,0 +1,182 @@
+"""
+    a uniform grid index over the coordinates of the vertices of a graph, for viewport and nearest vertex queries
+
+every item is bucketed by the cell of a grid of roughly square cells (cell_metres on a side) that contains it, so a
+query only looks at the items of the cells it overlaps, however many items there are elsewhere
+"""
+from __future__ import annotations
+from typing import Any, Iterable, Optional
+import math
+
+from pj2_graph import EARTH_RADIUS, haversine
+
+# default side of a grid cell, in metres
+DEFAULT_CELL_METRES = 150.0
+
+
+class SpatialIndex:
+    """A grid index of items by their (latitude, longitude), built once and then only read.
+
+    Instance Attributes:
+        - cell_metres: the side of a grid cell, in metres
+
+    Representation Invariants:
+        - sum(len(items) for items in self._cells.values()) == len(self._positions)
+
+    >>> index = SpatialIndex({'A': (43.6600, -79.3950), 'B': (43.6610, -79.3950), 'C': (43.6700, -79.3800)})
+    >>> sorted(index.within(43.659, -79.396, 43.662, -79.394))
+    ['A', 'B']
+    >>> [(item, round(distance)) for item, distance in index.nearest(43.6601, -79.3950, k=2)]
+    [('A', 11), ('B', 100)]
+    >>> [item for item, _ in index.near(43.6601, -79.3950, 50)]
+    ['A']
+    """
+    cell_metres: float
+    # Private Instance Attributes:
+    #     - _positions: maps item to its (latitude, longitude)
+    #     - _cells: maps (row, column) of every non-empty cell to the items in it
+    #     - _lat_step, _lng_step: the height and width of a cell in degrees
+    #     - _middle: the latitude in radians at which cells are square
+    #     - _widest: the largest absolute latitude of an item, in degrees
+    #     - _bounds: the (lowest row, lowest column, highest row, highest column) of the non-empty cells
+    _positions: dict[Any, tuple[float, float]]
+    _cells: dict[tuple[int, int], list]
+    _lat_step: float
+    _lng_step: float
+    _middle: float
+    _widest: float
+    _bounds: Optional[tuple[int, int, int, int]]
+
+    def __init__(self, positions: dict[Any, Iterable[float]], cell_metres: float = DEFAULT_CELL_METRES) -> None:
+        """Initialize an index of items, given as a dict mapping item to (latitude, longitude)."""
+        self.cell_metres = cell_metres
+        self._positions = {item: (float(lat), float(lng)) for item, (lat, lng) in positions.items()}
+        latitudes = [lat for lat, _ in self._positions.values()] or [0.0]
+        # cells are square at the middle latitude of the items, and narrower towards the poles
+        self._middle = math.radians((min(latitudes) + max(latitudes)) / 2)
+        self._widest = max(abs(lat) for lat in latitudes)
+        self._lat_step = math.degrees(cell_metres / EARTH_RADIUS)
+        self._lng_step = self._lat_step / max(math.cos(self._middle), 1e-6)
+        self._cells = {}
+        for item, (lat, lng) in self._positions.items():
+            self._cells.setdefault(self._cell_of(lat, lng), []).append(item)
+        if self._cells:
+            rows = [row for row, _ in self._cells]
+            columns = [column for _, column in self._cells]
+            self._bounds = (min(rows), min(columns), max(rows), max(columns))
+        else:
+            self._bounds = None
+
+    def __len__(self) -> int:
+        """Return the number of items in this index."""
+        return len(self._positions)
+
+    def __contains__(self, item: Any) -> bool:
+        """Return whether item is in this index."""
+        return item in self._positions
+
+    def position(self, item: Any) -> tuple[float, float]:
+        """
+        return the (latitude, longitude) of item, raise ValueError if item not in index
+        """
+        if item not in self._positions:
+            raise ValueError
+        return self._positions[item]
+
+    def within(self, south: float, west: float, north: float, east: float, limit: Optional[int] = None) -> list:
+        """
+        return the items inside the box with the given bounds in degrees (at most limit of them, if given)
+        only the cells overlapping the box are visited, or every non-empty cell if that is fewer
+        """
+        if self._bounds is None or south > north or west > east:
+            return []
+        low_row, low_column = self._cell_of(south, west)
+        high_row, high_column = self._cell_of(north, east)
+        low_row, low_column = max(low_row, self._bounds[0]), max(low_column, self._bounds[1])
+        high_row, high_column = min(high_row, self._bounds[2]), min(high_column, self._bounds[3])
+        if low_row > high_row or low_column > high_column:
+            return []
+        if (high_row - low_row + 1) * (high_column - low_column + 1) <= len(self._cells):
+            cells = (self._cells.get((row, column), ())
+                     for row in range(low_row, high_row + 1) for column in range(low_column, high_column + 1))
+        else:
+            cells = (items for (row, column), items in self._cells.items()
+                     if low_row <= row <= high_row and low_column <= column <= high_column)
+        found = []
+        for items in cells:
+            for item in items:
+                lat, lng = self._positions[item]
+                if south <= lat <= north and west <= lng <= east:
+                    found.append(item)
+                    if limit is not None and len(found) >= limit:
+                        return found
+        return found
+
+    def near(self, lat: float, lng: float, metres: float) -> list[tuple[Any, float]]:
+        """
+        return the (item, distance in metres) of every item at most metres from (lat, lng), nearest first
+        """
+        lat_margin = math.degrees(metres / EARTH_RADIUS)
+        lng_margin = lat_margin / max(math.cos(math.radians(min(abs(lat) + lat_margin, 89.9))), 1e-6)
+        found = []
+        for item in self.within(lat - lat_margin, lng - lng_margin, lat + lat_margin, lng + lng_margin):
+            distance = haversine((lat, lng), self._positions[item])
+            if distance <= metres:
+                found.append((item, distance))
+        found.sort(key=lambda pair: pair[1])
+        return found
+
+    def nearest(self, lat: float, lng: float, k: int = 1, exclude: Iterable = ()) -> list[tuple[Any, float]]:
+        """
+        return the (item, distance in metres) of the k items closest to (lat, lng), nearest first, skipping the
+        items in exclude
+        the rings of cells around (lat, lng) are searched outwards until no closer item can be in the next ring
+        """
+        if self._bounds is None or k <= 0:
+            return []
+        excluded = set(exclude)
+        row, column = self._cell_of(lat, lng)
+        # every further ring of cells adds at least this many metres, less than cell_metres where cells are narrower
+        widest = math.radians(min(max(self._widest, abs(lat)), 89.9))
+        ring_metres = self.cell_metres * min(1.0, math.cos(widest) / max(math.cos(self._middle), 1e-6))
+        # the number of rings after which every non-empty cell has been searched
+        last_ring = max(abs(row - self._bounds[0]), abs(row - self._bounds[2]),
+                        abs(column - self._bounds[1]), abs(column - self._bounds[3]))
+        found = []
+        ring = 0
+        while ring <= last_ring:
+            if (2 * ring + 1) ** 2 > 4 * len(self._cells):
+                # the rings would visit more cells than there are non-empty ones, so visit every item instead
+                found = [(haversine((lat, lng), position), item) for item, position in self._positions.items()
+                         if item not in excluded]
+                break
+            for cell in _ring_cells(row, column, ring):
+                for item in self._cells.get(cell, ()):
+                    if item not in excluded:
+                        found.append((haversine((lat, lng), self._positions[item]), item))
+            # every item not yet searched is more than ring cells away, so further than ring * ring_metres
+            if len(found) >= k:
+                found.sort(key=lambda pair: pair[0])
+                if found[k - 1][0] <= ring * ring_metres:
+                    break
+            ring += 1
+        found.sort(key=lambda pair: pair[0])
+        return [(item, distance) for distance, item in found[:k]]
+
+    def _cell_of(self, lat: float, lng: float) -> tuple[int, int]:
+        """Return the (row, column) of the cell containing (lat, lng)."""
+        return math.floor(lat / self._lat_step), math.floor(lng / self._lng_step)
+
+
+def _ring_cells(row: int, column: int, ring: int) -> list[tuple[int, int]]:
+    """Return the cells exactly ring cells away from (row, column) in rows or columns (the cell itself for 0)."""
+    if ring == 0:
+        return [(row, column)]
+    cells = []
+    for c in range(column - ring, column + ring + 1):
+        cells.append((row - ring, c))
+        cells.append((row + ring, c))
+    for r in range(row - ring + 1, row + ring):
+        cells.append((r, column - ring))
+        cells.append((r, column + ring))
+    return cells
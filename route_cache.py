@@ -0,0 +1,110 @@
+"""
+    a cache of computed routes, so that an itinerary requested again is answered without running a solver
+"""
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+import threading
+import time
+
+
+def route_key(start: Any, targets: list[Any], solver: str, version: int) -> tuple:
+    """
+    return the canonical cache key of an itinerary: the order in which the targets were selected does not matter
+    >>> route_key('A', ['A', 'B', 'C'], 'greedy', 3) == route_key('A', ['C', 'B', 'A', 'B'], 'greedy', 3)
+    True
+    >>> route_key('A', ['A', 'B'], 'greedy', 3) == route_key('B', ['A', 'B'], 'greedy', 3)
+    False
+    """
+    return start, frozenset(targets), solver, version
+
+
+class RouteCache:
+    """A thread-safe cache of route results bounded by a number of entries and a time to live.
+
+    When full, the least recently used entry is evicted. An entry older than ttl seconds is never returned.
+
+    Instance Attributes:
+        - max_entries: the largest number of routes kept
+        - ttl: the number of seconds a route is kept
+        - hits, misses, evictions, expirations: counters since the cache was created
+
+    Representation Invariants:
+        - len(self._entries) <= self.max_entries
+    """
+    # Private Instance Attributes:
+    #     - _entries: maps key to (time stored, value), least recently used first
+    #     - _clock: returns the current time in seconds
+    #     - _lock: guards every other attribute
+    max_entries: int
+    ttl: float
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int
+    _entries: OrderedDict
+    _clock: Callable[[], float]
+    _lock: threading.Lock
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 600.0,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        """Initialize an empty cache."""
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[Any]:
+        """
+        return the value stored for key, None if there is none or it has expired
+        >>> now = [0.0]
+        >>> cache = RouteCache(max_entries=2, ttl=10, clock=lambda: now[0])
+        >>> cache.put('a', 1)
+        >>> cache.put('b', 2)
+        >>> cache.get('a')
+        1
+        >>> cache.put('c', 3)
+        >>> cache.get('b') is None
+        True
+        >>> now[0] = 11.0
+        >>> cache.get('a') is None
+        True
+        >>> stats = cache.stats()
+        >>> stats['hits'], stats['misses'], stats['evictions'], stats['expirations']
+        (1, 2, 1, 1)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._clock() - entry[0] > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: tuple, value: Any) -> None:
+        """Store value for key, evicting the least recently used entry if the cache is full."""
+        with self._lock:
+            self._entries.pop(key, None)
+            while len(self._entries) >= self.max_entries > 0:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            if self.max_entries > 0:
+                self._entries[key] = (self._clock(), value)
+
+    def stats(self) -> dict[str, float]:
+        """Return the counters, the number of entries and the hit rate of this cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'expirations': self.expirations, 'entries': len(self._entries),
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
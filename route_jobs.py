@@ -0,0 +1,275 @@
+"""
+    a bounded queue of route jobs, so that slow solvers run in the background instead of blocking a request
+
+a job is submitted with a deadline and polled by its id; a job that is still queued when its deadline passes is
+never started, and the result of a job that finishes after its deadline, or was cancelled while running, is
+dropped (a running solver cannot be interrupted, so slow solvers should also bound their own running time, and
+a cancelled job keeps counting against the limit of unfinished jobs until its solver returns)
+"""
+from __future__ import annotations
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+import threading
+import time
+import uuid
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+EXPIRED = "expired"
+FINISHED = {DONE, FAILED, CANCELLED, EXPIRED}
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue already holds as many unfinished jobs as it allows."""
+
+    def __str__(self) -> str:
+        """Return a string representation of this error."""
+        return 'too many route jobs are waiting, try again later'
+
+
+class RouteJob:
+    """One itinerary waiting for, or computed by, a RouteJobQueue.
+
+    Instance Attributes:
+        - id: the id the job is polled with
+        - nodes, solver: the itinerary
+        - deadline: the time.monotonic() value after which the result is no longer wanted
+        - status: one of QUEUED, RUNNING, DONE, FAILED, CANCELLED and EXPIRED
+        - result: the result of the itinerary once status is DONE
+        - error: the description of the failure once status is FAILED
+    """
+    id: str
+    nodes: list
+    solver: str
+    deadline: float
+    status: str
+    result: Optional[dict]
+    error: Optional[str]
+    future: Optional[Future]
+
+    def __init__(self, nodes: list, solver: str, deadline: float) -> None:
+        """Initialize a queued job."""
+        self.id = uuid.uuid4().hex
+        self.nodes = nodes
+        self.solver = solver
+        self.deadline = deadline
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.future = None
+
+    def to_dict(self) -> dict:
+        """Return the state of this job as a JSON-serializable dict."""
+        state = {"job": self.id, "status": self.status}
+        if self.status == DONE:
+            state["result"] = self.result
+        elif self.status == FAILED:
+            state["error"] = self.error
+        return state
+
+
+class RouteJobQueue:
+    """A pool of worker threads computing route jobs, with at most max_pending unfinished jobs at a time.
+
+    Instance Attributes:
+        - max_pending: the largest number of queued and running jobs; more submissions raise JobQueueFull
+        - default_timeout: the number of seconds a job may take, from submission, unless given otherwise
+        - max_finished: the number of finished jobs kept for polling, the oldest are forgotten first
+
+    >>> release = threading.Event()
+    >>> def run(nodes: list, solver: str) -> dict:
+    ...     release.wait()
+    ...     return {"path": nodes}
+    >>> queue = RouteJobQueue(run, workers=1, max_pending=2)
+    >>> first = queue.submit(['A', 'B'], 'greedy')
+    >>> second = queue.submit(['B', 'C'], 'greedy')
+    >>> queue.submit(['C', 'D'], 'greedy')
+    Traceback (most recent call last):
+    ...
+    route_jobs.JobQueueFull: too many route jobs are waiting, try again later
+    >>> queue.cancel(second)
+    True
+    >>> release.set()
+    >>> queue.wait(first)['result']
+    {'path': ['A', 'B']}
+    >>> queue.status(second)['status']
+    'cancelled'
+    >>> queue.status('unknown') is None
+    True
+    >>> queue.shutdown()
+
+    A running job that is cancelled keeps its worker, so it is counted until its solver returns:
+
+    >>> started, release = threading.Event(), threading.Event()
+    >>> def run(nodes: list, solver: str) -> dict:
+    ...     started.set()
+    ...     release.wait()
+    ...     return {"path": nodes}
+    >>> queue = RouteJobQueue(run, workers=1, max_pending=1)
+    >>> first = queue.submit(['A', 'B'], 'greedy')
+    >>> _ = started.wait()
+    >>> queue.cancel(first)
+    True
+    >>> queue.submit(['B', 'C'], 'greedy')
+    Traceback (most recent call last):
+    ...
+    route_jobs.JobQueueFull: too many route jobs are waiting, try again later
+    >>> release.set()
+    >>> queue.wait(first)['status']
+    'cancelled'
+    >>> queue.wait(queue.submit(['B', 'C'], 'greedy'))['result']
+    {'path': ['B', 'C']}
+    >>> queue.shutdown()
+    """
+    max_pending: int
+    default_timeout: float
+    max_finished: int
+    # Private Instance Attributes:
+    #     - _run: computes the result of an itinerary (nodes, solver)
+    #     - _executor: the worker threads
+    #     - _jobs: maps job id to every job that is unfinished or among the last max_finished finished ones
+    #     - _finished: the ids of the finished jobs in _jobs, oldest first
+    #     - _pending: the number of jobs that are queued, or still running even if they were cancelled
+    #     - _lock: guards _jobs, _finished, _pending and the status of every job
+    _run: Callable[[list, str], dict]
+    _executor: ThreadPoolExecutor
+    _jobs: dict[str, RouteJob]
+    _finished: deque[str]
+    _pending: int
+    _lock: threading.Lock
+
+    def __init__(self, run: Callable[[list, str], dict], workers: int = 2, max_pending: int = 32,
+                 default_timeout: float = 30.0, max_finished: int = 1024) -> None:
+        """Initialize an empty queue whose jobs are computed by run on workers threads."""
+        self.max_pending = max_pending
+        self.default_timeout = default_timeout
+        self.max_finished = max_finished
+        self._run = run
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="route-job")
+        self._jobs = {}
+        self._finished = deque()
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, nodes: list, solver: str, timeout: Optional[float] = None) -> str:
+        """
+        queue an itinerary and return the id of its job, raise JobQueueFull if too many jobs are unfinished
+        """
+        timeout = self.default_timeout if timeout is None else timeout
+        job = RouteJob(nodes, solver, time.monotonic() + timeout)
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise JobQueueFull
+            self._pending += 1
+            self._jobs[job.id] = job
+            job.future = self._executor.submit(self._work, job)
+        return job.id
+
+    def status(self, job_id: str) -> Optional[dict]:
+        """Return the state of the job with the given id, None if there is no such job (any more)."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.status == QUEUED and time.monotonic() > job.deadline:
+                self._drop(job, EXPIRED)
+            return None if job is None else job.to_dict()
+
+    def itinerary(self, job_id: str) -> Optional[tuple[list, str]]:
+        """Return the nodes and solver of the job with the given id, None if there is no such job (any more)."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return None if job is None else (job.nodes, job.solver)
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        cancel the job with the given id, return whether it was still unfinished
+        a queued job never starts, and the result of a running one is dropped
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in FINISHED:
+                return False
+            if job.status == QUEUED:
+                self._drop(job, CANCELLED)
+            else:
+                self._finish(job, CANCELLED)  # its worker releases its place once the solver returns
+            return True
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[dict]:
+        """Block until the job with the given id has left the queue or run, then return its state."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None and job.future is not None and not job.future.cancelled():
+            job.future.result(timeout)
+        return self.status(job_id)
+
+    def shutdown(self) -> None:
+        """Stop the worker threads once the running jobs are finished, cancelling every queued job."""
+        with self._lock:
+            for job in list(self._jobs.values()):
+                if job.status == QUEUED:
+                    self._drop(job, CANCELLED)
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _work(self, job: RouteJob) -> None:
+        """
+        compute job on the current worker thread, unless it was cancelled or expired while queued, then release
+        its place among the unfinished jobs
+        """
+        try:
+            self._compute(job)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _compute(self, job: RouteJob) -> None:
+        """Compute job, unless it was cancelled or expired while queued, and give it its final status."""
+        with self._lock:
+            if job.status != QUEUED:
+                return
+            if time.monotonic() > job.deadline:
+                self._finish(job, EXPIRED)
+                return
+            job.status = RUNNING
+        try:
+            result = self._run(job.nodes, job.solver)
+        except Exception as error:  # the failure is reported to whoever polls the job
+            with self._lock:
+                if job.status == RUNNING:
+                    job.error = str(error)
+                    self._finish(job, FAILED)
+            return
+        with self._lock:
+            if job.status != RUNNING:
+                return  # cancelled while running
+            if time.monotonic() > job.deadline:
+                self._finish(job, EXPIRED)
+            else:
+                job.result = result
+                self._finish(job, DONE)
+
+    def _drop(self, job: RouteJob, status: str) -> None:
+        """Give a queued job its final status, releasing its place at once if no worker will pick it up.
+
+        Preconditions:
+            - self._lock is held
+            - job.status == QUEUED
+        """
+        if job.future is not None and job.future.cancel():
+            self._pending -= 1  # otherwise a worker has it already, and releases it once it sees the status
+        self._finish(job, status)
+
+    def _finish(self, job: RouteJob, status: str) -> None:
+        """Give an unfinished job its final status and forget the oldest finished jobs beyond max_finished.
+
+        Preconditions:
+            - self._lock is held
+            - job.status not in FINISHED
+        """
+        job.status = status
+        self._finished.append(job.id)
+        while len(self._finished) > self.max_finished:
+            del self._jobs[self._finished.popleft()]
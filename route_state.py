@@ -0,0 +1,210 @@
+"""
+    per-session route state for the web application
+
+every browser keeps its own itinerary (the selected nodes and the solver) in a cookie, and any thread of any
+server process can turn it back into the route, because routes are computed from an immutable graph snapshot
+"""
+from __future__ import annotations
+from typing import Any, Callable, Optional
+import json
+
+import pj2_graph
+from metrics import Metrics
+from route_cache import RouteCache, route_key
+
+# name of the cookie holding the itinerary of a session
+SESSION_COOKIE = "itinerary"
+
+
+def encode_itinerary(nodes: list[str], solver: str) -> str:
+    """
+    return the cookie value holding an itinerary
+    >>> decode_itinerary(encode_itinerary(['A', "Queen's Park"], 'greedy'))
+    (['A', "Queen's Park"], 'greedy')
+    """
+    return json.dumps({"nodes": nodes, "solver": solver})
+
+
+def decode_itinerary(value: Optional[str]) -> Optional[tuple[list[str], str]]:
+    """
+    return the (nodes, solver) stored in a cookie value, None if there is no valid itinerary in it
+    >>> decode_itinerary(None) is None
+    True
+    >>> decode_itinerary('not json') is None
+    True
+    >>> decode_itinerary('{"nodes": "A", "solver": "greedy"}') is None
+    True
+    """
+    if not value:
+        return None
+    try:
+        data = json.loads(value)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    nodes, solver = data.get("nodes"), data.get("solver")
+    if not _is_itinerary(nodes, solver):
+        return None
+    return nodes, solver
+
+
+class RoutePlanner:
+    """Computes routes for itineraries, and may be shared by any number of threads.
+
+    Nothing a request can reach is mutated except the route cache, which has its own lock: the graph is a frozen
+    CompactGraph and the distance oracle is read-only.
+
+    Instance Attributes:
+        - snapshot: the immutable graph every route is computed on
+        - oracle: the read-only distance oracle passed to the solvers (such as a DistanceMatrix), or None
+        - solvers: maps solver name to a function (graph, start, destination, oracle) -> path
+        - cache: the cache of computed routes
+        - version: the version of the graph the snapshot was taken from, part of every cache key
+        - metrics: records the time spent in every stage of planning, in the histograms 'route_stage_seconds'
+          (labelled by stage) and 'route_solver_seconds' (labelled by solver)
+    """
+    snapshot: pj2_graph.CompactGraph
+    oracle: Any
+    solvers: dict[str, Callable]
+    cache: RouteCache
+    version: int
+    metrics: Metrics
+
+    def __init__(self, graph: pj2_graph.Graph | pj2_graph.CompactGraph, oracle: Any, solvers: dict[str, Callable],
+                 cache: RouteCache, metrics: Optional[Metrics] = None) -> None:
+        """Initialize a planner over a snapshot of graph taken now (a CompactGraph is its own snapshot)."""
+        self.snapshot = graph.freeze()
+        self.oracle = oracle
+        self.solvers = solvers
+        self.cache = cache
+        self.version = graph.version
+        self.metrics = Metrics() if metrics is None else metrics
+
+    def plan(self, nodes: list[str], solver: str) -> dict:
+        """
+        return the result of an itinerary: a dict with its path, duration in minutes and a status message
+        a route is computed only if it is not in the cache; invalid itineraries get a warning message
+
+        >>> import threading
+        >>> from pj2_graph_alg import greedy_dijkstra_method1
+        >>> g = pj2_graph.Graph()
+        >>> for i in range(30):
+        ...     g.add_vertex(str(i))
+        >>> for i in range(29):
+        ...     g.add_edge(str(i), str(i + 1), 60 + i)
+        >>> planner = RoutePlanner(g, None, {'greedy': greedy_dijkstra_method1}, RouteCache())
+        >>> planner.plan(['0', '2'], 'greedy')['path']
+        ['0', '1', '2']
+        >>> planner.plan(['0'], 'greedy')['message']
+        '❗ Select at least 2 nodes.'
+
+        Many threads planning different itineraries at once each get their own route:
+        >>> itineraries = [[str(i), str((7 * i) % 30), str((11 * i + 3) % 30)] for i in range(30)]
+        >>> expected = [RoutePlanner(g, None, {'greedy': greedy_dijkstra_method1}, RouteCache()).plan(n, 'greedy')
+        ...             for n in itineraries]
+        >>> results = [None] * len(itineraries)
+        >>> def worker(k: int) -> None:
+        ...     for _ in range(20):
+        ...         results[k] = planner.plan(itineraries[k], 'greedy')
+        >>> threads = [threading.Thread(target=worker, args=(k,)) for k in range(len(itineraries))]
+        >>> for t in threads:
+        ...     t.start()
+        >>> for t in threads:
+        ...     t.join()
+        >>> results == expected
+        True
+        """
+        warning = self.check(nodes, solver)
+        if warning is not None:
+            return warning
+        return self.solve(nodes, solver)
+
+    def solve(self, nodes: list[str], solver: str) -> dict:
+        """
+        return the result of an itinerary that passed check, computing its route only if it is not in the cache
+        """
+        key = route_key(nodes[0], nodes, solver, self.version)
+        with self.metrics.timer('route_stage_seconds', stage='cache'):
+            route = self.cache.get(key)
+        if route is None:
+            # Compute path starting from the first node with the chosen solver
+            with self.metrics.timer('route_solver_seconds', solver=solver):
+                path = self.solvers[solver](self.snapshot, nodes[0], nodes, self.oracle)
+            route = self.result(path)
+            self.cache.put(key, route)
+        return route
+
+    def cached(self, nodes: Any, solver: Any) -> Optional[dict]:
+        """
+        return the result of an itinerary if its route is in the cache, None otherwise
+        no solver is ever run, so any itinerary a client sends (such as one read from its cookie) may be looked up
+
+        >>> from pj2_graph_alg import greedy_dijkstra_method1
+        >>> g = pj2_graph.Graph()
+        >>> for item in ['A', 'B']:
+        ...     g.add_vertex(item)
+        >>> g.add_edge('A', 'B', 60)
+        >>> planner = RoutePlanner(g, None, {'greedy': greedy_dijkstra_method1}, RouteCache())
+        >>> planner.cached(['A', 'B'], 'greedy') is None
+        True
+        >>> planner.plan(['A', 'B'], 'greedy') == planner.cached(['A', 'B'], 'greedy')
+        True
+        """
+        if not _is_itinerary(nodes, solver) or not nodes:
+            return None
+        with self.metrics.timer('route_stage_seconds', stage='cache'):
+            return self.cache.get(route_key(nodes[0], nodes, solver, self.version))
+
+    def check(self, nodes: Any, solver: Any) -> Optional[dict]:
+        """
+        return the result with a warning message for an itinerary that cannot be planned, None if it can
+        nodes and solver may be any values decoded from a request
+
+        >>> g = pj2_graph.Graph()
+        >>> for item in ['A', 'B', 'C']:
+        ...     g.add_vertex(item)
+        >>> g.add_edge('A', 'B', 60)
+        >>> planner = RoutePlanner(g, None, {'greedy': None}, RouteCache())
+        >>> planner.check(['A', 'B'], 'greedy') is None
+        True
+        >>> planner.check([['A'], 'B'], 'greedy')['message']
+        '❗ Select the nodes as a list of names.'
+        >>> planner.check(['A', 'B'], [])['message']
+        '❗ Unknown solver [].'
+        >>> planner.check(['A', 'C'], 'greedy')['message']
+        '❗ Cannot reach C from A.'
+        """
+        with self.metrics.timer('route_stage_seconds', stage='check'):
+            if not isinstance(nodes, list) or not all(isinstance(n, str) for n in nodes):
+                return _warning([], "❗ Select the nodes as a list of names.")
+            if not isinstance(solver, str) or solver not in self.solvers:
+                return _warning(nodes, f"❗ Unknown solver {solver}.")
+            if len(nodes) < 2:
+                return _warning(nodes, "❗ Select at least 2 nodes.")
+
+            start = nodes[0]
+            # Reject selections that cannot all be reached from the start; each check is a component lookup
+            unreachable = [n for n in nodes if not self.snapshot.connected(start, n)]
+            if unreachable:
+                return _warning(nodes, f"❗ Cannot reach {', '.join(unreachable)} from {start}.")
+            return None
+
+    def result(self, path: list[str]) -> dict:
+        """
+        return the result of a computed path: the path, its duration in minutes and a status message
+        """
+        # Calculate total duration of the route; assume the distance is given in seconds and convert to minutes
+        with self.metrics.timer('route_stage_seconds', stage='comp_path'):
+            distance = round(self.snapshot.comp_path(path) / 60, 2)
+        return {"path": path, "distance": distance, "message": "✅ Path calculated successfully."}
+
+
+def _is_itinerary(nodes: Any, solver: Any) -> bool:
+    """Return whether nodes is a list of node names and solver is a solver name (not whether they exist)."""
+    return isinstance(nodes, list) and all(isinstance(n, str) for n in nodes) and isinstance(solver, str)
+
+
+def _warning(nodes: list[str], message: str) -> dict:
+    """Return the result of an itinerary that could not be planned."""
+    return {"path": nodes, "distance": 0, "message": message}